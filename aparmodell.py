@@ -0,0 +1,419 @@
+"""
+Kompakte datatyper for APAR-data: Operatør, bomstasjonsfelt og prisintervaller
+
+APAR-dumpen tolkes én gang. Hvert kjørefelt blir et Felt-objekt (__slots__), mens hele prishistorikken
+for alle felt, kjøretøyklasser og pristyper ligger i sammenhengende numpy-arrays i en Pristabell.
+Oppslag på gjeldende pris gjøres dermed vektorisert for alle felt samtidig, i stedet for å bygge opp
+lister med dictionaries for hvert felt og hvert kall
+
+Eksempel:
+    apar = aparmodell.AparData.fraApar( apardump )
+    takst = apar.priser.aktivePriser( 'smallVehicle', 'priceNoRebate' )   # En verdi per felt, NaN = ingen pris
+
+Takster lagres og sammenlignes som heltall øre (int32) med eksplisitt maske for manglende verdi, se tilOre.
+Da blir likhet eksakt, og flyttallsstøy gir ikke falske takstavvik (og unødvendige skriveoperasjoner til NVDB).
+I tabellene fra tolkapar ligger APAR-takstene også som nullable Int32-kolonner i øre (nvdbtakster, nøkkel 'ore',
+samme navn som i takstmatrisen), slik at manglende takst og 0 kr holdes fra hverandre helt fram til endringssettet
+
+Tidspunkt (activeFrom, activeTo) lagres som norsk lokal tid uten tidssone, samme tid som datetime.now() og
+passeringstidspunktene i prismotor, se lokaltid
+"""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Felt i APAR som kan ha prisinformasjon på formen { 'priceNoRebate' : [ { 'price', 'activeFrom', 'activeTo' } ], ... }
+kjoretoyklasser = [ 'smallVehicle', 'smallDiesel', 'smallPetrol', 'smallChargableHybrid', 'smallElectric',
+                    'smallHydrogen', 'euro5', 'euro6', 'largeElectric', 'largeHydrogen',
+                    'largeHybrid', 'largePetrol', 'monthlyMaximumCharges' ]
+
+# Kobling mellom APAR-priser og takst-egenskapene på NVDB bomstasjon (objekttype 45). Kolonnenavnene for 
+# APAR-taksten er de som brukes i rapportene fra tolkapar.py (kroner), og øre-kolonnene som brukes til sammenligning
+nvdbtakster = [ { 'klasse' : 'smallVehicle', 'pristype' : 'priceNoRebate',         'apar' : 'APAR takst liten bil',             'nvdb' : 'Takst liten bil',         'id' : 1820, 'ore' : 'APAR smallVehicle priceNoRebate'         },
+                { 'klasse' : 'largePetrol',  'pristype' : 'priceNoRebate',         'apar' : 'APAR takst stor bensinbil',        'nvdb' : 'Takst stor bil',          'id' : 1819, 'ore' : 'APAR largePetrol priceNoRebate'          },
+                { 'klasse' : 'smallVehicle', 'pristype' : 'priceRushHourNoRebate', 'apar' : 'APAR Rustid takst liten bil',      'nvdb' : 'Rushtidstakst liten bil', 'id' : 9410, 'ore' : 'APAR smallVehicle priceRushHourNoRebate' },
+                { 'klasse' : 'largePetrol',  'pristype' : 'priceRushHourNoRebate', 'apar' : 'APAR Rustid takst stor bensinbil', 'nvdb' : 'Rushtidstakst stor bil',  'id' : 9411, 'ore' : 'APAR largePetrol priceRushHourNoRebate'  } ]
+
+# Tidssonen som APAR-tidspunkt med tidssone regnes om til
+tidssone = 'Europe/Oslo'
+
+def lokaltid( verdier ):
+    """
+    Gjør om tidspunkt til norsk lokal tid uten tidssone. Tekst med tidssone (Z, +02:00) regnes om fra UTC,
+    tekst uten tidssone er allerede lokal tid
+
+    ARGUMENTS
+        verdier: Liste, numpy array eller pandas series med ISO 8601-tekst, datetime eller datetime64
+
+    RETURNS
+        numpy array (datetime64[s]), NaT der tidspunktet mangler
+    """
+    verdier = pd.Series( verdier )
+    if pd.api.types.is_datetime64_any_dtype( verdier ):
+        if getattr( verdier.dt, 'tz', None ) is not None:
+            verdier = verdier.dt.tz_convert( tidssone ).dt.tz_localize( None )
+        return verdier.to_numpy( dtype='datetime64[s]' )
+
+    tekst = verdier.astype( object )
+    medSone = tekst.str.contains( r'[T ]\d.*(?:Z|[+-]\d\d(?::?\d\d)?)$', na=False ).to_numpy( dtype=bool )
+    tid = pd.to_datetime( tekst, utc=True, format='ISO8601' )
+    lokal = tid.dt.tz_convert( tidssone ).dt.tz_localize( None ).to_numpy( dtype='datetime64[s]' )
+    return np.where( medSone, lokal, tid.dt.tz_localize( None ).to_numpy( dtype='datetime64[s]' ))
+
+def tilOre( kroner ):
+    """
+    Gjør om takster i kroner (tall, tekst eller None/NaN) til heltall øre
+
+    RETURNS
+        tuple med numpy arrays ( ore, mangler ): ore er int32 (0 der verdien mangler), mangler er boolsk
+    """
+    kr = np.asarray( kroner, dtype=np.float64 )
+    mangler = ~np.isfinite( kr )
+    ore = np.rint( np.where( mangler, 0.0, kr ) * 100 ).astype( np.int32 )
+    return ( ore, mangler )
+
+def tilKroner( ore, mangler=None ):
+    """
+    Gjør om heltall øre til kroner (float64), NaN der mangler er True
+    """
+    kr = np.asarray( ore, dtype=np.float64 ) / 100
+    if mangler is not None:
+        kr[ np.asarray( mangler, dtype=bool ) ] = np.nan
+    return kr
+
+def kronetekst( ore ):
+    """
+    Takst i øre som tekst i kroner, på samme form som str( round( kroner, 2 )), f.eks '23.0' og '23.5'
+    """
+    return str( round( int( ore ) / 100, 2 ))
+
+def matrisekolonne( klasse, pristype ):
+    """
+    Kolonnenavn for en kjøretøyklasse og pristype i takstmatrisen, se Pristabell.prismatrise
+    """
+    return f"APAR {klasse} {pristype}"
+
+def orekolonne( ore, mangler=None ):
+    """
+    Nullable Int32-kolonne (pandas) med takster i øre, <NA> der mangler er True
+    """
+    ore = np.asarray( ore, dtype=np.int32 )
+    mangler = np.zeros( len( ore ), dtype=bool ) if mangler is None else np.asarray( mangler, dtype=bool )
+    return pd.arrays.IntegerArray( np.where( mangler, 0, ore ).astype( np.int32 ), mangler.copy() )
+
+def aparOre( df, takster=None ):
+    """
+    APAR-takstene i df som heltall øre med maske for manglende takst. Bruker øre-kolonnene (nvdbtakster, nøkkel
+    'ore') der de finnes, ellers kronekolonnene
+
+    RETURNS
+        tuple med numpy arrays ( ore, mangler ) med form ( rader, takster )
+    """
+    if takster is None:
+        takster = nvdbtakster
+    if all( t['ore'] in df.columns for t in takster ):
+        kolonner = df[ [ t['ore'] for t in takster ] ].astype( 'Int32' )
+        return ( kolonner.to_numpy( dtype=np.int32, na_value=0 ), kolonner.isna().to_numpy() )
+    return tilOre( df[ [ t['apar'] for t in takster ] ].to_numpy( dtype=float ))
+
+def takstavvik( df, takster=None, kunAparpris=True ):
+    """
+    Sammenligner APAR-takster med NVDB-takster for alle rader og alle takster på én gang, som heltall øre.
+    Manglende takst er ikke det samme som 0: Takst i kun den ene av APAR og NVDB er et avvik, mangler begge er
+    det ikke
+
+    ARGUMENTS
+        df: pandas dataframe med både APAR-kolonnene og NVDB-kolonnene i takster
+
+    KEYWORDS:
+        takster: None (default, dvs nvdbtakster) eller liste med dictionaries på samme form som nvdbtakster
+
+        kunAparpris: True (default) | False. Med True teller kun avvik der APAR har en takst. Hva som skrives
+                     til NVDB avgjøres av endringsavvik
+
+    RETURNS
+        boolsk numpy array ( rader, takster ), True for avvik
+    """
+    if takster is None:
+        takster = nvdbtakster
+    apar, aparMangler = aparOre( df, takster )
+    nvdb, nvdbMangler = tilOre( df[ [ t['nvdb'] for t in takster ] ].to_numpy( dtype=float ))
+    avvik = ( aparMangler != nvdbMangler ) | ( ~aparMangler & ~nvdbMangler & ( apar != nvdb ))
+    if kunAparpris:
+        avvik &= ~aparMangler
+    return avvik
+
+def endringsavvik( df, takster=None ):
+    """
+    Takstavvik som skal skrives til NVDB i endringssettet: Avvik der APAR har en takst over 0 kr. 0 kr i APAR
+    betyr ingen takst (for rushtid: ikke tidsdifferensiert takst) og skrives ikke, slik som før takstene ble øre.
+    Rapportene bruker takstavvik, der 0 kr og manglende takst holdes fra hverandre
+
+    RETURNS
+        tuple med numpy arrays ( skriv, ore, mangler ) med form ( rader, takster ), der ore og mangler er
+        APAR-takstene fra aparOre
+    """
+    if takster is None:
+        takster = nvdbtakster
+    ore, mangler = aparOre( df, takster )
+    skriv = takstavvik( df, takster, kunAparpris=True ) & ~mangler & ( ore > 0 )
+    return ( skriv, ore, mangler )
+
+class Operator:
+    """
+    Bompengeoperatør, med liste over indeksen til sine felt i AparData.felt
+    """
+    __slots__ = ( 'operatorId', 'operatorName', 'felt' )
+
+    def __init__( self, operatorId, operatorName ):
+        self.operatorId = operatorId
+        self.operatorName = operatorName
+        self.felt = []
+
+    def __repr__( self ):
+        return f"Operator({self.operatorId}, {self.operatorName!r}, {len(self.felt)} felt)"
+
+class Felt:
+    """
+    Ett kjørefelt i en bomstasjon (en rad i APAR-dumpen). Prisene ligger i Pristabell, se AparData.priser
+    """
+    __slots__ = ( 'indeks', 'operatorId', 'tollStationKey', 'tollStationCode', 'tollStationName',
+                  'projectNumber', 'projectName', 'tollStationLane', 'tollStationDirection', 'lat', 'lon',
+                  'priceDifferentiationTime', 'rushHour', 'timeRuleType', 'timeRuleDuration', 'timeRuleGroup',
+                  'freeHandicap' )
+
+    def __init__( self, indeks, rad ):
+        self.indeks = indeks
+        for egenskap in Felt.__slots__[1:]:
+            setattr( self, egenskap, rad.get( egenskap ))
+        if self.lat is None:
+            self.lat = _koordinat( rad.get( 'positionY' ))
+        if self.lon is None:
+            self.lon = _koordinat( rad.get( 'positionX' ))
+
+    def __repr__( self ):
+        return f"Felt({self.tollStationKey}, {self.tollStationName!r}, felt={self.tollStationLane})"
+
+def _koordinat( tekst ):
+    if tekst and isinstance( tekst, str ) and len( tekst.strip() ) > 3:
+        return float( tekst )
+    return np.nan
+
+class Pristabell:
+    """
+    Prishistorikk for alle felt i sammenhengende arrays, sortert på felt, klasse, pristype og fra-dato
+
+    Arrays (like lange):
+        felt:     int32,  indeks i AparData.felt
+        klasse:   int16,  indeks i klasser
+        pristype: int16,  indeks i pristyper
+        ore:      int32,  pris i øre
+        fra, til: datetime64[s]
+
+    Prisintervaller uten pris tas ikke med
+    """
+    __slots__ = ( 'felt', 'klasse', 'pristype', 'ore', 'fra', 'til', 'klasser', 'pristyper', 'antallFelt' )
+
+    def __init__( self, felt, klasse, pristype, pris, fra, til, klasser, pristyper, antallFelt ):
+        ore, mangler = tilOre( pris )
+        rekkefolge = np.lexsort( ( fra, pristype, klasse, felt ))
+        rekkefolge = rekkefolge[ ~mangler[rekkefolge] ]
+        self.felt = np.asarray( felt, dtype=np.int32 )[rekkefolge]
+        self.klasse = np.asarray( klasse, dtype=np.int16 )[rekkefolge]
+        self.pristype = np.asarray( pristype, dtype=np.int16 )[rekkefolge]
+        self.ore = ore[rekkefolge]
+        self.fra = np.asarray( fra, dtype='datetime64[s]' )[rekkefolge]
+        self.til = np.asarray( til, dtype='datetime64[s]' )[rekkefolge]
+        self.klasser = list( klasser )
+        self.pristyper = list( pristyper )
+        self.antallFelt = antallFelt
+
+    def __len__( self ):
+        return len( self.ore )
+
+    def _utvalg( self, klasse, pristype ):
+        if klasse not in self.klasser or pristype not in self.pristyper:
+            return np.zeros( len( self ), dtype=bool )
+        return ( self.klasse == self.klasser.index( klasse )) & ( self.pristype == self.pristyper.index( pristype ))
+
+    def _aktive( self, tidspunkt=None, utvalg=None ):
+        """
+        Radnummer for gjeldende prisintervall, ett per ( felt, klasse, pristype ). Der flere intervaller gjelder
+        samtidig brukes det med senest activeFrom, se overlapp
+
+        RETURNS
+            tuple ( radnummer, antall ), antall er hvor mange intervaller som gjaldt for den cellen
+        """
+        if tidspunkt is None:
+            tidspunkt = datetime.now()
+        t = lokaltid( [ tidspunkt ] )[0]
+        aktiv = ( self.fra <= t ) & ( self.til > t )
+        if utvalg is not None:
+            aktiv &= utvalg
+        rad = np.nonzero( aktiv )[0]
+        # Tabellen er sortert på felt, klasse, pristype og fra, dvs siste rad i hver celle har senest activeFrom
+        celle = ( self.felt[rad].astype( np.int64 ) * len( self.klasser ) + self.klasse[rad] ) * len( self.pristyper ) + self.pristype[rad]
+        siste = np.r_[ celle[1:] != celle[:-1], True ] if len( rad ) else np.zeros( 0, dtype=bool )
+        forste = np.r_[ True, celle[1:] != celle[:-1] ] if len( rad ) else np.zeros( 0, dtype=bool )
+        antall = np.diff( np.r_[ np.nonzero( forste )[0], len( rad ) ] )
+        return ( rad[siste], antall )
+
+    def overlapp( self, tidspunkt=None ):
+        """
+        Celler ( felt, klasse, pristype ) med mer enn ett gjeldende prisintervall på tidspunktet
+
+        RETURNS
+            liste med tuple ( felt, klasse, pristype, antall ), klasse og pristype som tekst
+        """
+        rad, antall = self._aktive( tidspunkt )
+        flere = antall > 1
+        return [ ( int( self.felt[ii] ), self.klasser[ self.klasse[ii] ], self.pristyper[ self.pristype[ii] ], int( n ))
+                 for ii, n in zip( rad[flere], antall[flere] ) ]
+
+    def aktivePriser( self, klasse, pristype, tidspunkt=None ):
+        """
+        Gjeldende pris for alle felt for en kjøretøyklasse og pristype
+
+        ARGUMENTS
+            klasse: Kjøretøyklasse, f.eks 'smallVehicle'
+
+            pristype: Pristype, f.eks 'priceNoRebate'
+
+        KEYWORDS:
+            tidspunkt: None (default, dvs nå) eller datetime
+
+        RETURNS
+            numpy array (float64, kroner) med en verdi per felt, NaN der feltet ikke har gjeldende pris. Der flere
+            prisintervaller gjelder samtidig brukes det med senest activeFrom
+        """
+        return tilKroner( *self.aktiveOre( klasse, pristype, tidspunkt ))
+
+    def aktiveOre( self, klasse, pristype, tidspunkt=None ):
+        """
+        Som aktivePriser, men i øre
+
+        RETURNS
+            tuple med numpy arrays ( ore, mangler ), én verdi per felt. ore er int32 (0 der mangler er True)
+        """
+        rad, _ = self._aktive( tidspunkt, utvalg=self._utvalg( klasse, pristype ))
+        ore = np.zeros( self.antallFelt, dtype=np.int32 )
+        mangler = np.ones( self.antallFelt, dtype=bool )
+        ore[ self.felt[rad] ] = self.ore[rad]
+        mangler[ self.felt[rad] ] = False
+        return ( ore, mangler )
+
+    def prismatrise( self, tidspunkt=None ):
+        """
+        Gjeldende pris for alle felt, kjøretøyklasser og pristyper i én operasjon
+
+        KEYWORDS:
+            tidspunkt: None (default, dvs nå) eller datetime
+
+        RETURNS
+            tuple med numpy arrays ( ore, mangler ), begge med form ( antallFelt, len( klasser ), len( pristyper )).
+            ore er int32, mangler er True der det ikke finnes gjeldende pris. Der flere prisintervaller gjelder
+            samtidig brukes det med senest activeFrom, se overlapp
+        """
+        rad, _ = self._aktive( tidspunkt )
+        form = ( self.antallFelt, len( self.klasser ), len( self.pristyper ))
+        celle = np.ravel_multi_index( ( self.felt[rad], self.klasse[rad], self.pristype[rad] ), form )
+        ore = np.zeros( form, dtype=np.int32 )
+        ore.reshape( -1 )[celle] = self.ore[rad]
+        mangler = np.ones( form, dtype=bool )
+        mangler.reshape( -1 )[celle] = False
+        return ( ore, mangler )
+
+    def startdatoer( self, tidspunkt=None ):
+        """
+        Når gjeldende pris startet (activeFrom), for alle felt, kjøretøyklasser og pristyper, se prismatrise
+
+        RETURNS
+            numpy array (datetime64[s]) med form ( antallFelt, len( klasser ), len( pristyper )), NaT der det ikke
+            finnes gjeldende pris
+        """
+        rad, _ = self._aktive( tidspunkt )
+        form = ( self.antallFelt, len( self.klasser ), len( self.pristyper ))
+        fra = np.full( form, np.datetime64( 'NaT' ), dtype='datetime64[s]' )
+        fra[ self.felt[rad], self.klasse[rad], self.pristype[rad] ] = self.fra[rad]
+        return fra
+
+    def intervaller( self, felt, klasse, pristype ):
+        """
+        Prisintervallene for ett felt, klasse og pristype
+
+        RETURNS
+            tuple med arrays ( ore, fra, til ), sortert på fra-dato
+        """
+        start, slutt = np.searchsorted( self.felt, [ felt, felt + 1 ] )
+        utvalg = self._utvalg( klasse, pristype )[start:slutt]
+        return ( self.ore[start:slutt][utvalg], self.fra[start:slutt][utvalg], self.til[start:slutt][utvalg] )
+
+class AparData:
+    """
+    APAR-dumpen tolket til Operator, Felt og Pristabell
+
+    Attributter:
+        operatorer: dictionary { operatorId : Operator }
+        felt:       liste med Felt, i samme rekkefølge som radene i dumpen
+        priser:     Pristabell
+        indeks:     dictionary { tollStationKey : indeks i felt }
+    """
+    __slots__ = ( 'operatorer', 'felt', 'priser', 'indeks' )
+
+    def __init__( self, operatorer, felt, priser ):
+        self.operatorer = operatorer
+        self.felt = felt
+        self.priser = priser
+        self.indeks = { f.tollStationKey : f.indeks for f in felt }
+
+    def __len__( self ):
+        return len( self.felt )
+
+    @classmethod
+    def fraApar( cls, apardump ):
+        """
+        Tolker APAR-data (liste med dictionaries, slik de kommer fra APAR-api'et) én gang
+
+        ARGUMENTS
+            apardump: Liste med dictionaries, f.eks json.load( 'apardump.json' ) eller apardata.to_dict( 'records' )
+
+        RETURNS
+            AparData-objekt
+        """
+        operatorer = {}
+        feltliste = []
+        klasser = []
+        pristyper = []
+        kolFelt, kolKlasse, kolType, kolPris, kolFra, kolTil = [], [], [], [], [], []
+
+        for indeks, rad in enumerate( apardump ):
+            felt = Felt( indeks, rad )
+            feltliste.append( felt )
+            if felt.operatorId not in operatorer:
+                operatorer[felt.operatorId] = Operator( felt.operatorId, rad.get( 'operatorName' ))
+            operatorer[felt.operatorId].felt.append( indeks )
+
+            for klasse in kjoretoyklasser:
+                prisinfo = rad.get( klasse )
+                if not isinstance( prisinfo, dict ):
+                    continue
+                for pristype, prisListe in prisinfo.items():
+                    if not isinstance( prisListe, list ):
+                        continue
+                    if klasse not in klasser:
+                        klasser.append( klasse )
+                    if pristype not in pristyper:
+                        pristyper.append( pristype )
+                    for x in prisListe:
+                        kolFelt.append( indeks )
+                        kolKlasse.append( klasser.index( klasse ))
+                        kolType.append( pristyper.index( pristype ))
+                        kolPris.append( x.get( 'price' ))
+                        kolFra.append( x['activeFrom'] )
+                        kolTil.append( x['activeTo'] )
+
+        priser = Pristabell( kolFelt, kolKlasse, kolType, kolPris,
+                             lokaltid( kolFra ), lokaltid( kolTil ),
+                             klasser, pristyper, len( feltliste ))
+        return cls( operatorer, feltliste, priser )
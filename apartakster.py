@@ -9,6 +9,11 @@ from shapely.geometry import Point
 from shapely import wkt 
 
 import STARTHER
+import publiser
+import httpcache
+import trafikkstyring
+import historikk
+import feltplassering
 # if not [ k for k in sys.path if 'nvdbapi' in k]:
 #     print( "Adding NVDB api library to python search path")
 #     sys.path.append( '/mnt/c/data/leveranser/nvdbapi-V4' )
@@ -20,26 +25,6 @@ with open( 'SECRET.json' ) as f:
 myKey = secret['myAutopassAPARKey']
 url = 'https://apar.autopassops.no/api' 
 
-def hentFeltPunkt( stedfesting ): 
-    """
-    Henter kjørefelt for stedfesting som kommaseparert tekst 
-    """
-    pos, vid = stedfesting.split( '@' )
-    pos = float( pos )
-    
-    r = requests.get( 'https://nvdbapiles.atlas.vegvesen.no/vegnett/veglenkesekvenser/segmentert/' + \
-                    vid  )
-    feltoversikt = ''
-    if r.ok: 
-        mydf = pd.DataFrame( r.json())
-        mydf2 = mydf[ (mydf['startposisjon'] <= pos) & (mydf['sluttposisjon'] > pos) ]
-        assert len( mydf2 ) == 1, "Skal ha kun ett svar på dette filteret"
-        if isinstance( mydf2.iloc[0]['feltoversikt'] , list ): 
-            feltoversikt = ','.join( mydf2.iloc[0]['feltoversikt'] ) 
-    
-    return feltoversikt 
-
-
 if __name__ == '__main__': 
     headers = { 'Accept' : 'application/json', 
             'Authorization': myKey  }
@@ -54,26 +39,42 @@ if __name__ == '__main__':
     # print( "Endret etter:", r2.status_code, r2.text )
     
     # Finner alle NVDB bomstasjoner
-    nvdbBomst = pd.DataFrame( nvdbapiv3.nvdbFagdata(45).to_records() )
+    nvdbBomst = pd.DataFrame( trafikkstyring.nvdb.utfor( lambda : nvdbapiv3.nvdbFagdata(45).to_records(), maalSvartid=False ))
     
     nvdbBomst['stedfest'] = nvdbBomst['relativPosisjon'].astype(str) + '@' + nvdbBomst['veglenkesekvensid'].astype(str)
-    nvdbBomst['tilgjengeligeKjfelt'] = nvdbBomst['stedfest'].apply( hentFeltPunkt )
+    # Kjørefelt fra den felles vegnettcachen, hentet i bolker via trafikkstyring.nvdb 
+    nvdbBomst['tilgjengeligeKjfelt'] = feltplassering.standardcache().feltoversikt( nvdbBomst['veglenkesekvensid'], nvdbBomst['relativPosisjon'] )
         
     # alle operatør ID 
     operatorId = list( nvdbBomst[  ~nvdbBomst['Operatør_Id'].isnull() ]['Operatør_Id'].unique() )
     operatorId = [ int(x ) for x in operatorId ]
 
-    data = []
-    for operator in operatorId: 
+    def hentOperator( operator ): 
         print( f"henter operatør {operator}")
-        r = requests.get( url + '/operators/' + str(operator) + '/tollstations', headers=headers)
-        if r.ok: 
-            data.extend( r.json())
-        else: 
-            print( f"Fant ingen data for operatørID {operator}: {r.status_code} {r.text} ")
-    
-    with open( mappe+'apardump.json', 'w') as f:
-        json.dump( data, f, ensure_ascii=False, indent=4 )
+        return httpcache.get( url + '/operators/' + str(operator) + '/tollstations', headers=headers, styrer=trafikkstyring.apar, minne=False )
+
+    # Én operatør om gangen: Svaret tolkes, skrives til apardump.json og historikken, og slippes før neste.
+    # Mens én operatør behandles hentes den neste, så minnebruken er begrenset av de to største operatørene.
+    # Svarene holdes ikke i minnecachen til httpcache (minne=False), kun på disk
+    hist = historikk.Historikk( mappe + 'historikk/' )
+    with publiser.jsonListe( mappe+'apardump.json' ) as apardump, hist.aparInnlesing() as innlesing: 
+        svarliste = trafikkstyring.apar.kartleggStrom( hentOperator, operatorId, vindu=2 )
+        for operator, r in zip( operatorId, svarliste ): 
+            if r.ok: 
+                stasjoner = r.json()
+                apardump.skriv( stasjoner )
+                innlesing.leggTil( stasjoner )
+            elif r.status_code == 404: 
+                # Operatøren finnes ikke i APAR, dvs ingen stasjoner 
+                print( f"Fant ingen data for operatørID {operator}: {r.status_code} {r.text} ")
+            else: 
+                # Manglende svar (5xx, 429 osv) må ikke registreres som fjernede stasjoner i historikken. Unntaket gjør at 
+                # hverken apardump.json eller historikken oppdateres, forrige versjon blir stående 
+                raise RuntimeError( f"Feil ved henting av operatørID {operator}: {r.status_code} {r.text}" )
+            r = stasjoner = None 
+
+    print( f"APAR: {trafikkstyring.apar.status()}")
+    print( f"Historikk: {innlesing.antall} APAR-felt er nye, endret eller fjernet")
     
     # # Henter endringer 
     # r = requests.get( url + '/tollstations', headers=headers, params={'DFrom' : '2023-01-01T09:00:00Z' } )
@@ -93,10 +94,9 @@ if __name__ == '__main__':
     now = datetime.now()
     to_uker_siden = now - timedelta( weeks=2 )
     to_uker_siden = to_uker_siden.replace( hour=0, minute=0, second=0, microsecond=0 )
-    r = requests.get( url + '/tollstations', headers=headers, params={'DFrom' : to_uker_siden.isoformat() + 'Z' } )
+    r = httpcache.get( url + '/tollstations', headers=headers, params={'DFrom' : to_uker_siden.isoformat() + 'Z' }, styrer=trafikkstyring.apar )
     if r.ok: 
         endret_sisteuker = r.json()
-        with open( mappe + 'endret_bomstasjoner_sisteuker.json', 'w' ) as f: 
-            json.dump( endret_sisteuker, f, indent=4, ensure_ascii=False )
+        publiser.skrivJson( endret_sisteuker, mappe + 'endret_bomstasjoner_sisteuker.json' )
     
      
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""
+Lokal, lesbar HTTP/JSON-tjeneste for sammenstilte APAR- og NVDB-bomstasjoner
+
+Leser tabellene som tolkapar.py lagrer i <mappe>/tabeller/ (enkel kobling, flertydig kobling, APAR uten
+kobling og NVDB uten kobling) og bygger indekser i minnet på nvdbId, (operatorId, tollStationCode),
+tollStationKey og et rutenett for utsnitt (bbox, UTM33). Hver rad er ferdig serialisert til json
+ved oppstart, slik at et oppslag kun er et par dictionary-oppslag
+
+Endepunkter (alle GET, svar er json):
+    /nvdbId/<nvdbId>
+    /stasjon/<operatorId>/<tollStationCode>
+    /tollStationKey/<tollStationKey>
+    /bbox?xmin=&ymin=&xmax=&ymax=&side=0&antall=100      (UTM33 koordinater)
+    /tabell/<kobling>?side=0&antall=100                   (kobling = enkel, flertydig, apar uten kobling, ...)
+    /status
+
+Lister pagineres med side og antall, og strømmes ut med chunked transfer-encoding
+
+Bruk:
+    python bomstasjonstjeneste.py [port]
+"""
+import os
+import sys
+import json
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+import numpy as np
+import pandas as pd
+from shapely import wkt
+from pyproj import Transformer
+
+# tabellnavn fra tolkapar.lagreTabeller og hvilken kobling radene representerer
+tabellkobling = { 'merged'                   : 'enkel',
+                  'flertydig'                : 'flertydig',
+                  'apar_utenkobling_medpris' : 'apar uten kobling',
+                  'apar_utenpris'            : 'inaktiv apar',
+                  'nvdb_utenkobling'         : 'nvdb uten kobling' }
+
+# Kolonner som tas med i svaret, de som finnes i tabellen brukes
+svarkolonner = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode', 'tollStationName',
+                 'projectNumber', 'projectName', 'tollStationLane', 'tollStationDirection', 'lat', 'lon',
+                 'smallVehicle', 'largePetrol',
+                 'APAR takst liten bil', 'Takst liten bil', 'APAR Rustid takst liten bil', 'Rushtidstakst liten bil',
+                 'APAR takst stor bensinbil', 'Takst stor bil', 'APAR Rustid takst stor bensinbil', 'Rushtidstakst stor bil',
+                 'nvdbId', 'versjon', 'Operatør_Id', 'Bomstasjon_Id', 'Navn bomstasjon', 'Navn bompengeanlegg (fra CS)',
+                 'Innkrevningsretning', 'stedfesting_felt', 'tilgjengeligeKjfelt', 'stedfesting QA', 'Antall APAR felt',
+                 'kommune', 'vref', 'vegkart lenke', 'geometri' ]
+
+class Bomstasjonsindeks:
+    """
+    Indekser i minnet over sammenstilte bomstasjoner
+
+    ARGUMENTS
+        tabeller: dictionary { tabellnavn : pandas dataframe }, se tabellkobling
+
+    KEYWORDS:
+        rutestr: Størrelse på rutene i rutenettet for bbox-oppslag (meter)
+    """
+    def __init__( self, tabeller, rutestr=10000 ):
+        self.rutestr = rutestr
+        self.rader = []           # Ferdig serialisert json (bytes) per rad
+        self.kobling = []
+        self.nvdbId = {}
+        self.stasjon = {}
+        self.tollStationKey = {}
+        self.koblingstype = {}
+        self.rutenett = {}
+        xliste, yliste = [], []
+
+        trans = Transformer.from_crs( 'EPSG:4326', 'EPSG:25833', always_xy=True )
+        for tabellnavn, kobling in tabellkobling.items():
+            if tabellnavn not in tabeller:
+                continue
+            df = tabeller[tabellnavn]
+            kolonner = [ x for x in svarkolonner if x in df.columns ]
+            # to_json tar seg av numpy-typer, NaN og datoer
+            radliste = json.loads( pd.DataFrame( df[kolonner] ).to_json( orient='records', force_ascii=False, default_handler=str ))
+            for rad in radliste:
+                nr = len( self.rader )
+                rad['kobling'] = kobling
+                x, y = _koordinater( rad, trans )
+                xliste.append( x )
+                yliste.append( y )
+                self.rader.append( json.dumps( rad, ensure_ascii=False ).encode( 'utf-8' ))
+                self.kobling.append( kobling )
+                self.koblingstype.setdefault( kobling, [] ).append( nr )
+
+                if rad.get( 'nvdbId' ) is not None:
+                    self.nvdbId.setdefault( str( rad['nvdbId'] ), [] ).append( nr )
+                operatorId = rad.get( 'operatorId', rad.get( 'Operatør_Id' ))
+                kode = rad.get( 'tollStationCode', rad.get( 'Bomstasjon_Id' ))
+                if operatorId is not None and kode is not None:
+                    self.stasjon.setdefault( ( _tekst( operatorId ), _tekst( kode )), [] ).append( nr )
+                if rad.get( 'tollStationKey' ) is not None:
+                    # Flertydig kobling kan ha kommaseparert liste med nøkler
+                    for nokkel in str( rad['tollStationKey'] ).split( ',' ):
+                        self.tollStationKey.setdefault( nokkel.strip(), [] ).append( nr )
+                if not math.isnan( x ):
+                    self.rutenett.setdefault( self._rute( x, y ), [] ).append( nr )
+
+        self.x = np.array( xliste )
+        self.y = np.array( yliste )
+
+    def _rute( self, x, y ):
+        return ( int( x // self.rutestr ), int( y // self.rutestr ))
+
+    def bbox( self, xmin, ymin, xmax, ymax ):
+        """
+        Radnummer for alle rader med koordinater innenfor utsnittet
+        """
+        ix0, iy0 = self._rute( xmin, ymin )
+        ix1, iy1 = self._rute( xmax, ymax )
+        kandidater = []
+        for ix in range( ix0, ix1 + 1 ):
+            for iy in range( iy0, iy1 + 1 ):
+                kandidater.extend( self.rutenett.get( ( ix, iy ), [] ))
+        kandidater = np.array( sorted( kandidater ), dtype=np.int64 )
+        if len( kandidater ) == 0:
+            return []
+        x, y = self.x[kandidater], self.y[kandidater]
+        return kandidater[ ( x >= xmin ) & ( x <= xmax ) & ( y >= ymin ) & ( y <= ymax ) ].tolist()
+
+    def status( self ):
+        return { 'rader'          : len( self.rader ),
+                 'nvdbId'         : len( self.nvdbId ),
+                 'stasjoner'      : len( self.stasjon ),
+                 'tollStationKey' : len( self.tollStationKey ),
+                 'ruter'          : len( self.rutenett ),
+                 'koblinger'      : { k : len( v ) for k, v in self.koblingstype.items() } }
+
+def _tekst( verdi ):
+    """
+    Normaliserer ID-verdier, slik at 100120, 100120.0 og '100120' blir samme nøkkel
+    """
+    if isinstance( verdi, float ) and verdi.is_integer():
+        verdi = int( verdi )
+    return str( verdi ).strip()
+
+def _koordinater( rad, trans ):
+    """
+    UTM33-koordinater for en rad, fra NVDB-geometri hvis vi har den, ellers fra APAR lat/lon
+    """
+    if rad.get( 'geometri' ):
+        try:
+            punkt = wkt.loads( rad['geometri'] )
+            return ( punkt.x, punkt.y )
+        except Exception:
+            pass
+    if rad.get( 'lat' ) is not None and rad.get( 'lon' ) is not None:
+        return trans.transform( rad['lon'], rad['lat'] )
+    return ( math.nan, math.nan )
+
+def lesTabeller( mappe ):
+    """
+    Leser de tabellene tolkapar.lagreTabeller har lagret, som finnes i mappe
+    """
+    tabeller = {}
+    for tabellnavn in tabellkobling:
+        filnavn = os.path.join( mappe, tabellnavn + '.pkl' )
+        if os.path.isfile( filnavn ):
+            tabeller[tabellnavn] = pd.read_pickle( filnavn )
+    return tabeller
+
+class Sporringsbehandler( BaseHTTPRequestHandler ):
+    indeks = None
+    protocol_version = 'HTTP/1.1'
+
+    def _skrivBiter( self, biter ):
+        """
+        Strømmer ut json med chunked transfer-encoding
+        """
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'application/json; charset=utf-8' )
+        self.send_header( 'Transfer-Encoding', 'chunked' )
+        self.end_headers()
+        for bit in biter:
+            if bit:
+                self.wfile.write( f"{len(bit):X}\r\n".encode( 'ascii' ) + bit + b"\r\n" )
+        self.wfile.write( b"0\r\n\r\n" )
+
+    def _liste( self, radnummer, parametre ):
+        side = int( parametre.get( 'side', [0] )[0] )
+        antall = min( 1000, int( parametre.get( 'antall', [100] )[0] ))
+        utvalg = radnummer[ side*antall : (side+1)*antall ]
+
+        def biter():
+            yield json.dumps( { 'totalt' : len( radnummer ), 'side' : side, 'antall' : len( utvalg ) } )[:-1].encode( 'utf-8' ) + b', "data" : ['
+            for ii, nr in enumerate( utvalg ):
+                yield ( b',' if ii > 0 else b'' ) + self.indeks.rader[nr]
+            yield b']}'
+
+        self._skrivBiter( biter() )
+
+    def _feil( self, kode, melding ):
+        data = json.dumps( { 'feil' : melding }, ensure_ascii=False ).encode( 'utf-8' )
+        self.send_response( kode )
+        self.send_header( 'Content-Type', 'application/json; charset=utf-8' )
+        self.send_header( 'Content-Length', str( len( data )))
+        self.end_headers()
+        self.wfile.write( data )
+
+    def do_GET( self ):
+        url = urlparse( self.path )
+        deler = [ unquote( x ) for x in url.path.strip( '/' ).split( '/' ) if x ]
+        parametre = parse_qs( url.query )
+        indeks = self.indeks
+        try:
+            if deler == [ 'status' ]:
+                data = json.dumps( indeks.status() ).encode( 'utf-8' )
+                self._skrivBiter( [ data ] )
+            elif len( deler ) == 2 and deler[0] == 'nvdbId':
+                self._liste( indeks.nvdbId.get( deler[1], [] ), parametre )
+            elif len( deler ) == 3 and deler[0] == 'stasjon':
+                self._liste( indeks.stasjon.get( ( deler[1], deler[2] ), [] ), parametre )
+            elif len( deler ) == 2 and deler[0] == 'tollStationKey':
+                self._liste( indeks.tollStationKey.get( deler[1], [] ), parametre )
+            elif len( deler ) == 2 and deler[0] == 'tabell':
+                self._liste( indeks.koblingstype.get( deler[1], [] ), parametre )
+            elif deler == [ 'bbox' ]:
+                xmin, ymin, xmax, ymax = [ float( parametre[k][0] ) for k in [ 'xmin', 'ymin', 'xmax', 'ymax' ] ]
+                self._liste( indeks.bbox( xmin, ymin, xmax, ymax ), parametre )
+            else:
+                self._feil( 404, f"Ukjent endepunkt {url.path}" )
+        except ( KeyError, ValueError ) as e:
+            self._feil( 400, f"Ugyldig forespørsel: {e}" )
+
+def start( mappe, port=8080, vert='127.0.0.1' ):
+    """
+    Leser tabellene, bygger indeksene og starter tjenesten (blokkerer)
+    """
+    Sporringsbehandler.indeks = Bomstasjonsindeks( lesTabeller( mappe ))
+    print( f"Bomstasjonstjeneste på http://{vert}:{port}/ {Sporringsbehandler.indeks.status()}")
+    ThreadingHTTPServer( ( vert, port ), Sporringsbehandler ).serve_forever()
+
+
+if __name__ == '__main__':
+    mappe = '/mnt/c/DATA/leveranser/apardata/tabeller/'
+    port = int( sys.argv[1] ) if len( sys.argv ) > 1 else 8080
+    start( mappe, port=port )
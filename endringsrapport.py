@@ -0,0 +1,212 @@
+"""
+Endringer siden forrige kjøring: Nye, fjernede og endrede rader i tabellene fra tolkapar.sammenstill
+
+Sammenligner tabellene fra denne kjøringen med tabellene forrige kjøring lagret (tolkapar.lagreTabeller), uten å
+lese de gamle json-dumpene på nytt. Hver tabell sorteres på sin nøkkel (tollStationKey, nvdbId, ...) og de to
+sorterte nøkkel-listene flettes med searchsorted. Feltene sammenlignes kolonnevis for alle koblede rader samtidig
+
+Resultatet er én kompakt tabell med én rad per ny eller fjernet rad, og én rad per endret felt med før- og
+etter-verdi
+
+Eksempel:
+    forrige = endringsrapport.lesForrige( mappe + 'tabeller/' )
+    endringer = endringsrapport.sammenlignKjoringer( forrige, resultat )
+    endringsrapport.skrivRapport( endringer, mappe )
+"""
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import publiser
+import nvdbgeotricks
+
+# Tabellene som sammenlignes, med nøkkel og hvilke kolonner som sammenlignes (None = alle kolonner som finnes i begge)
+sammenligninger = [
+    { 'tabell' : 'merged',                   'nokkel' : [ 'tollStationKey' ],
+      'kolonner' : [ 'nvdbId', 'tollStationName', 'tollStationLane', 'tollStationDirection',
+                     'APAR takst liten bil', 'APAR Rustid takst liten bil', 'APAR takst stor bensinbil', 'APAR Rustid takst stor bensinbil',
+                     'Takst liten bil', 'Rushtidstakst liten bil', 'Takst stor bil', 'Rushtidstakst stor bil', 'stedfesting QA' ] },
+    { 'tabell' : 'apar_utenkobling_medpris', 'nokkel' : [ 'tollStationKey' ], 'kolonner' : [ 'operatorId', 'tollStationCode', 'tollStationName' ] },
+    { 'tabell' : 'apar_utenpris',            'nokkel' : [ 'tollStationKey' ], 'kolonner' : [ 'operatorId', 'tollStationCode', 'tollStationName' ] },
+    { 'tabell' : 'nvdb_utenkobling',         'nokkel' : [ 'nvdbId' ],         'kolonner' : [ 'versjon', 'Navn bomstasjon', 'Operatør_Id', 'Bomstasjon_Id' ] },
+    { 'tabell' : 'takstmatrise',             'nokkel' : [ 'nvdbId' ],         'kolonner' : None },
+    { 'tabell' : 'kvalitetsfunn',            'nokkel' : [ 'regel', 'nvdbId', 'tollStationKey' ], 'kolonner' : [ 'alvorlighet', 'verdi' ] },
+]
+
+endringskolonner = [ 'tabell', 'nokkel', 'endring', 'felt', 'før', 'etter' ]
+
+def sjekksumForrige( mappe ):
+    """
+    Sjekksum av tabellfilene fra forrige kjøring i mappe, '' hvis det ikke finnes noen. Identifiserer hvilken
+    tilstand endringene fra sammenlignKjoringer er regnet ut fra, se hendelseslogg
+    """
+    h = hashlib.sha256()
+    funnet = False
+    for x in sammenligninger:
+        filnavn = os.path.join( mappe, x['tabell'] + '.pkl' )
+        if os.path.isfile( filnavn ):
+            funnet = True
+            h.update( x['tabell'].encode( 'utf-8' ))
+            with open( filnavn, 'rb' ) as f:
+                for bolk in iter( lambda : f.read( 1024*1024 ), b'' ):
+                    h.update( bolk )
+    return h.hexdigest() if funnet else ''
+
+def lesForrige( mappe ):
+    """
+    Leser de tabellene fra forrige kjøring som finnes i mappe (lagret med tolkapar.lagreTabeller)
+
+    RETURNS
+        dictionary { tabellnavn : pandas dataframe }, tom hvis det ikke finnes noen forrige kjøring
+    """
+    tabeller = {}
+    for x in sammenligninger:
+        filnavn = os.path.join( mappe, x['tabell'] + '.pkl' )
+        if os.path.isfile( filnavn ):
+            tabeller[ x['tabell'] ] = pd.read_pickle( filnavn )
+    return tabeller
+
+def nokkeltekst( df, nokkel ):
+    """
+    Nøkkel som tekst, sammensatte nøkler skilles med |. Heltall som er lagret som flyttall skrives uten desimaler
+    """
+    deler = []
+    for kol in nokkel:
+        verdi = df[kol] if kol in df.columns else pd.Series( [ None ] * len( df ), index=df.index )
+        tall = pd.to_numeric( verdi, errors='coerce' )
+        heltall = tall.notnull() & ( tall == tall.round() )
+        tekst = verdi.astype( str ).where( verdi.notnull(), '' )
+        tekst[heltall] = tall[heltall].astype( np.int64 ).astype( str )
+        deler.append( tekst.to_numpy( dtype=str ))
+    resultat = deler[0]
+    for d in deler[1:]:
+        resultat = np.char.add( np.char.add( resultat, '|' ), d )
+    return resultat
+
+def _like( a, b ):
+    """
+    Elementvis likhet der to manglende verdier regnes som like
+    """
+    a = pd.Series( a, dtype=object ).reset_index( drop=True )
+    b = pd.Series( b, dtype=object ).reset_index( drop=True )
+    begge = a.isnull() & b.isnull()
+    return ( begge | ( a == b ).fillna( False ).astype( bool )).to_numpy( dtype=bool )
+
+def sammenlign( gammel, ny, nokkel, kolonner=None, tabell='' ):
+    """
+    Nye, fjernede og endrede rader mellom to versjoner av en tabell, via sortert fletting på nøkkel
+
+    ARGUMENTS
+        gammel, ny: pandas dataframe
+
+        nokkel: Liste med nøkkelkolonner. Ved duplikate nøkler brukes første rad, og duplikatene i ny rapporteres
+                med endring 'duplikat' og antall rader med nøkkelen i etter
+
+    KEYWORDS:
+        kolonner: None (default, alle felles kolonner) eller liste med kolonner som sammenlignes
+
+        tabell: Tabellnavn som skrives i resultatet
+
+    RETURNS
+        pandas dataframe med kolonnene tabell, nokkel, endring ('ny', 'fjernet', 'endret' eller 'duplikat'), felt, før og etter
+    """
+    if kolonner is None:
+        kolonner = [ x for x in ny.columns if x in gammel.columns and x not in nokkel ]
+    kolonner = [ x for x in kolonner if x in ny.columns or x in gammel.columns ]
+
+    nokkelGammel, nokkelNy = nokkeltekst( gammel, nokkel ), nokkeltekst( ny, nokkel )
+    # Stabil sortering, første forekomst av en nøkkel kommer først
+    sortGammel = np.argsort( nokkelGammel, kind='stable' )
+    sortNy = np.argsort( nokkelNy, kind='stable' )
+    sortGammel = sortGammel[ np.r_[ True, nokkelGammel[sortGammel][1:] != nokkelGammel[sortGammel][:-1] ] ] if len( sortGammel ) else sortGammel
+    forsteNy = np.r_[ True, nokkelNy[sortNy][1:] != nokkelNy[sortNy][:-1] ] if len( sortNy ) else np.zeros( 0, dtype=bool )
+    duplikat, antall = np.unique( nokkelNy[sortNy][~forsteNy], return_counts=True )
+    sortNy = sortNy[forsteNy]
+    sortertGammel, sortertNy = nokkelGammel[sortGammel], nokkelNy[sortNy]
+
+    # Fletting: posisjonen til hver ny nøkkel blant de gamle
+    posisjon = np.searchsorted( sortertGammel, sortertNy )
+    finnes = posisjon < len( sortertGammel )
+    finnes[finnes] = sortertGammel[ posisjon[finnes] ] == sortertNy[finnes]
+    iGammel = np.zeros( len( sortertGammel ), dtype=bool )
+    iGammel[ posisjon[finnes] ] = True
+
+    deler = []
+    if len( duplikat ):
+        print( f"Endringsrapport: {len( duplikat )} duplikate nøkler i {tabell}, sammenligner første rad for hver: {duplikat[:5].tolist()}")
+        deler.append( pd.DataFrame( { 'nokkel' : duplikat, 'endring' : 'duplikat', 'etter' : antall + 1 } ))
+    if ( ~finnes ).any():
+        deler.append( pd.DataFrame( { 'nokkel' : sortertNy[~finnes], 'endring' : 'ny' } ))
+    if ( ~iGammel ).any():
+        deler.append( pd.DataFrame( { 'nokkel' : sortertGammel[~iGammel], 'endring' : 'fjernet' } ))
+
+    radNy = sortNy[finnes]
+    radGammel = sortGammel[ posisjon[finnes] ]
+    for kol in kolonner:
+        fraGammel = gammel[kol].to_numpy( dtype=object )[radGammel] if kol in gammel.columns else np.full( len( radGammel ), None, dtype=object )
+        fraNy = ny[kol].to_numpy( dtype=object )[radNy] if kol in ny.columns else np.full( len( radNy ), None, dtype=object )
+        ulik = ~_like( fraGammel, fraNy )
+        if ulik.any():
+            deler.append( pd.DataFrame( { 'nokkel' : sortertNy[finnes][ulik], 'endring' : 'endret', 'felt' : kol,
+                                          'før' : fraGammel[ulik], 'etter' : fraNy[ulik] } ))
+
+    if not deler:
+        return pd.DataFrame( columns=endringskolonner )
+    endringer = pd.concat( deler, ignore_index=True ).reindex( columns=endringskolonner )
+    endringer['tabell'] = tabell
+    return endringer.sort_values( [ 'nokkel', 'endring', 'felt' ], kind='stable', na_position='first' ).reset_index( drop=True )
+
+def sammenlignKjoringer( forrige, resultat, oppsett=None ):
+    """
+    Sammenligner alle tabellene i oppsett mellom forrige og denne kjøringen
+
+    ARGUMENTS
+        forrige: dictionary med tabeller fra forrige kjøring, se lesForrige
+
+        resultat: dictionary med tabeller fra tolkapar.sammenstill
+
+    KEYWORDS:
+        oppsett: None (default, dvs sammenligninger) eller liste på samme form
+
+    RETURNS
+        pandas dataframe med alle endringer, se sammenlign
+    """
+    if oppsett is None:
+        oppsett = sammenligninger
+
+    deler = []
+    for x in oppsett:
+        if x['tabell'] not in resultat:
+            continue
+        if x['tabell'] not in forrige:
+            print( f"Endringsrapport: Finner ikke {x['tabell']} fra forrige kjøring, alle rader regnes som nye")
+        gammel = forrige.get( x['tabell'], pd.DataFrame( columns=resultat[ x['tabell'] ].columns ))
+        deler.append( sammenlign( gammel, resultat[ x['tabell'] ], x['nokkel'], kolonner=x['kolonner'], tabell=x['tabell'] ))
+
+    if not deler:
+        return pd.DataFrame( columns=endringskolonner )
+    return pd.concat( deler, ignore_index=True )
+
+def oppsummer( endringer ):
+    """
+    Antall endringer per tabell og type. Endrede rader telles én gang, selv om flere felt er endret
+    """
+    unike = endringer.drop_duplicates( subset=[ 'tabell', 'nokkel', 'endring' ] )
+    oppsummering = unike.groupby( [ 'tabell', 'endring' ] ).size().unstack( fill_value=0 ).reset_index()
+    for tabell, rad in oppsummering.set_index( 'tabell' ).iterrows():
+        print( f"Endringer {tabell}: " + ', '.join( [ f"{antall} {endring}" for endring, antall in rad.items() if antall ] ))
+    return oppsummering
+
+def skrivRapport( endringer, mappe ):
+    """
+    Skriver endringer.xlsx (oppsummering og alle endringer) til mappe
+    """
+    oppsummering = oppsummer( endringer )
+    utdata = endringer.copy()
+    for kol in [ 'før', 'etter' ]:
+        utdata[kol] = utdata[kol].apply( lambda x : x if x is None or isinstance( x, ( int, float, str, bool )) else str( x ))
+    with publiser.atomisk( mappe + 'endringer.xlsx' ) as tmpfil:
+        nvdbgeotricks.skrivexcel( tmpfil, [ oppsummering, utdata ], sheet_nameListe=[ 'Oppsummering', 'Endringer' ] )
+    return oppsummering
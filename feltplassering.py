@@ -0,0 +1,272 @@
+"""
+Kontroll av stedfesting på kjørefelt for punktobjekter i NVDB, for alle objekttyper med en retningsegenskap
+
+Generalisering av lagStedfesting / vurderStedfest i tolkapar_OLD.py, som kun gjelder
+bomstasjon (objekttype 45) og egenskapen Innkrevningsretning. En objekttype beskrives med Objekttype: Hvilken
+egenskap som angir retning, og hvilke verdier som betyr begge retninger (0), med metrering (1) og mot metrering (2)
+
+Alle objekttyper deler én Vegnettcache. Vegnettet (segmentert veglenkesekvens med feltoversikt) hentes i
+bolker med mange veglenkesekvenser per kall, kun én gang per veglenkesekvens uansett hvor mange objekter og
+objekttyper som ligger på den, og kallene går gjennom trafikkstyring.nvdb
+
+Eksempel:
+    kontroll = feltplassering.Feltplassering()
+    resultat = kontroll.kontroller( { feltplassering.bomstasjon : nvdbAlle } )
+    resultat[ feltplassering.bomstasjon ]['stedfesting QA']
+"""
+import threading
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+
+import httpcache
+import trafikkstyring
+
+vegnettURL = 'https://nvdbapiles.atlas.vegvesen.no/vegnett/veglenkesekvenser/segmentert'
+
+class Objekttype:
+    """
+    Punktobjekttype med retningsegenskap
+
+    ARGUMENTS
+        typeId: NVDB objekttype ID
+
+        navn: Navn på objekttypen
+
+        retningsegenskap: Navn på egenskapen som angir retning
+
+        retningsverdier: dictionary { egenskapverdi : 0 | 1 | 2 }, 0 = begge retninger (ingen stedfesting på felt),
+                         1 = med metrering, 2 = mot metrering. Manglende verdi regnes som 0
+    """
+    __slots__ = ( 'typeId', 'navn', 'retningsegenskap', 'retningsverdier' )
+
+    def __init__( self, typeId, navn, retningsegenskap, retningsverdier ):
+        self.typeId = typeId
+        self.navn = navn
+        self.retningsegenskap = retningsegenskap
+        self.retningsverdier = dict( retningsverdier )
+
+    def __repr__( self ):
+        return f"Objekttype({self.typeId}, {self.navn!r}, {self.retningsegenskap!r})"
+
+bomstasjon = Objekttype( 45, 'Bomstasjon', 'Innkrevningsretning',
+                         { 'Begge retninger' : 0, 'Med metrering' : 1, 'Mot metrering' : 2 } )
+
+class Vegnettcache:
+    """
+    Felles cache for segmentert vegnett (feltoversikt per segment), hentet i bolker
+
+    KEYWORDS:
+        styrer: trafikkstyring.Trafikkstyrer for kallene, default trafikkstyring.nvdb
+
+        bolk: Antall veglenkesekvenser per kall
+
+        maksAlder: Hvor lenge (sekunder) et svar i httpcache regnes som ferskt
+    """
+    def __init__( self, styrer=None, bolk=50, maksAlder=3600 ):
+        self.styrer = styrer or trafikkstyring.nvdb
+        self.bolk = bolk
+        self.maksAlder = maksAlder
+        self.segmenter = {}          # veglenkesekvensid -> ( start, slutt, feltoversikt ), sortert på start
+        self._laas = threading.Lock()
+        self.statistikk = { 'kall' : 0, 'veglenkesekvenser' : 0 }
+
+    def _hentBolk( self, idliste ):
+        """
+        Henter segmentert vegnett for en liste med veglenkesekvenser, følger paginering
+        """
+        segmenter = []
+        params = { 'veglenkesekvens' : ','.join( [ str( x ) for x in idliste ] ) }
+        url = vegnettURL
+        while True:
+            r = httpcache.get( url, params=params, maksAlder=self.maksAlder, styrer=self.styrer )
+            with self._laas:
+                self.statistikk['kall'] += 1
+            if not r.ok:
+                print( f"Vegnettcache: Feil {r.status_code} ved henting av {len( idliste )} veglenkesekvenser")
+                break
+            data = r.json()
+            if isinstance( data, list ):
+                segmenter.extend( data )
+                break
+            segmenter.extend( data.get( 'objekter', [] ))
+            neste = data.get( 'metadata', {} ).get( 'neste', {} )
+            if not data.get( 'metadata', {} ).get( 'returnert' ) or not neste.get( 'href' ):
+                break
+            url = neste['href'].split( '?' )[0]
+            params = { k : v[0] for k, v in parse_qs( urlparse( neste['href'] ).query ).items() }
+
+        perSekvens = {}
+        for seg in segmenter:
+            felt = seg.get( 'feltoversikt' )
+            perSekvens.setdefault( seg['veglenkesekvensid'], [] ).append(
+                ( seg['startposisjon'], seg['sluttposisjon'], ','.join( felt ) if isinstance( felt, list ) else '' ))
+        resultat = {}
+        for vid in idliste:
+            rader = sorted( perSekvens.get( vid, [] ))
+            resultat[vid] = ( np.array( [ x[0] for x in rader ], dtype=float ),
+                              np.array( [ x[1] for x in rader ], dtype=float ),
+                              [ x[2] for x in rader ] )
+        return resultat
+
+    def hent( self, veglenkesekvenser ):
+        """
+        Sørger for at vegnettet for alle veglenkesekvensene ligger i cachen. Manglende hentes i bolker, i parallell
+        """
+        with self._laas:
+            mangler = sorted( { int( x ) for x in veglenkesekvenser if pd.notnull( x ) } - set( self.segmenter ))
+        if not mangler:
+            return
+        bolker = [ mangler[ii:ii+self.bolk] for ii in range( 0, len( mangler ), self.bolk ) ]
+        for svar in self.styrer.kartlegg( self._hentBolk, bolker ):
+            with self._laas:
+                self.segmenter.update( svar )
+                self.statistikk['veglenkesekvenser'] += len( svar )
+
+    def feltoversikt( self, veglenkesekvenser, posisjoner ):
+        """
+        Tilgjengelige kjørefelt (kommaseparert tekst) i hvert punkt ( veglenkesekvens, relativ posisjon )
+
+        RETURNS
+            liste med tekst, '' der vi ikke finner segment eller segmentet mangler feltoversikt
+        """
+        vid = pd.to_numeric( pd.Series( veglenkesekvenser ), errors='coerce' ).to_numpy()
+        pos = pd.to_numeric( pd.Series( posisjoner ), errors='coerce' ).to_numpy( dtype=float )
+        self.hent( vid )
+
+        resultat = np.full( len( vid ), '', dtype=object )
+        gyldig = np.nonzero( ~np.isnan( vid ) & ~np.isnan( pos ))[0]
+        for sekvens, rader in pd.Series( gyldig ).groupby( vid[gyldig] ):
+            start, slutt, felt = self.segmenter.get( int( sekvens ), ( np.zeros( 0 ), np.zeros( 0 ), [] ))
+            if len( start ) == 0:
+                continue
+            rader = rader.to_numpy()
+            nr = np.searchsorted( start, pos[rader], side='right' ) - 1
+            treff = ( nr >= 0 ) & ( pos[rader] < slutt[ np.maximum( nr, 0 ) ] )
+            resultat[ rader[treff] ] = [ felt[ii] for ii in nr[treff] ]
+        return resultat.tolist()
+
+    def status( self ):
+        return dict( self.statistikk, cachet=len( self.segmenter ))
+
+_standardcache = None
+_standardlaas = threading.Lock()
+
+def standardcache():
+    """
+    Felles Vegnettcache for hele prosessen
+    """
+    global _standardcache
+    with _standardlaas:
+        if _standardcache is None:
+            _standardcache = Vegnettcache()
+    return _standardcache
+
+def skalHaStedfest( df, objekttype=bomstasjon ) -> np.ndarray:
+    """
+    Hvilket kjørefelt objektet skal være stedfestet på ut fra retningsegenskapen og segmentretning:
+    0, 1 eller 2. -1 for ukjent egenskapverdi
+    """
+    retning = df[ objekttype.retningsegenskap ] if objekttype.retningsegenskap in df.columns else pd.Series( np.nan, index=df.index )
+    skal = retning.map( objekttype.retningsverdier )
+    skal[ retning.isnull() ] = 0
+    skal = skal.fillna( -1 ).to_numpy( dtype=int )
+    snudd = ( df['segmentretning'] == 'MOT' ).to_numpy() & ( skal > 0 )
+    skal[snudd] = 3 - skal[snudd]
+    return skal
+
+def harStedfest( df ) -> np.ndarray:
+    """
+    Tolkning av stedfesting_felt: 0 (ingen, alle felt eller både 1 og 2), 1 eller 2. -1 for ugyldig kombinasjon
+    """
+    felt = df['stedfesting_felt']
+    tekst = felt.fillna( '' ).astype( str )
+    har1 = tekst.str.contains( '1', regex=False ).to_numpy()
+    har2 = tekst.str.contains( '2', regex=False ).to_numpy()
+    ingen = felt.isnull().to_numpy() | ( felt == df['tilgjengeligeKjfelt'] ).to_numpy() | ( har1 & har2 )
+    return np.select( [ ingen, har1 & ~har2, har2 & ~har1 ], [ 0, 1, 2 ], default=-1 )
+
+def vurdering( skal, har ):
+    """
+    Tekstlig vurdering, samme tekster som tolkapar_OLD.vurderStedfest
+    """
+    skal = np.asarray( skal )
+    har = np.asarray( har )
+    return np.select( [ ( skal < 0 ) | ( har < 0 ), skal == har, ( skal > 0 ) & ( har == 0 ), ( skal > 0 ) & ( har > 0 ), ( skal == 0 ) & ( har > 0 ) ],
+                      [ 'Ugyldig retning eller stedfesting', 'OK',
+                        np.char.add( 'Innkr sier felt ', skal.astype( str )),
+                        np.char.add( np.char.add( np.char.add( 'Snudd stedfesting ', har.astype( str )), ' ift metrering ' ), skal.astype( str )),
+                        'Skal IKKE ha kj.felt stedfesting' ], default='' ).astype( object )
+
+class Feltplassering:
+    """
+    Kontroll av stedfesting på kjørefelt for en eller flere objekttyper, med felles Vegnettcache
+
+    KEYWORDS:
+        cache: None (default, dvs standardcache()) eller Vegnettcache
+    """
+    def __init__( self, cache=None ):
+        self.cache = cache or standardcache()
+
+    def kontroller( self, objekter ):
+        """
+        ARGUMENTS
+            objekter: dictionary { Objekttype : pandas dataframe fra nvdbapiv4 to_records } med kolonnene
+                      veglenkesekvensid, relativPosisjon, segmentretning, stedfesting_felt og retningsegenskapen
+
+        RETURNS
+            dictionary { Objekttype : pandas dataframe } med nye kolonner tilgjengeligeKjfelt, skalHaStedfest,
+            harStedfest og stedfesting QA
+        """
+        # Vegnettet for alle objekttyper hentes samlet, slik at felles veglenkesekvenser kun hentes én gang
+        self.cache.hent( pd.concat( [ df['veglenkesekvensid'] for df in objekter.values() ] ) if objekter else [] )
+
+        resultat = {}
+        for objekttype, df in objekter.items():
+            df = df.copy()
+            df['tilgjengeligeKjfelt'] = self.cache.feltoversikt( df['veglenkesekvensid'], df['relativPosisjon'] )
+            skal = skalHaStedfest( df, objekttype )
+            har = harStedfest( df )
+            df['skalHaStedfest'] = skal
+            df['harStedfest'] = har
+            df['stedfesting QA'] = vurdering( skal, har )
+            resultat[objekttype] = df
+            antallAvvik = int( ( df['stedfesting QA'] != 'OK' ).sum() )
+            print( f"Feltplassering {objekttype.navn} ({objekttype.typeId}): {len( df )} objekter, {antallAvvik} avvik")
+        print( f"Vegnettcache: {self.cache.status()}")
+        return resultat
+
+    def hentOgKontroller( self, objekttyper, filter=None ):
+        """
+        Henter objektene fra NVDB (én nedlasting per objekttype) og kontrollerer dem samlet
+
+        ARGUMENTS
+            objekttyper: Liste med Objekttype
+
+        KEYWORDS:
+            filter: None (default) eller dictionary med søkefilter til nvdbapiv4.nvdbFagdata (f.eks kommune)
+        """
+        import nvdbapiv4
+
+        def last( objekttype ):
+            sok = nvdbapiv4.nvdbFagdata( objekttype.typeId )
+            if filter:
+                sok.filter( filter )
+            return pd.DataFrame( trafikkstyring.nvdb.utfor( lambda : sok.to_records( relasjoner=False ), maalSvartid=False ))
+
+        tabeller = trafikkstyring.nvdb.kartlegg( last, objekttyper )
+        return self.kontroller( dict( zip( objekttyper, tabeller )))
+
+
+if __name__ == '__main__':
+    import STARTHER
+    import nvdbgeotricks
+    import publiser
+
+    mappe = '/mnt/c/DATA/leveranser/apardata/'
+    objekttyper = [ bomstasjon ]
+    resultat = Feltplassering().hentOgKontroller( objekttyper )
+    with publiser.atomisk( mappe + 'feltplassering.xlsx' ) as tmpfil:
+        nvdbgeotricks.skrivexcel( tmpfil, [ df[ df['stedfesting QA'] != 'OK' ] for df in resultat.values() ],
+                                  sheet_nameListe=[ f"{x.navn} {x.typeId}"[:31] for x in resultat ] )
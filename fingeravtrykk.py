@@ -0,0 +1,148 @@
+"""
+Inkrementell beregning: fingeravtrykk per bomstasjon og cache for avledede resultater
+
+Fingeravtrykket for en NVDB bomstasjon er en sjekksum av nvdbId, versjon, stedfesting og de APAR-feltene
+som har samme operatør ID og bomstasjon ID. Avledede resultater per stasjon (kjørefelt-oppslag,
+geometri for redigering) caches med fingeravtrykket som nøkkel,
+slik at en kjøring kun beregner de stasjonene der inndataene er endret. Resultater som også avhenger av data
+utenfor fingeravtrykket (f.eks vegnettet bak kjørefelt-oppslaget) kan i tillegg få en maksimal alder
+
+Eksempel:
+    cache = fingeravtrykk.Stasjonscache( mappe + 'stasjonscache.pkl' )
+    verdier = cache.beregn( 'aparRediger', nokler, avtrykk, lambda ii : [ ... for ii in ii ] )
+    cache.skriv()
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+
+import pandas as pd
+
+def sjekksum( *deler ) -> str:
+    h = hashlib.sha256()
+    for del_ in deler:
+        h.update( str( del_ ).encode( 'utf-8' ))
+        h.update( b'\x1f' )
+    return h.hexdigest()
+
+def aparAvtrykk( apardata ):
+    """
+    Sjekksum av alle APAR-felt per (operatorId, tollStationCode)
+
+    RETURNS
+        dictionary { ( operatorId, tollStationCode ) : sjekksum }
+    """
+    kolonner = [ x for x in apardata.columns if x not in ( 'lat', 'lon' ) ]
+    poster = apardata[kolonner].to_dict( 'records' )
+    feltsum = [ sjekksum( json.dumps( rad, sort_keys=True, default=str, ensure_ascii=False )) for rad in poster ]
+    df = pd.DataFrame( { 'operatorId' : apardata['operatorId'].values, 'tollStationCode' : apardata['tollStationCode'].values,
+                         'tollStationKey' : apardata['tollStationKey'].astype( str ).values, 'feltsum' : feltsum } )
+    df = df.sort_values( [ 'operatorId', 'tollStationCode', 'tollStationKey' ] )
+    return df.groupby( [ 'operatorId', 'tollStationCode' ] )['feltsum'].agg( lambda x : sjekksum( *x )).to_dict()
+
+def nvdbAvtrykk( nvdbAlle, kolonner=( 'nvdbId', 'versjon', 'Navn bomstasjon', 'geometri' )):
+    """
+    Sjekksum av NVDB-objektene per (Operatør_Id, Bomstasjon_Id)
+
+    RETURNS
+        dictionary { ( Operatør_Id, Bomstasjon_Id ) : sjekksum }
+    """
+    kolonner = [ x for x in kolonner if x in nvdbAlle.columns ]
+    df = nvdbAlle[ [ 'Operatør_Id', 'Bomstasjon_Id' ] + kolonner ].sort_values( 'nvdbId' )
+    df = df.assign( _sum=df[kolonner].astype( str ).agg( '|'.join, axis=1 ))
+    return df.groupby( [ 'Operatør_Id', 'Bomstasjon_Id' ] )['_sum'].agg( lambda x : sjekksum( *x )).to_dict()
+
+def stasjonsavtrykk( nvdbAlle, aparsummer, kolonner=( 'nvdbId', 'versjon', 'stedfest', 'tilgjengeligeKjfelt' )):
+    """
+    Fingeravtrykk per rad i nvdbAlle: NVDB-egenskapene i kolonner pluss sjekksum for tilhørende APAR-felt
+
+    ARGUMENTS
+        nvdbAlle: pandas dataframe med NVDB bomstasjoner
+
+        aparsummer: dictionary fra aparAvtrykk
+
+    RETURNS
+        liste med fingeravtrykk, samme rekkefølge som nvdbAlle
+    """
+    kolonner = [ x for x in kolonner if x in nvdbAlle.columns ]
+    verdier = nvdbAlle[kolonner].astype( str ).to_numpy().tolist()
+    nokler = zip( nvdbAlle['Operatør_Id'].tolist(), nvdbAlle['Bomstasjon_Id'].tolist() )
+    return [ sjekksum( *rad, aparsummer.get( nokkel, '' )) for rad, nokkel in zip( verdier, nokler ) ]
+
+class Stasjonscache:
+    """
+    Cache for avledede resultater per stasjon, med fingeravtrykk som gyldighetssjekk
+
+    ARGUMENTS
+        filnavn: Pickle-fil for cachen. None gir en cache som kun lever i minnet
+    """
+    def __init__( self, filnavn=None ):
+        self.filnavn = filnavn
+        self.data = {}
+        self.statistikk = {}
+        if filnavn and os.path.isfile( filnavn ):
+            with open( filnavn, 'rb' ) as f:
+                self.data = pickle.load( f )
+
+    def beregn( self, navn, nokler, avtrykk, beregning, maksAlder=None ):
+        """
+        Henter verdier fra cache der fingeravtrykket er uendret (og verdien ikke er for gammel), og beregner resten
+
+        ARGUMENTS
+            navn: Navn på det avledede resultatet, f.eks 'tilgjengeligeKjfelt'
+
+            nokler: Liste med nøkler (f.eks nvdbId), én per rad
+
+            avtrykk: Liste med fingeravtrykk, én per rad
+
+            beregning: Funksjon som tar en liste med radnummer og returnerer en liste med verdier for disse
+
+        KEYWORDS:
+            maksAlder: None (default, ingen grense) eller maksimal alder i sekunder for verdier fra cachen
+
+        RETURNS
+            Liste med verdier, én per rad
+        """
+        del_ = self.data.setdefault( navn, {} )
+        verdier = [ None ] * len( nokler )
+        mangler = []
+        naa = time.time()
+        for ii, ( nokkel, avtr ) in enumerate( zip( nokler, avtrykk )):
+            lagret = del_.get( nokkel )
+            # Oppføringer uten tidspunkt (eldre cache-filer) regnes som for gamle når det er en grense
+            fersk = maksAlder is None or ( lagret is not None and len( lagret ) > 2 and naa - lagret[2] < maksAlder )
+            if lagret is not None and lagret[0] == avtr and fersk:
+                verdier[ii] = lagret[1]
+            else:
+                mangler.append( ii )
+
+        if mangler:
+            nye = beregning( mangler )
+            for ii, verdi in zip( mangler, nye ):
+                verdier[ii] = verdi
+                del_[ nokler[ii] ] = ( avtrykk[ii], verdi, naa )
+
+        self.statistikk[navn] = { 'gjenbrukt' : len( nokler ) - len( mangler ), 'beregnet' : len( mangler ) }
+        return verdier
+
+    def rydd( self, navn, nokler ):
+        """
+        Fjerner cache-oppføringer for nøkler som ikke lenger finnes
+        """
+        nokler = set( nokler )
+        del_ = self.data.get( navn, {} )
+        for nokkel in [ x for x in del_ if x not in nokler ]:
+            del del_[nokkel]
+
+    def skriv( self ):
+        if not self.filnavn:
+            return
+        with open( self.filnavn + '.tmp', 'wb' ) as f:
+            pickle.dump( self.data, f, protocol=pickle.HIGHEST_PROTOCOL )
+        os.replace( self.filnavn + '.tmp', self.filnavn )
+
+    def oppsummer( self ):
+        for navn, stat in self.statistikk.items():
+            print( f"Inkrementell beregning {navn}: {stat['beregnet']} beregnet, {stat['gjenbrukt']} gjenbrukt")
@@ -0,0 +1,214 @@
+"""
+Automatisk tildeling av APAR-felt til NVDB bomstasjoner der operatør ID + bomstasjon ID forekommer flere ganger i NVDB
+
+Alle kandidatpar ( APAR-felt, NVDB-objekt ) i den flertydige koblingen får poeng i én samlet, vektorisert
+beregning. Poengene bygger på
+    - retning: Feltnummer i APAR (oddetall = felt 1, partall = felt 2) mot feltet NVDB-objektet skal ha
+      ut fra Innkrevningsretning og segmentretning, se feltplassering.skalHaStedfest
+    - stedfesting: Feltnummer i APAR mot stedfesting_felt på NVDB-objektet, se feltplassering.harStedfest
+    - avstand: Avstanden mellom APAR-posisjonen og NVDB-geometrien
+    - feltFinnes: Om feltnummeret i APAR finnes blant tilgjengeligeKjfelt der NVDB-objektet står
+
+Hvert delpoeng er mellom -1 (taler imot) og 1 (taler for), 0 betyr at vi ikke vet (manglende data, begge
+retninger, ingen stedfesting på felt). Et felt tildeles NVDB-objektet med høyest poengsum når forspranget til
+nest beste kandidat er stort nok, ellers er det uavklart og må vurderes manuelt
+
+Takstene for et flertydig NVDB-objekt regnes som entydige når alle felt som er tildelt objektet har samme
+APAR-takst, eller når alle feltene på APAR-stasjonen har samme takst (da spiller tildelingen ingen rolle)
+
+Eksempel:
+    losning = flertydighet.losFlertydige( flertydig )
+    losning['tildeling'][ losning['tildeling']['status'] == 'uavklart' ]
+    rader = flertydighet.takstrader( flertydig, losning['tildeling'], felttakster )
+"""
+import re
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+import aparmodell
+import feltplassering
+
+# Vekting av delpoengene
+vekter = { 'retning' : 1.0, 'stedfesting' : 0.5, 'avstand' : 1.0, 'feltFinnes' : 0.5 }
+
+# Kolonner fra APAR og NVDB som tas med i poengtabellen
+aparkolonner = [ 'operatorId', 'tollStationCode', 'tollStationKey', 'tollStationName', 'tollStationLane', 'tollStationDirection' ]
+nvdbkolonner = [ 'nvdbId', 'Navn bomstasjon', 'Innkrevningsretning', 'stedfesting_felt', 'tilgjengeligeKjfelt' ]
+
+def feltnummer( lane ) -> np.ndarray:
+    """
+    Feltnummeret i tollStationLane som float, NaN der det ikke finnes et tall
+    """
+    tekst = pd.Series( lane ).astype( str )
+    return pd.to_numeric( tekst.str.extract( r'(\d+)', expand=False ), errors='coerce' ).to_numpy( dtype=float )
+
+def feltside( nummer ) -> np.ndarray:
+    """
+    Kjørefelt 1 (oddetall, med metrering) eller 2 (partall, mot metrering) for feltnummer, 0 der det mangler
+    """
+    nummer = np.asarray( nummer, dtype=float )
+    side = np.zeros( len( nummer ), dtype=int )
+    kjent = ~np.isnan( nummer )
+    side[kjent] = np.where( nummer[kjent] % 2 == 1, 1, 2 )
+    return side
+
+def _enighet( a, b ) -> np.ndarray:
+    """
+    1 der a og b er samme kjørefelt (1 eller 2), -1 der de er ulike, 0 der en av dem er ukjent eller 0
+    """
+    kjent = ( a > 0 ) & ( b > 0 )
+    return np.where( kjent, np.where( a == b, 1.0, -1.0 ), 0.0 )
+
+def _feltFinnes( nummer, tilgjengelige ) -> np.ndarray:
+    """
+    1 der feltnummeret finnes blant tilgjengelige kjørefelt (f.eks '1,2,3K'), -1 der det ikke finnes, 0 der
+    en av dem mangler
+    """
+    resultat = np.zeros( len( nummer ))
+    for ii, ( nr, felt ) in enumerate( zip( nummer, tilgjengelige )):
+        if np.isnan( nr ) or not isinstance( felt, str ) or not felt.strip():
+            continue
+        feltnr = { int( treff.group( 1 )) for treff in [ re.match( r'\s*(\d+)', x ) for x in felt.split( ',' ) ] if treff }
+        if feltnr:
+            resultat[ii] = 1.0 if int( nr ) in feltnr else -1.0
+    return resultat
+
+def poeng( flertydig, maksAvstand=100 ):
+    """
+    Poeng for alle kandidatpar i den flertydige koblingen
+
+    ARGUMENTS
+        flertydig: pandas dataframe fra tolkapar.sammenstill, én rad per kandidatpar ( APAR-felt, NVDB-objekt )
+
+    KEYWORDS:
+        maksAvstand: Avstand (meter) der avstandspoenget er 0. Kortere avstand gir positive poeng, lengre negative
+
+    RETURNS
+        pandas dataframe med én rad per kandidatpar, delpoeng, avstand og poengsum
+    """
+    df = pd.DataFrame( flertydig ).reset_index( drop=True )
+    par = df[ [ x for x in aparkolonner + nvdbkolonner if x in df.columns ] ].copy()
+    if 'geometry' in par.columns:
+        par = par.drop( columns='geometry' )
+
+    nummer = feltnummer( df['tollStationLane'] )
+    side = feltside( nummer )
+    par['retning'] = _enighet( side, feltplassering.skalHaStedfest( df ))
+    par['stedfesting'] = _enighet( side, feltplassering.harStedfest( df ))
+
+    trans = Transformer.from_crs( "EPSG:4326", "EPSG:25833", always_xy=True )
+    x, y = trans.transform( df['lon'].to_numpy( dtype=float ), df['lat'].to_numpy( dtype=float ))
+    nvdbgeom = shapely.from_wkt( df['geometri'].to_numpy(), on_invalid='ignore' )
+    avstand = np.hypot( np.asarray( x ) - shapely.get_x( nvdbgeom ), np.asarray( y ) - shapely.get_y( nvdbgeom ))
+    avstand[ ~np.isfinite( avstand ) ] = np.nan
+    par['avstand'] = avstand.round( 1 )
+    par['avstand poeng'] = np.where( ~np.isfinite( avstand ), 0.0, np.clip( 1 - avstand / maksAvstand, -1, 1 ))
+
+    tilgjengelige = df['tilgjengeligeKjfelt'] if 'tilgjengeligeKjfelt' in df.columns else pd.Series( None, index=df.index )
+    par['feltFinnes'] = _feltFinnes( nummer, tilgjengelige.to_numpy( dtype=object ))
+
+    par['poeng'] = ( vekter['retning'] * par['retning'] + vekter['stedfesting'] * par['stedfesting'] +
+                     vekter['avstand'] * par['avstand poeng'] + vekter['feltFinnes'] * par['feltFinnes'] ).round( 3 )
+    return par
+
+def tildel( par, margin=0.5, minPoeng=0.0 ):
+    """
+    Tildeler hvert APAR-felt til kandidaten med høyest poengsum, når den er entydig bedre enn nest beste
+
+    ARGUMENTS
+        par: pandas dataframe fra poeng()
+
+    KEYWORDS:
+        margin: Minste forsprang i poeng til nest beste kandidat
+
+        minPoeng: Beste kandidat må ha poengsum over dette
+
+    RETURNS
+        pandas dataframe med én rad per APAR-felt: tildelt nvdbId, poeng, forsprang, antall kandidater og
+        status 'entydig' eller 'uavklart'
+    """
+    sortert = par.sort_values( [ 'tollStationKey', 'poeng' ], ascending=[ True, False ], kind='stable' )
+    plass = sortert.groupby( 'tollStationKey' ).cumcount()
+    beste = sortert[ plass == 0 ].set_index( 'tollStationKey' )
+    nest = sortert[ plass == 1 ].set_index( 'tollStationKey' )['poeng']
+
+    kolonner = [ x for x in [ 'operatorId', 'tollStationCode', 'tollStationName', 'tollStationLane', 'nvdbId', 'poeng' ] if x in beste.columns ]
+    tildeling = beste[kolonner].copy()
+    tildeling['forsprang'] = ( tildeling['poeng'] - nest.reindex( tildeling.index )).round( 3 )
+    tildeling['kandidater'] = sortert.groupby( 'tollStationKey' ).size().reindex( tildeling.index )
+    entydig = ( tildeling['forsprang'].fillna( np.inf ) >= margin ) & ( tildeling['poeng'] > minPoeng )
+    tildeling['status'] = np.where( entydig, 'entydig', 'uavklart' )
+    # Uavklarte felt er ikke tildelt noe NVDB-objekt, men vi viser den beste kandidaten
+    tildeling['beste nvdbId'] = tildeling['nvdbId']
+    tildeling['nvdbId'] = tildeling['nvdbId'].where( entydig )
+    return tildeling.reset_index()
+
+def losFlertydige( flertydig, maksAvstand=100, margin=0.5, minPoeng=0.0 ):
+    """
+    Poeng og tildeling for alle flertydige koblinger i én omgang, se poeng() og tildel()
+
+    RETURNS
+        dictionary med 'poeng' (ett kandidatpar per rad) og 'tildeling' (ett APAR-felt per rad)
+    """
+    if len( flertydig ) == 0:
+        return { 'poeng' : pd.DataFrame( columns=aparkolonner + [ 'nvdbId', 'poeng' ] ),
+                 'tildeling' : pd.DataFrame( columns=[ 'tollStationKey', 'operatorId', 'tollStationCode', 'nvdbId', 'poeng',
+                                                       'forsprang', 'kandidater', 'status', 'beste nvdbId' ] ) }
+    par = poeng( flertydig, maksAvstand=maksAvstand )
+    tildeling = tildel( par, margin=margin, minPoeng=minPoeng )
+    print( f"Flertydig kobling: {int( ( tildeling['status'] == 'entydig' ).sum() )} av {len( tildeling )} APAR-felt tildelt NVDB-objekt automatisk")
+    return { 'poeng' : par, 'tildeling' : tildeling }
+
+def _entydigeTakster( df, nokkel ):
+    """
+    Nøklene der alle radene har samme APAR-takster i øre (manglende takst regnes som egen verdi)
+    """
+    takster = [ t['ore'] for t in aparmodell.nvdbtakster ]
+    antall = df.groupby( nokkel, dropna=False )[takster].nunique( dropna=False )
+    return antall.index[ ( antall <= 1 ).all( axis=1 ) ]
+
+def takstrader( flertydig, tildeling, felttakster ):
+    """
+    Én rad per flertydig NVDB-objekt med entydige APAR-takster, til endringssettet
+
+    For NVDB-objekter med tildelte felt brukes takstene fra de tildelte feltene, og de må være like. NVDB-objekter
+    uten tildelte felt tas med når alle feltene på APAR-stasjonen har samme takst. Resten hoppes over, med utskrift
+
+    ARGUMENTS
+        flertydig: pandas dataframe fra tolkapar.sammenstill
+
+        tildeling: pandas dataframe fra tildel()
+
+        felttakster: pandas dataframe med tollStationKey og APAR-takstene per felt, både i kroner og øre (se
+                     aparmodell.nvdbtakster, nøklene 'apar' og 'ore')
+
+    RETURNS
+        pandas dataframe med samme kolonner som flertydig
+    """
+    takster = [ t['apar'] for t in aparmodell.nvdbtakster ] + [ t['ore'] for t in aparmodell.nvdbtakster ]
+    if len( flertydig ) == 0:
+        return flertydig.iloc[0:0]
+    df = pd.DataFrame( flertydig ).reset_index( drop=True )
+    felttakster = felttakster.drop_duplicates( subset='tollStationKey' ).set_index( 'tollStationKey' )
+    nye = felttakster.reindex( df['tollStationKey'] )[takster].reset_index( drop=True )
+    for kolonne in takster:
+        df[kolonne] = nye[kolonne].array
+    df['_stasjon'] = df['operatorId'].astype( str ) + '_' + df['tollStationCode'].astype( str )
+
+    entydig = tildeling[ tildeling['status'] == 'entydig' ]
+    tildelt = pd.MultiIndex.from_arrays( [ df['tollStationKey'], df['nvdbId'] ] ).isin(
+                pd.MultiIndex.from_arrays( [ entydig['tollStationKey'], entydig['nvdbId'].astype( df['nvdbId'].dtype ) ] ))
+    medFelt = df[tildelt]
+    rader = [ medFelt[ medFelt['nvdbId'].isin( _entydigeTakster( medFelt, 'nvdbId' )) ] ]
+
+    utenFelt = df[ ~df['nvdbId'].isin( medFelt['nvdbId'] ) ]
+    rader.append( utenFelt[ utenFelt['_stasjon'].isin( _entydigeTakster( df, '_stasjon' )) ] )
+
+    rader = pd.concat( rader ).drop_duplicates( subset='nvdbId', keep='first' ).drop( columns='_stasjon' )
+    hoppetOver = sorted( set( df['nvdbId'] ) - set( rader['nvdbId'] ))
+    if hoppetOver:
+        print( f"Flertydig kobling: Hopper over takster for {len( hoppetOver )} NVDB-objekter med ulike APAR-takster: {hoppetOver}")
+    return rader
@@ -0,0 +1,396 @@
+"""
+Hendelseslogg for endringer i takster og kvalitetsfunn, med offset per konsument, servert med long-poll og
+server-sent events (SSE)
+
+Etter hver kjøring legger tolkapar.py endringene fra endringsrapport til som hendelser i en lokal logg (én json per
+linje, kun tillegg). Hver hendelse får et fortløpende offset, og inneholder tabell, stasjon (nøkkel), felt, før- og
+etter-verdi og dato endringen gjelder fra (activeFrom for den gjeldende APAR-prisen der den er kjent, ellers dagens
+dato). Konsumenter (f.eks skrivTakster2nvdb.py) kan dermed reagere i løpet av
+sekunder, i stedet for å laste ned bomstasjon_endringssett.json med jevne mellomrom
+
+Loggen skrives med fil-lås og fsync, slik at den tåler at flere prosesser skriver og at prosessen dør midt i
+en skriving (ufullstendige linjer på slutten ignoreres og kuttes bort ved neste skriving). Hver konsument har
+et lagret offset (neste hendelse den skal ha), i <mappe>/konsumenter.json
+
+Hendelsene fra én kjøring merkes med sjekksummen av tabellene det ble sammenlignet med (kjoring). Kjøres tolkapar.py
+på nytt fra samme utgangspunkt, f.eks fordi lagringen av tabellene feilet, legges de samme hendelsene ikke til igjen
+
+Endepunkter:
+    GET  /hendelser?fra=<offset>&konsument=<navn>&vent=<sekunder>&antall=<maks>
+         Long-poll: Svarer med en gang hvis det finnes hendelser fra offset, ellers ventes det inntil vent sekunder.
+         Uten fra brukes lagret offset for konsumenten
+    GET  /strom?fra=<offset>&konsument=<navn>
+         Server-sent events, id er offset. Last-Event-ID fra klienten gjenopptar strømmen
+    POST /konsumenter/<navn>?offset=<offset>     Lagrer offset (neste hendelse konsumenten skal ha)
+    GET  /konsumenter
+    GET  /status
+
+Bruk:
+    python hendelseslogg.py [port]
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from datetime import datetime, date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+import numpy as np
+import pandas as pd
+
+# Hvilke endringer fra endringsrapport som blir hendelser: tabell og felt (None = alle felt)
+hendelsesfelt = {
+    'merged'        : [ 'APAR takst liten bil', 'APAR Rustid takst liten bil', 'APAR takst stor bensinbil', 'APAR Rustid takst stor bensinbil',
+                        'Takst liten bil', 'Rushtidstakst liten bil', 'Takst stor bil', 'Rushtidstakst stor bil' ],
+    'takstmatrise'  : None,
+    'kvalitetsfunn' : None,
+}
+
+def _jsonverdi( verdi ):
+    """
+    Verdi som kan skrives som json: None for manglende verdier, numpy-typer som python-typer, ellers tekst
+    """
+    if isinstance( verdi, ( list, tuple, dict )):
+        return str( verdi )
+    try:
+        if pd.isnull( verdi ):
+            return None
+    except ( TypeError, ValueError ):
+        pass
+    if isinstance( verdi, np.generic ):
+        return verdi.item()
+    if isinstance( verdi, ( int, float, str, bool )):
+        return verdi
+    return str( verdi )
+
+def _signatur( hendelse ):
+    """
+    Det som skiller to hendelser fra hverandre, uten offset og tidspunkt
+    """
+    return json.dumps( [ hendelse.get( x ) for x in [ 'tabell', 'nokkel', 'endring', 'felt', 'før', 'etter' ] ], ensure_ascii=False )
+
+def hendelserFraEndringer( endringer, gyldigFra=None, oppsett=None, prisstart=None, kjoring=None ):
+    """
+    Lager hendelser av endringene fra endringsrapport.sammenlignKjoringer
+
+    ARGUMENTS
+        endringer: pandas dataframe fra endringsrapport
+
+    KEYWORDS:
+        gyldigFra: None (default, dvs i dag) eller dato endringene gjelder fra. Endringssettet til NVDB
+                   bruker dagens dato som startdato, så det er også default her
+
+        oppsett: None (default, dvs hendelsesfelt) eller dictionary på samme form
+
+        prisstart: None (default) eller pandas dataframe med kolonnene tabell, nokkel (tekst, som i endringer), felt
+                   og gyldigFra (se tolkapar.lagPrisstart). Endringer i disse feltene får gyldigFra herfra i stedet for default
+
+        kjoring: None (default) eller identifikator for kjøringen, legges til hver hendelse
+
+    RETURNS
+        Liste med hendelser (dictionaries), uten offset
+    """
+    if oppsett is None:
+        oppsett = hendelsesfelt
+    gyldigFra = gyldigFra or date.today()
+    gyldigFra = gyldigFra[0:10] if isinstance( gyldigFra, str ) else gyldigFra.isoformat()[0:10]
+    startdato = {}
+    if prisstart is not None and len( prisstart ):
+        startdato = dict( zip( zip( prisstart['tabell'], prisstart['nokkel'], prisstart['felt'] ),
+                               pd.to_datetime( prisstart['gyldigFra'] ).dt.strftime( '%Y-%m-%d' )))
+
+    hendelser = []
+    for tabell, felt in oppsett.items():
+        # Duplikate nøkler er en feil i tabellen, ikke en endring
+        utvalg = endringer[ ( endringer['tabell'] == tabell ) & ( endringer['endring'] != 'duplikat' ) ]
+        if felt is not None:
+            # Nye og fjernede rader har ikke felt, de tas alltid med
+            utvalg = utvalg[ utvalg['felt'].isnull() | utvalg['felt'].isin( felt ) ]
+        for rad in utvalg.to_dict( 'records' ):
+            hendelse = { 'tabell'    : tabell,
+                         'nokkel'    : rad['nokkel'],
+                         'endring'   : rad['endring'],
+                         'felt'      : _jsonverdi( rad['felt'] ),
+                         'før'       : _jsonverdi( rad['før'] ),
+                         'etter'     : _jsonverdi( rad['etter'] ),
+                         'gyldigFra' : startdato.get( ( tabell, rad['nokkel'], rad['felt'] ), gyldigFra ) }
+            if kjoring is not None:
+                hendelse['kjoring'] = kjoring
+            hendelser.append( hendelse )
+    return hendelser
+
+class Hendelseslogg:
+    """
+    Hendelseslogg på disk, se modulbeskrivelsen
+
+    ARGUMENTS
+        mappe: Mappe for hendelser.jsonl og konsumenter.json
+    """
+    def __init__( self, mappe ):
+        self.mappe = mappe
+        os.makedirs( mappe, exist_ok=True )
+        self.filnavn = os.path.join( mappe, 'hendelser.jsonl' )
+        self.konsumentfil = os.path.join( mappe, 'konsumenter.json' )
+        self._posisjoner = []     # Byte-posisjon for hver hendelse, indeks = offset
+        self._lest = 0            # Antall byte som er indeksert
+        self._betingelse = threading.Condition()
+        self._oppdater()
+
+    def _oppdater( self ):
+        """
+        Indekserer hendelser som er lagt til siden sist, også av andre prosesser. Ufullstendige linjer hoppes over
+        """
+        with self._betingelse:
+            if not os.path.isfile( self.filnavn ) or os.path.getsize( self.filnavn ) <= self._lest:
+                return len( self._posisjoner )
+            with open( self.filnavn, 'rb' ) as f:
+                f.seek( self._lest )
+                for linje in iter( f.readline, b'' ):
+                    if not linje.endswith( b'\n' ):
+                        break
+                    self._posisjoner.append( self._lest )
+                    self._lest += len( linje )
+            self._betingelse.notify_all()
+            return len( self._posisjoner )
+
+    def __len__( self ):
+        return self._oppdater()
+
+    def leggTil( self, hendelser ):
+        """
+        Legger hendelser til i loggen, med fortløpende offset og tidspunkt
+
+        RETURNS
+            Offset for neste hendelse (dvs antall hendelser i loggen)
+        """
+        if len( hendelser ) == 0:
+            return self._oppdater()
+        tid = datetime.now().isoformat( timespec='seconds' )
+        with open( self.filnavn, 'ab' ) as f:
+            fcntl.flock( f, fcntl.LOCK_EX )
+            try:
+                neste = self._oppdater()
+                # Rester etter en avbrutt skriving kuttes bort, så ny linje ikke blir slått sammen med en halv
+                if f.seek( 0, os.SEEK_END ) > self._lest:
+                    f.truncate( self._lest )
+                data = b''.join( [ json.dumps( dict( hendelse, offset=neste + ii, tid=tid ), ensure_ascii=False ).encode( 'utf-8' ) + b'\n'
+                                   for ii, hendelse in enumerate( hendelser ) ] )
+                f.write( data )
+                f.flush()
+                os.fsync( f.fileno() )
+            finally:
+                fcntl.flock( f, fcntl.LOCK_UN )
+        return self._oppdater()
+
+    def _fraKjoring( self, kjoring, bolk=1000 ):
+        """
+        Signaturene til hendelsene fra kjoring. Hendelsene fra én kjøring ligger samlet, så det holder å lese
+        bakfra til første hendelse fra en annen kjøring
+        """
+        signaturer = set()
+        slutt = self._oppdater()
+        while slutt > 0:
+            start = max( 0, slutt - bolk )
+            for linje in reversed( self.les( start, slutt - start )):
+                hendelse = json.loads( linje )
+                if hendelse.get( 'kjoring' ) != kjoring:
+                    return signaturer
+                signaturer.add( _signatur( hendelse ))
+            slutt = start
+        return signaturer
+
+    def leggTilEndringer( self, endringer, gyldigFra=None, prisstart=None, kjoring=None ):
+        """
+        Legger til hendelser for endringer fra endringsrapport, se hendelserFraEndringer
+
+        KEYWORDS:
+            gyldigFra, prisstart: Se hendelserFraEndringer
+
+            kjoring: None (default) eller identifikator for utgangspunktet endringene er regnet ut fra, f.eks
+                     endringsrapport.sjekksumForrige. Hendelser som allerede er lagt til fra samme kjøring hoppes over
+
+        RETURNS
+            Antall nye hendelser
+        """
+        hendelser = hendelserFraEndringer( endringer, gyldigFra=gyldigFra, prisstart=prisstart, kjoring=kjoring )
+        if kjoring is not None:
+            # Gjennom json, så verdiene sammenlignes slik de er lagret
+            lagret = self._fraKjoring( kjoring )
+            hendelser = [ x for x in hendelser if _signatur( json.loads( json.dumps( x, ensure_ascii=False ))) not in lagret ]
+        self.leggTil( hendelser )
+        print( f"Hendelseslogg: {len( hendelser )} nye hendelser, {len( self )} totalt")
+        return len( hendelser )
+
+    def les( self, fra=0, antall=1000 ):
+        """
+        Hendelser fra og med offset fra, høyst antall
+
+        RETURNS
+            Liste med hendelser som json-tekst (bytes, uten linjeskift)
+        """
+        totalt = self._oppdater()
+        fra = max( 0, fra )
+        if fra >= totalt:
+            return []
+        til = min( totalt, fra + antall )
+        with open( self.filnavn, 'rb' ) as f:
+            f.seek( self._posisjoner[fra] )
+            data = f.read( ( self._posisjoner[til] if til < totalt else self._lest ) - self._posisjoner[fra] )
+        return data.rstrip( b'\n' ).split( b'\n' )
+
+    def vent( self, fra, tidsavbrudd=30, intervall=0.5 ):
+        """
+        Venter til det finnes hendelser fra og med offset fra, eller tidsavbrudd (sekunder)
+
+        RETURNS
+            True hvis det finnes nye hendelser
+        """
+        slutt = time.monotonic() + tidsavbrudd
+        while self._oppdater() <= fra:
+            igjen = slutt - time.monotonic()
+            if igjen <= 0:
+                return False
+            # Nye hendelser fra denne prosessen vekker oss med en gang, fra andre prosesser innen intervall
+            with self._betingelse:
+                self._betingelse.wait( min( intervall, igjen ))
+        return True
+
+    def konsumenter( self ):
+        """
+        Lagret offset per konsument
+        """
+        if not os.path.isfile( self.konsumentfil ):
+            return {}
+        with open( self.konsumentfil ) as f:
+            return json.load( f )
+
+    def offset( self, konsument ):
+        """
+        Lagret offset for konsument (neste hendelse den skal ha), 0 for nye konsumenter
+        """
+        return self.konsumenter().get( konsument, 0 )
+
+    def bekreft( self, konsument, offset ):
+        """
+        Lagrer offset for konsument, dvs at alle hendelser før offset er behandlet
+        """
+        with open( self.konsumentfil + '.las', 'w' ) as las:
+            fcntl.flock( las, fcntl.LOCK_EX )
+            konsumenter = self.konsumenter()
+            konsumenter[konsument] = int( offset )
+            with open( self.konsumentfil + '.tmp', 'w' ) as f:
+                json.dump( konsumenter, f, indent=4, ensure_ascii=False )
+                f.flush()
+                os.fsync( f.fileno() )
+            os.replace( self.konsumentfil + '.tmp', self.konsumentfil )
+        return konsumenter
+
+    def status( self ):
+        return { 'hendelser' : len( self ), 'konsumenter' : self.konsumenter() }
+
+class Hendelsesbehandler( BaseHTTPRequestHandler ):
+    logg = None
+    protocol_version = 'HTTP/1.1'
+    # Kommentar-linje i SSE-strømmen med dette intervallet, slik at mellomtjenere ikke kobler fra
+    hjerteslag = 15
+
+    def _svar( self, kode, data ):
+        if not isinstance( data, bytes ):
+            data = json.dumps( data, ensure_ascii=False ).encode( 'utf-8' )
+        self.send_response( kode )
+        self.send_header( 'Content-Type', 'application/json; charset=utf-8' )
+        self.send_header( 'Content-Length', str( len( data )))
+        self.end_headers()
+        self.wfile.write( data )
+
+    def _fra( self, parametre ):
+        if 'fra' in parametre:
+            return int( parametre['fra'][0] )
+        if self.headers.get( 'Last-Event-ID' ):
+            return int( self.headers['Last-Event-ID'] ) + 1
+        if 'konsument' in parametre:
+            return self.logg.offset( parametre['konsument'][0] )
+        return 0
+
+    def _hendelser( self, parametre ):
+        fra = self._fra( parametre )
+        antall = min( 10000, int( parametre.get( 'antall', [1000] )[0] ))
+        vent = min( 300, float( parametre.get( 'vent', [0] )[0] ))
+        if vent > 0:
+            self.logg.vent( fra, tidsavbrudd=vent )
+        hendelser = self.logg.les( fra, antall=antall )
+        self._svar( 200, b'{"fra": ' + str( fra ).encode( 'ascii' ) + b', "neste": ' + str( fra + len( hendelser )).encode( 'ascii' ) +
+                         b', "hendelser": [' + b','.join( hendelser ) + b']}' )
+
+    def _strom( self, parametre ):
+        fra = self._fra( parametre )
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'text/event-stream; charset=utf-8' )
+        self.send_header( 'Cache-Control', 'no-cache' )
+        self.send_header( 'Connection', 'close' )
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                if not self.logg.vent( fra, tidsavbrudd=self.hjerteslag ):
+                    self.wfile.write( b': hjerteslag\n\n' )
+                    self.wfile.flush()
+                    continue
+                for hendelse in self.logg.les( fra ):
+                    self.wfile.write( b'id: ' + str( fra ).encode( 'ascii' ) + b'\nevent: endring\ndata: ' + hendelse + b'\n\n' )
+                    fra += 1
+                self.wfile.flush()
+        except ( BrokenPipeError, ConnectionResetError ):
+            pass
+
+    def do_GET( self ):
+        url = urlparse( self.path )
+        deler = [ unquote( x ) for x in url.path.strip( '/' ).split( '/' ) if x ]
+        parametre = parse_qs( url.query )
+        try:
+            if deler == [ 'hendelser' ]:
+                self._hendelser( parametre )
+            elif deler == [ 'strom' ]:
+                self._strom( parametre )
+            elif deler == [ 'konsumenter' ]:
+                self._svar( 200, self.logg.konsumenter() )
+            elif deler == [ 'status' ]:
+                self._svar( 200, self.logg.status() )
+            else:
+                self._svar( 404, { 'feil' : f"Ukjent endepunkt {url.path}" } )
+        except ( KeyError, ValueError ) as e:
+            self._svar( 400, { 'feil' : f"Ugyldig forespørsel: {e}" } )
+
+    def do_POST( self ):
+        url = urlparse( self.path )
+        deler = [ unquote( x ) for x in url.path.strip( '/' ).split( '/' ) if x ]
+        parametre = parse_qs( url.query )
+        if int( self.headers.get( 'Content-Length', 0 )):
+            self.rfile.read( int( self.headers['Content-Length'] ))
+        try:
+            if len( deler ) == 2 and deler[0] == 'konsumenter':
+                self._svar( 200, { deler[1] : self.logg.bekreft( deler[1], int( parametre['offset'][0] ))[ deler[1] ] } )
+            else:
+                self._svar( 404, { 'feil' : f"Ukjent endepunkt {url.path}" } )
+        except ( KeyError, ValueError ) as e:
+            self._svar( 400, { 'feil' : f"Ugyldig forespørsel: {e}" } )
+
+    def log_message( self, format, *args ):
+        pass
+
+def start( mappe, port=8081, vert='127.0.0.1' ):
+    """
+    Starter hendelsestjenesten for loggen i mappe (blokkerer)
+    """
+    Hendelsesbehandler.logg = Hendelseslogg( mappe )
+    print( f"Hendelsestjeneste på http://{vert}:{port}/ {Hendelsesbehandler.logg.status()}")
+    ThreadingHTTPServer( ( vert, port ), Hendelsesbehandler ).serve_forever()
+
+
+if __name__ == '__main__':
+    mappe = '/mnt/c/DATA/leveranser/apardata/hendelser/'
+    port = int( sys.argv[1] ) if len( sys.argv ) > 1 else 8081
+    start( mappe, port=port )
@@ -0,0 +1,353 @@
+"""
+Historikk over APAR- og NVDB-takster, lagret som parquet-filer partisjonert på dato
+
+Hver kjøring legger til dagens tilstand, men kun for de bomstasjonene som er endret siden forrige gang
+(sammenlignet på sjekksum per stasjon). Nye, endrede og fjernede stasjoner lagres i
+    <mappe>/<kilde>/dato=YYYY-MM-DD/del-NNN.parquet
+der kilde er apar eller nvdb. Siste kjente sjekksum per stasjon ligger i <mappe>/<kilde>/sjekksummer.json
+
+APAR lagres i langt format, én rad per prisintervall (felt x kjøretøyklasse x pristype x periode), slik at
+spørringer som "alle prisendringer for operatør X i 2025" kun leser de kolonnene og radene som trengs
+
+Store APAR-dumper kan legges til i bolker (f.eks én operatør om gangen) med aparInnlesing, da holdes kun én
+bolk i minnet. Stasjoner som ikke er med i noen av bolkene regnes som fjernet når innlesingen avsluttes
+
+Eksempel:
+    hist = historikk.Historikk( mappe + 'historikk/' )
+    hist.leggTilApar( apardump )
+
+    with hist.aparInnlesing() as innlesing:
+        for bolk in bolker:
+            innlesing.leggTil( bolk )
+
+    endringer = hist.prisendringer( 100120, '2025-01-01', '2026-01-01' )
+"""
+import os
+import json
+import glob
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime, date
+
+import numpy as np
+import pandas as pd
+
+import aparmodell
+
+# Egenskaper fra NVDB som tas vare på i historikken
+nvdbkolonner = [ 'nvdbId', 'versjon', 'Operatør_Id', 'Bomstasjon_Id', 'Navn bomstasjon',
+                 'Takst liten bil', 'Takst stor bil', 'Rushtidstakst liten bil', 'Rushtidstakst stor bil',
+                 'Tidsdifferensiert takst', 'Timesregel', 'Timesregel, varighet', 'Timesregel, passeringsgruppe',
+                 'Rushtid morgen, fra', 'Rushtid morgen, til', 'Rushtid ettermiddag, fra', 'Rushtid ettermiddag, til' ]
+
+# Kolonnene i APAR-historikken
+aparkolonner = [ 'operatorId', 'tollStationKey', 'tollStationCode', 'tollStationName', 'tollStationLane',
+                 'klasse', 'pristype', 'pris', 'activeFrom', 'activeTo', 'endring', 'sjekksum' ]
+
+def sjekksum( data ) -> str:
+    """
+    sha256 for json-representasjonen av data (sorterte nøkler)
+    """
+    return hashlib.sha256( json.dumps( data, sort_keys=True, default=str, ensure_ascii=False ).encode( 'utf-8' )).hexdigest()
+
+def _dato( verdi ):
+    if verdi is None:
+        return date.today().isoformat()
+    if isinstance( verdi, ( datetime, date )):
+        return verdi.isoformat()[0:10]
+    return str( verdi )[0:10]
+
+class Historikk:
+    """
+    Historikk over takster, se modulbeskrivelsen
+
+    ARGUMENTS
+        mappe: Rotmappe for historikken
+    """
+    def __init__( self, mappe ):
+        self.mappe = mappe
+
+    def _kildemappe( self, kilde ):
+        return os.path.join( self.mappe, kilde )
+
+    def _lesSjekksummer( self, kilde ):
+        filnavn = os.path.join( self._kildemappe( kilde ), 'sjekksummer.json' )
+        if not os.path.isfile( filnavn ):
+            return {}
+        with open( filnavn ) as f:
+            return json.load( f )
+
+    def _skrivSjekksummer( self, kilde, sjekksummer ):
+        filnavn = os.path.join( self._kildemappe( kilde ), 'sjekksummer.json' )
+        with open( filnavn + '.tmp', 'w' ) as f:
+            json.dump( sjekksummer, f )
+        os.replace( filnavn + '.tmp', filnavn )
+
+    def _skrivDel( self, kilde, dato, df ):
+        """
+        Skriver en ny del-fil i datopartisjonen
+        """
+        partisjon = os.path.join( self._kildemappe( kilde ), 'dato=' + dato )
+        os.makedirs( partisjon, exist_ok=True )
+        nr = len( glob.glob( os.path.join( partisjon, 'del-*.parquet' )))
+        filnavn = os.path.join( partisjon, f"del-{nr:03d}.parquet" )
+        df.to_parquet( filnavn + '.tmp', index=False )
+        os.replace( filnavn + '.tmp', filnavn )
+        return filnavn
+
+    def _endringer( self, kilde, nyeSjekksummer, komplett=True ):
+        """
+        Sammenligner sjekksummer med forrige kjente tilstand
+
+        RETURNS
+            tuple ( endrede nøkler : dictionary nøkkel -> 'ny' | 'endret', fjernede nøkler : liste, alle sjekksummer )
+        """
+        gamle = self._lesSjekksummer( kilde )
+        endret = { k : ( 'endret' if k in gamle else 'ny' ) for k, v in nyeSjekksummer.items() if gamle.get( k ) != v }
+        fjernet = [ k for k in gamle if k not in nyeSjekksummer ] if komplett else []
+        alle = dict( gamle ) if not komplett else {}
+        alle.update( nyeSjekksummer )
+        return ( endret, fjernet, alle )
+
+    def leggTilApar( self, apardump, dato=None, komplett=True ):
+        """
+        Legger til APAR-tilstand, kun stasjoner (tollStationKey) med endret innhold lagres
+
+        ARGUMENTS
+            apardump: Liste med APAR-data (dictionaries), slik de kommer fra APAR-api'et
+
+        KEYWORDS:
+            dato: None (default, dvs i dag) eller dato for tilstanden
+
+            komplett: True (default) | False. Om apardump er komplett; i så fall regnes manglende stasjoner som fjernet.
+                      Sett til False når data legges til i flere omganger (f.eks én operatør om gangen)
+
+        RETURNS
+            Antall nye, endrede eller fjernede stasjoner
+        """
+        dato = _dato( dato )
+        nyeSjekksummer = { str( rad['tollStationKey'] ) : sjekksum( rad ) for rad in apardump }
+        endret, fjernet, alle = self._endringer( 'apar', nyeSjekksummer, komplett=komplett )
+        if len( endret ) == 0 and len( fjernet ) == 0:
+            return 0
+
+        utvalg = [ rad for rad in apardump if str( rad['tollStationKey'] ) in endret ]
+        df = aparTilTabell( utvalg, nyeSjekksummer, endret )
+        if fjernet:
+            df = pd.concat( [ df, pd.DataFrame( { 'tollStationKey' : fjernet, 'endring' : 'fjernet' } ) ], ignore_index=True )
+        self._skrivDel( 'apar', dato, _aparSkjema( df ))
+        self._skrivSjekksummer( 'apar', alle )
+        return len( endret ) + len( fjernet )
+
+    @contextmanager
+    def aparInnlesing( self, dato=None ):
+        """
+        Context manager for å legge til APAR-tilstand i bolker, se Aparinnlesing. Stasjoner som ikke var med
+        i noen bolk regnes som fjernet når blokken er ferdig. Feiler blokken registreres ingen fjernede stasjoner,
+        og sjekksummene blir ikke oppdatert
+
+        RETURNS
+            Aparinnlesing, antall nye, endrede eller fjernede stasjoner ligger i .antall etter blokken
+        """
+        innlesing = Aparinnlesing( self, dato=dato )
+        yield innlesing
+        innlesing.avslutt()
+
+    def leggTilNvdb( self, nvdbAlle, dato=None ):
+        """
+        Legger til NVDB-tilstand (takstegenskapene for objekttype 45), kun endrede objekter lagres
+
+        ARGUMENTS
+            nvdbAlle: pandas dataframe med NVDB bomstasjoner
+
+        RETURNS
+            Antall nye, endrede eller fjernede objekter
+        """
+        dato = _dato( dato )
+        kolonner = [ x for x in nvdbkolonner if x in nvdbAlle.columns ]
+        df = pd.DataFrame( nvdbAlle[kolonner] ).copy()
+        for kol in nvdbkolonner:
+            if kol not in df.columns:
+                df[kol] = None
+
+        poster = json.loads( df.to_json( orient='records', force_ascii=False ))
+        nyeSjekksummer = { str( rad['nvdbId'] ) : sjekksum( rad ) for rad in poster }
+        endret, fjernet, alle = self._endringer( 'nvdb', nyeSjekksummer )
+        if len( endret ) == 0 and len( fjernet ) == 0:
+            return 0
+
+        df = df[ df['nvdbId'].astype( str ).isin( endret ) ].copy()
+        df['endring'] = df['nvdbId'].astype( str ).map( endret )
+        df['sjekksum'] = df['nvdbId'].astype( str ).map( nyeSjekksummer )
+        if fjernet:
+            df = pd.concat( [ df, pd.DataFrame( { 'nvdbId' : [ int( x ) for x in fjernet ], 'endring' : 'fjernet' } ) ], ignore_index=True )
+        self._skrivDel( 'nvdb', dato, _nvdbSkjema( df ))
+        self._skrivSjekksummer( 'nvdb', alle )
+        return len( endret ) + len( fjernet )
+
+    def partisjoner( self, kilde, fra=None, til=None ):
+        """
+        Del-filer for datopartisjoner med fra <= dato < til
+        """
+        filer = []
+        for partisjon in sorted( glob.glob( os.path.join( self._kildemappe( kilde ), 'dato=*' ))):
+            dato = os.path.basename( partisjon )[5:]
+            if ( fra is None or dato >= _dato( fra )) and ( til is None or dato < _dato( til )):
+                filer.extend( [ ( dato, x ) for x in sorted( glob.glob( os.path.join( partisjon, 'del-*.parquet' ))) ] )
+        return filer
+
+    def les( self, kilde, fra=None, til=None, kolonner=None, filtre=None ):
+        """
+        Leser historikk for datopartisjoner med fra <= dato < til
+
+        KEYWORDS:
+            kolonner: None (default, alle) eller liste med kolonner
+
+            filtre: None (default) eller filter på pyarrow-form, f.eks [ ('operatorId', '==', 100120) ]
+
+        RETURNS
+            pandas dataframe med kolonnene dato og del (filnavn) i tillegg
+        """
+        deler = []
+        for dato, filnavn in self.partisjoner( kilde, fra=fra, til=til ):
+            df = pd.read_parquet( filnavn, columns=kolonner, filters=filtre )
+            df['dato'] = dato
+            df['del'] = os.path.basename( filnavn )
+            deler.append( df )
+        if not deler:
+            return pd.DataFrame( columns=( kolonner or [] ) + [ 'dato', 'del' ] )
+        return pd.concat( deler, ignore_index=True )
+
+    def tilstand( self, kilde, dato=None ):
+        """
+        Rekonstruerer tilstanden slik den var ved utgangen av en gitt dato
+
+        RETURNS
+            pandas dataframe med siste versjon av hver stasjon (APAR: alle prisrader for stasjonen)
+        """
+        til = ( pd.Timestamp( _dato( dato )) + pd.Timedelta( days=1 )).date().isoformat()
+        df = self.les( kilde, til=til )
+        if len( df ) == 0:
+            return df
+        nokkel = 'tollStationKey' if kilde == 'apar' else 'nvdbId'
+        # Siste versjon av en stasjon er alle radene fra den siste del-fila stasjonen forekommer i
+        df['_versjon'] = df['dato'] + '/' + df['del']
+        siste = df.groupby( nokkel )['_versjon'].transform( 'max' )
+        df = df[ ( df['_versjon'] == siste ) & ( df['endring'] != 'fjernet' ) ]
+        return df.drop( columns='_versjon' ).reset_index( drop=True )
+
+    def prisendringer( self, operatorId, fra, til ):
+        """
+        Alle APAR-prisintervaller for en operatør som starter i perioden fra <= activeFrom < til
+
+        Samme prisintervall kan forekomme i flere øyeblikksbilder (fordi andre deler av stasjonen er endret),
+        de tas bare med én gang, første gang de er sett
+
+        RETURNS
+            pandas dataframe sortert på activeFrom
+        """
+        fra = pd.Timestamp( _dato( fra ))
+        til = pd.Timestamp( _dato( til ))
+        df = self.les( 'apar', kolonner=[ 'operatorId', 'tollStationKey', 'tollStationName', 'klasse', 'pristype', 'pris', 'activeFrom', 'activeTo' ],
+                       filtre=[ ( 'operatorId', '==', int( operatorId )), ( 'activeFrom', '>=', fra ), ( 'activeFrom', '<', til ) ] )
+        df = df.drop_duplicates( subset=[ 'tollStationKey', 'klasse', 'pristype', 'activeFrom', 'activeTo', 'pris' ], keep='first' )
+        return df.drop( columns='del' ).rename( columns={ 'dato' : 'sett første gang' } ).sort_values( [ 'activeFrom', 'tollStationKey', 'klasse', 'pristype' ] ).reset_index( drop=True )
+
+class Aparinnlesing:
+    """
+    Legger til APAR-tilstand i bolker, hver bolk normaliseres og skrives som egen del-fil med en gang.
+    Kun sjekksummene (én per stasjon) holdes i minnet mellom bolkene. Lages med Historikk.aparInnlesing
+    """
+    def __init__( self, historikk, dato=None ):
+        self.historikk = historikk
+        self.dato = _dato( dato )
+        self.antall = 0
+        self._gamle = historikk._lesSjekksummer( 'apar' )
+        self._sjekksummer = {}
+
+    def leggTil( self, bolk ):
+        """
+        Legger til en bolk med APAR-data (liste med dictionaries, f.eks alle stasjoner for én operatør)
+
+        RETURNS
+            Antall nye eller endrede stasjoner i bolken
+        """
+        nyeSjekksummer = { str( rad['tollStationKey'] ) : sjekksum( rad ) for rad in bolk }
+        self._sjekksummer.update( nyeSjekksummer )
+        endret = { k : ( 'endret' if k in self._gamle else 'ny' ) for k, v in nyeSjekksummer.items() if self._gamle.get( k ) != v }
+        if len( endret ) == 0:
+            return 0
+
+        utvalg = [ rad for rad in bolk if str( rad['tollStationKey'] ) in endret ]
+        self.historikk._skrivDel( 'apar', self.dato, _aparSkjema( aparTilTabell( utvalg, nyeSjekksummer, endret )))
+        self.antall += len( endret )
+        return len( endret )
+
+    def avslutt( self ):
+        """
+        Registrerer stasjoner som ikke var med i noen bolk som fjernet, og lagrer sjekksummene
+
+        RETURNS
+            Antall nye, endrede eller fjernede stasjoner
+        """
+        fjernet = [ k for k in self._gamle if k not in self._sjekksummer ]
+        if fjernet:
+            df = pd.DataFrame( { 'tollStationKey' : fjernet, 'endring' : 'fjernet' } ).reindex( columns=aparkolonner )
+            self.historikk._skrivDel( 'apar', self.dato, _aparSkjema( df ))
+            self.antall += len( fjernet )
+        if self.antall:
+            self.historikk._skrivSjekksummer( 'apar', self._sjekksummer )
+        return self.antall
+
+def aparTilTabell( apardump, sjekksummer, endret ):
+    """
+    Gjør om APAR-data til langt format, én rad per prisintervall. Felt uten priser får én rad uten pris
+    """
+    apar = aparmodell.AparData.fraApar( apardump )
+    priser = apar.priser
+    felt = apar.felt
+    df = pd.DataFrame( { 'felt'       : priser.felt,
+                         'klasse'     : np.array( priser.klasser, dtype=object )[ priser.klasse ] if len( priser ) else [],
+                         'pristype'   : np.array( priser.pristyper, dtype=object )[ priser.pristype ] if len( priser ) else [],
+                         'pris'       : aparmodell.tilKroner( priser.ore ),
+                         'activeFrom' : priser.fra,
+                         'activeTo'   : priser.til } )
+    utenPris = sorted( set( range( len( felt ))) - set( priser.felt.tolist() ))
+    if utenPris:
+        df = pd.concat( [ df, pd.DataFrame( { 'felt' : utenPris } ) ], ignore_index=True )
+
+    nokler = [ str( f.tollStationKey ) for f in felt ]
+    indeks = df['felt'].to_numpy( dtype=np.int64 )
+    df['operatorId'] = [ felt[ii].operatorId for ii in indeks ]
+    df['tollStationKey'] = [ nokler[ii] for ii in indeks ]
+    df['tollStationCode'] = [ felt[ii].tollStationCode for ii in indeks ]
+    df['tollStationName'] = [ felt[ii].tollStationName for ii in indeks ]
+    df['tollStationLane'] = [ felt[ii].tollStationLane for ii in indeks ]
+    df['endring'] = df['tollStationKey'].map( endret )
+    df['sjekksum'] = df['tollStationKey'].map( sjekksummer )
+    return df.drop( columns='felt' )
+
+def _aparSkjema( df ):
+    """
+    Faste datatyper, slik at alle del-filer har samme skjema
+    """
+    df = df.copy()
+    df['operatorId'] = pd.to_numeric( df.get( 'operatorId' ), errors='coerce' ).astype( 'Int64' )
+    for kol in [ 'tollStationKey', 'tollStationCode', 'tollStationName', 'tollStationLane', 'klasse', 'pristype', 'endring', 'sjekksum' ]:
+        if kol not in df.columns:
+            df[kol] = None
+        df[kol] = df[kol].astype( 'string' )
+    df['pris'] = pd.to_numeric( df.get( 'pris' ), errors='coerce' ).astype( 'float64' )
+    for kol in [ 'activeFrom', 'activeTo' ]:
+        df[kol] = pd.to_datetime( df.get( kol ))
+    return df[ aparkolonner ]
+
+def _nvdbSkjema( df ):
+    df = df.copy()
+    df['nvdbId'] = pd.to_numeric( df['nvdbId'] ).astype( 'Int64' )
+    df['versjon'] = pd.to_numeric( df['versjon'], errors='coerce' ).astype( 'Int64' )
+    for kol in [ 'Operatør_Id', 'Bomstasjon_Id', 'Takst liten bil', 'Takst stor bil', 'Rushtidstakst liten bil', 'Rushtidstakst stor bil' ]:
+        df[kol] = pd.to_numeric( df[kol], errors='coerce' ).astype( 'float64' )
+    for kol in [ x for x in nvdbkolonner + [ 'endring', 'sjekksum' ] if df[x].dtype == object ]:
+        df[kol] = df[kol].astype( 'string' )
+    return df[ nvdbkolonner + [ 'endring', 'sjekksum' ] ]
@@ -0,0 +1,266 @@
+"""
+Felles HTTP-klient med lokal cache og betingede spørringer (ETag / Last-Modified)
+
+Svaret fra hver GET-spørring lagres på disk sammen med ETag og Last-Modified. Neste gang samme
+ressurs hentes sendes If-None-Match / If-Modified-Since, og ved 304 Not Modified returneres det lagrede
+svaret. Ferdig tolket json lagres også (pickle), slik at uendrede data verken lastes ned eller tolkes på nytt
+
+Svar-objektet har de samme egenskapene som vi bruker fra requests.Response (ok, status_code, text, json())
+
+Eksempel:
+    import httpcache
+    r = httpcache.get( 'https://nvdbapiles.atlas.vegvesen.no/vegnett/veglenkesekvenser/segmentert/123.json' )
+    if r.ok:
+        data = r.json()
+
+NB! json() kan returnere ett og samme objekt til flere kallere, det må ikke endres
+
+Minnecachen er begrenset (LRU, se maksMinne). Store svar som bare skal leses én gang kan hentes med
+get( ..., minne=False ), da holdes verken rådata eller tolket json i minnet etter at svaret er brukt
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import requests
+
+# Standard plassering av cache, kan overstyres med miljøvariabel
+cachemappe = os.environ.get( 'APARDATA_HTTPCACHE', 'httpcache' )
+
+class Svar:
+    """
+    Svar fra HttpCache.get, med samme grensesnitt som requests.Response for det vi bruker
+    """
+    __slots__ = ( 'status_code', 'ok', 'fraCache', 'headers', '_innhold', '_tolket', '_cache', '_nokkel' )
+
+    def __init__( self, status_code, innhold, headers=None, fraCache=False, cache=None, nokkel=None, tolket=None ):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 400
+        self.fraCache = fraCache
+        self.headers = headers or {}
+        self._innhold = innhold
+        self._tolket = tolket
+        self._cache = cache
+        self._nokkel = nokkel
+
+    @property
+    def content( self ):
+        return self._innhold
+
+    @property
+    def text( self ):
+        return self._innhold.decode( 'utf-8', errors='replace' )
+
+    def json( self ):
+        if self._tolket is None:
+            self._tolket = json.loads( self._innhold )
+            if self._cache and self._nokkel:
+                self._cache._lagreTolket( self._nokkel, self._tolket )
+        return self._tolket
+
+class HttpCache:
+    """
+    HTTP-klient med cache på disk og i minnet
+
+    KEYWORDS:
+        mappe: Mappe for cache-filer. Default er modulvariabelen cachemappe
+
+        styrer: None (default) eller objekt med metoden utfor( funksjon ), se trafikkstyring
+
+        maksMinne: Maks antall byte (rådata) i minnecachen, default 256 MB. De minst brukte svarene fjernes først.
+                   0 slår av minnecachen
+    """
+    def __init__( self, mappe=None, styrer=None, maksMinne=256*1024**2 ):
+        self.mappe = mappe or cachemappe
+        self.styrer = styrer
+        self.maksMinne = maksMinne
+        os.makedirs( self.mappe, exist_ok=True )
+        self.session = requests.Session()
+        self._minne = OrderedDict()
+        self._minnestorrelse = 0
+        self._laas = threading.Lock()
+        self.statistikk = { 'hentet' : 0, 'uendret' : 0, 'fraMinne' : 0 }
+
+    def _nokkel( self, url, params, headers ):
+        """
+        Cache-nøkkel ut fra url, parametre og de headerne som påvirker svaret
+        """
+        h = hashlib.sha256( url.encode( 'utf-8' ))
+        if params:
+            h.update( json.dumps( params, sort_keys=True, default=str ).encode( 'utf-8' ))
+        if headers:
+            relevante = { k : v for k, v in headers.items() if k.lower() in ( 'accept', 'authorization' ) }
+            h.update( json.dumps( relevante, sort_keys=True ).encode( 'utf-8' ))
+        return h.hexdigest()
+
+    def _tell( self, hva ):
+        with self._laas:
+            self.statistikk[hva] += 1
+
+    def _husk( self, nokkel, meta, innhold, tolket ):
+        """
+        Legger svaret i minnecachen og fjerner de minst brukte svarene til vi er under maksMinne. Kalles med låsen
+        """
+        gammel = self._minne.pop( nokkel, None )
+        if gammel:
+            self._minnestorrelse -= len( gammel['innhold'] )
+        if len( innhold ) > self.maksMinne:
+            return
+        self._minne[nokkel] = { 'meta' : meta, 'innhold' : innhold, 'tolket' : tolket }
+        self._minnestorrelse += len( innhold )
+        while self._minnestorrelse > self.maksMinne:
+            _, eldste = self._minne.popitem( last=False )
+            self._minnestorrelse -= len( eldste['innhold'] )
+
+    def glem( self, nokkel=None ):
+        """
+        Fjerner ett svar (cache-nøkkel) eller alle svar fra minnecachen. Cachen på disk beholdes
+        """
+        with self._laas:
+            if nokkel is None:
+                self._minne.clear()
+                self._minnestorrelse = 0
+            elif nokkel in self._minne:
+                self._minnestorrelse -= len( self._minne.pop( nokkel )['innhold'] )
+
+    def _filnavn( self, nokkel, endelse ):
+        return os.path.join( self.mappe, nokkel + endelse )
+
+    def _skrivAtomisk( self, filnavn, data ):
+        tmpfil = filnavn + '.' + str( threading.get_ident() ) + '.tmp'
+        with open( tmpfil, 'wb' ) as f:
+            f.write( data )
+        os.replace( tmpfil, filnavn )
+
+    def _lesMeta( self, nokkel ):
+        try:
+            with open( self._filnavn( nokkel, '.meta.json' )) as f:
+                return json.load( f )
+        except ( FileNotFoundError, ValueError ):
+            return None
+
+    def _lagreTolket( self, nokkel, tolket ):
+        with self._laas:
+            if nokkel in self._minne:
+                self._minne[nokkel]['tolket'] = tolket
+        self._skrivAtomisk( self._filnavn( nokkel, '.pkl' ), pickle.dumps( tolket, protocol=pickle.HIGHEST_PROTOCOL ))
+
+    def _fraCache( self, nokkel, meta, minne=True ):
+        """
+        Lager Svar-objekt fra cache, med ferdig tolket json hvis vi har det
+        """
+        with self._laas:
+            iminnet = self._minne.get( nokkel )
+            if iminnet:
+                self._minne.move_to_end( nokkel )
+        if iminnet and ( iminnet['meta'].get( 'etag' ), iminnet['meta'].get( 'lastModified' )) == ( meta.get( 'etag' ), meta.get( 'lastModified' )):
+            return Svar( meta['status_code'], iminnet['innhold'], headers=meta.get( 'headers' ), fraCache=True,
+                        cache=self, nokkel=nokkel, tolket=iminnet['tolket'] )
+
+        with open( self._filnavn( nokkel, '.body' ), 'rb' ) as f:
+            innhold = f.read()
+        tolket = None
+        if os.path.isfile( self._filnavn( nokkel, '.pkl' )):
+            with open( self._filnavn( nokkel, '.pkl' ), 'rb' ) as f:
+                tolket = pickle.load( f )
+        if minne:
+            with self._laas:
+                self._husk( nokkel, meta, innhold, tolket )
+        return Svar( meta['status_code'], innhold, headers=meta.get( 'headers' ), fraCache=True,
+                    cache=self, nokkel=nokkel, tolket=tolket )
+
+    def get( self, url, headers=None, params=None, maksAlder=0, styrer=None, minne=True, **kwargs ):
+        """
+        Henter url med betinget spørring hvis vi har en lagret versjon
+
+        ARGUMENTS
+            url: URL som skal hentes
+
+        KEYWORDS:
+            headers: None (default) eller dictionary med headere
+
+            params: None (default) eller dictionary med parametre
+
+            maksAlder: 0 (default). Antall sekunder et lagret svar kan brukes uten å spørre serveren på nytt
+
+            styrer: None (default) eller Trafikkstyrer for dette kallet. Default er styreren til HttpCache-objektet
+
+            minne: True (default) | False. Med False lagres svaret kun på disk, ikke i minnecachen, og et evt
+                   tidligere svar for samme url fjernes fra minnet
+
+            Øvrige nøkkelord sendes videre til requests.Session.get
+
+        RETURNS
+            Svar-objekt
+        """
+        nokkel = self._nokkel( url, params, headers )
+        if not minne:
+            self.glem( nokkel )
+        meta = self._lesMeta( nokkel )
+        if meta and not os.path.isfile( self._filnavn( nokkel, '.body' )):
+            meta = None
+
+        if meta and maksAlder > 0 and time.time() - meta['tidspunkt'] < maksAlder:
+            self._tell( 'fraMinne' )
+            return self._fraCache( nokkel, meta, minne=minne )
+
+        mineHeadere = dict( headers or {} )
+        if meta and meta.get( 'etag' ):
+            mineHeadere['If-None-Match'] = meta['etag']
+        if meta and meta.get( 'lastModified' ):
+            mineHeadere['If-Modified-Since'] = meta['lastModified']
+
+        def spor():
+            return self.session.get( url, headers=mineHeadere, params=params, **kwargs )
+
+        styrer = styrer or self.styrer
+        if styrer:
+            r = styrer.utfor( spor )
+        else:
+            r = spor()
+
+        if r.status_code == 304 and meta:
+            self._tell( 'uendret' )
+            meta['tidspunkt'] = time.time()
+            self._skrivAtomisk( self._filnavn( nokkel, '.meta.json' ), json.dumps( meta ).encode( 'utf-8' ))
+            return self._fraCache( nokkel, meta, minne=minne )
+
+        self._tell( 'hentet' )
+        if r.ok and ( r.headers.get( 'ETag' ) or r.headers.get( 'Last-Modified' ) or maksAlder > 0 ):
+            nyMeta = { 'url' : url, 'status_code' : r.status_code, 'tidspunkt' : time.time(),
+                       'etag' : r.headers.get( 'ETag' ), 'lastModified' : r.headers.get( 'Last-Modified' ),
+                       'headers' : { 'Content-Type' : r.headers.get( 'Content-Type' ) } }
+            self._skrivAtomisk( self._filnavn( nokkel, '.body' ), r.content )
+            pklfil = self._filnavn( nokkel, '.pkl' )
+            if os.path.isfile( pklfil ):
+                os.remove( pklfil )
+            self._skrivAtomisk( self._filnavn( nokkel, '.meta.json' ), json.dumps( nyMeta ).encode( 'utf-8' ))
+            if minne:
+                with self._laas:
+                    self._husk( nokkel, nyMeta, r.content, None )
+            return Svar( r.status_code, r.content, headers=dict( r.headers ), cache=self, nokkel=nokkel )
+
+        return Svar( r.status_code, r.content, headers=dict( r.headers ))
+
+_standard = None
+_standardLaas = threading.Lock()
+
+def standardcache():
+    """
+    Felles HttpCache-objekt for hele prosessen
+    """
+    global _standard
+    with _standardLaas:
+        if _standard is None:
+            _standard = HttpCache()
+    return _standard
+
+def get( url, **kwargs ):
+    """
+    Henter url via felles HttpCache, se HttpCache.get
+    """
+    return standardcache().get( url, **kwargs )
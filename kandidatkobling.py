@@ -0,0 +1,238 @@
+"""
+Forslag til kobling for APAR-felt som ikke er koblet mot NVDB bomstasjon
+
+APAR-felt med posisjon får de nærmeste NVDB bomstasjonene som kandidater, via et romlig indeks (STRtree) over
+NVDB-geometriene. Alle ukoblede felt slås opp i én samlet spørring mot indeksen
+
+APAR-felt uten posisjon kan kun kobles på navn. Navnene (tollStationName og projectName) sammenlignes med
+Navn bomstasjon og Navn bompengeanlegg (fra CS) via en invertert indeks over bokstav-n-gram. Sammenligningen
+blokkes på operatør og kommune, slik at vi aldri sammenligner alle par
+
+Eksempel:
+    kandidater = kandidatkobling.naermesteKandidater( apar_uten_kobling, nvdbAlle, k=3, maksAvstand=500 )
+    kandidater = kandidatkobling.navnekandidater( apar_uten_kobling, nvdbAlle, antall=3 )
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+# Kolonner fra NVDB som tas med for hver kandidat
+nvdbkolonner = [ 'nvdbId', 'Navn bomstasjon', 'Navn bompengeanlegg (fra CS)', 'Operatør_Id', 'Bomstasjon_Id', 'kommune', 'vref', 'vegkart lenke' ]
+
+# Kolonner fra APAR som identifiserer feltet
+aparkolonner = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode', 'tollStationName', 'projectName', 'tollStationLane' ]
+
+def _nvdbGeometri( nvdbAlle ):
+    """
+    2D-geometri (UTM33) for NVDB bomstasjonene, None der geometri mangler eller er ugyldig
+    """
+    return shapely.force_2d( shapely.from_wkt( nvdbAlle['geometri'].to_numpy(), on_invalid='ignore' ))
+
+def _kandidattabell( apar, nvdbAlle, aparnr, nvdbnr, kolonner ):
+    """
+    Setter sammen APAR-kolonner og NVDB-kolonner for kandidatparene ( aparnr[i], nvdbnr[i] )
+    """
+    aparkol = [ x for x in aparkolonner if x in apar.columns ]
+    nvdbkol = [ x for x in nvdbkolonner if x in nvdbAlle.columns ]
+    df = pd.concat( [ apar[aparkol].iloc[aparnr].reset_index( drop=True ),
+                      nvdbAlle[nvdbkol].iloc[nvdbnr].reset_index( drop=True ) ], axis=1 )
+    for navn, verdier in kolonner.items():
+        df[navn] = verdier
+    df['NVDB har kobling'] = df['Operatør_Id'].notnull() & df['Bomstasjon_Id'].notnull()
+    return df
+
+def naermesteKandidater( apar, nvdbAlle, k=3, maksAvstand=500 ):
+    """
+    De k nærmeste NVDB bomstasjonene innenfor maksAvstand for hvert APAR-felt med posisjon
+
+    ARGUMENTS
+        apar: pandas dataframe med APAR-felt (f.eks de som ikke er koblet), med kolonnene lat og lon
+
+        nvdbAlle: pandas dataframe med NVDB bomstasjoner, med kolonne geometri (wkt, UTM33)
+
+    KEYWORDS:
+        k: Maks antall kandidater per APAR-felt
+
+        maksAvstand: Kandidater lenger unna enn dette (meter) tas ikke med
+
+    RETURNS
+        pandas dataframe med én rad per kandidat, med APAR-kolonner, NVDB-kolonner, avstand (meter) og rang
+        (1 = nærmest), sortert på tollStationKey og rang
+    """
+    nvdbgeom = _nvdbGeometri( nvdbAlle )
+    harGeom = ~shapely.is_missing( nvdbgeom )
+    tre = shapely.STRtree( nvdbgeom[harGeom] )
+    treTilRad = np.nonzero( harGeom )[0]
+
+    trans = Transformer.from_crs( 'EPSG:4326', 'EPSG:25833', always_xy=True )
+    x, y = trans.transform( apar['lon'].to_numpy( dtype=float ), apar['lat'].to_numpy( dtype=float ))
+    medPosisjon = np.nonzero( np.isfinite( x ) & np.isfinite( y ))[0]
+    punkter = shapely.points( x[medPosisjon], y[medPosisjon] )
+
+    # Alle par innenfor maksAvstand i én spørring, deretter de k nærmeste per APAR-felt
+    aparIdx, treIdx = tre.query( punkter, predicate='dwithin', distance=maksAvstand )
+    aparnr = medPosisjon[aparIdx]
+    nvdbnr = treTilRad[treIdx]
+    avstand = shapely.distance( punkter[aparIdx], nvdbgeom[nvdbnr] )
+
+    rekkefolge = np.lexsort( ( avstand, aparnr ))
+    aparnr, nvdbnr, avstand = aparnr[rekkefolge], nvdbnr[rekkefolge], avstand[rekkefolge]
+    rang = pd.Series( aparnr ).groupby( aparnr ).cumcount().to_numpy() + 1
+    beholdes = rang <= k
+
+    return _kandidattabell( apar, nvdbAlle, aparnr[beholdes], nvdbnr[beholdes],
+                            { 'avstand' : np.round( avstand[beholdes], 1 ), 'rang' : rang[beholdes] } )
+
+# Ord som ikke skiller bomstasjoner fra hverandre, fjernes før n-gram lages
+stoppord = [ 'bomstasjon', 'bomstasjonen', 'bompengeanlegg', 'bomring', 'bomringen', 'bompengeprosjekt', 'prosjekt',
+             'felt', 'retning', 'mot', 'fra', 'til', 'og', 'ved', 'i', 'nord', 'sør', 'øst', 'vest' ]
+
+def normaliserNavn( tekst ):
+    """
+    Små bokstaver, uten tegnsetting, tall for felt/retning og stoppord
+    """
+    if not isinstance( tekst, str ):
+        return ''
+    ord_ = re.findall( r'[a-zæøå]+', tekst.lower() )
+    return ' '.join( [ x for x in ord_ if x not in stoppord ] )
+
+def ngram( tekst, n=3 ):
+    """
+    Mengde med bokstav-n-gram, med mellomrom som start- og sluttmarkør
+    """
+    tekst = f" {normaliserNavn( tekst )} "
+    if len( tekst.strip() ) == 0:
+        return set()
+    return { tekst[ii:ii+n] for ii in range( max( 1, len( tekst ) - n + 1 )) }
+
+class Ngramindeks:
+    """
+    Invertert indeks fra n-gram til dokumentnummer
+
+    ARGUMENTS
+        tekster: Liste med tekster (dokumenter)
+
+    KEYWORDS:
+        n: Lengde på n-gram
+    """
+    def __init__( self, tekster, n=3 ):
+        self.n = n
+        postinger = defaultdict( list )
+        self.storrelse = np.zeros( len( tekster ), dtype=np.int32 )
+        for nr, tekst in enumerate( tekster ):
+            gram = ngram( tekst, n=n )
+            self.storrelse[nr] = len( gram )
+            for g in gram:
+                postinger[g].append( nr )
+        self.postinger = { g : np.array( nr, dtype=np.int32 ) for g, nr in postinger.items() }
+
+    def likhet( self, tekst, tillatt=None ):
+        """
+        Dice-likhet mellom tekst og alle dokumenter som deler minst ett n-gram
+
+        KEYWORDS:
+            tillatt: None (default) eller boolsk array, kun dokumenter med True tas med (blokking)
+
+        RETURNS
+            tuple med arrays ( dokumentnummer, likhet )
+        """
+        gram = ngram( tekst, n=self.n )
+        treff = [ self.postinger[g] for g in gram if g in self.postinger ]
+        if not treff:
+            return ( np.zeros( 0, dtype=np.int32 ), np.zeros( 0 ))
+        treff = np.concatenate( treff )
+        if tillatt is not None:
+            treff = treff[ tillatt[treff] ]
+        dokumenter, felles = np.unique( treff, return_counts=True )
+        return ( dokumenter, 2 * felles / ( len( gram ) + self.storrelse[dokumenter] ))
+
+def _tekstId( verdi ):
+    if verdi is None or ( isinstance( verdi, float ) and np.isnan( verdi )):
+        return None
+    if isinstance( verdi, float ) and verdi.is_integer():
+        verdi = int( verdi )
+    return str( verdi )
+
+def navnekandidater( apar, nvdbAlle, antall=3, minLikhet=0.3, vekt=( 0.7, 0.3 )):
+    """
+    Rangerte NVDB-kandidater for hver APAR-bomstasjon, ut fra navnelikhet
+
+    Blokking: En APAR-bomstasjon sammenlignes kun med NVDB bomstasjoner med samme operatør, og med NVDB bomstasjoner
+    uten operatør i de kommunene der operatøren allerede har bomstasjoner i NVDB. Operatører uten bomstasjoner i NVDB
+    sammenlignes med alle NVDB bomstasjoner uten operatør
+
+    ARGUMENTS
+        apar: pandas dataframe med APAR-felt (f.eks de som ikke er koblet og mangler posisjon)
+
+        nvdbAlle: pandas dataframe med NVDB bomstasjoner
+
+    KEYWORDS:
+        antall: Maks antall kandidater per APAR-bomstasjon
+
+        minLikhet: Kandidater med lavere samlet likhet tas ikke med
+
+        vekt: Vekt for ( stasjonsnavn, anleggsnavn ) i samlet likhet
+
+    RETURNS
+        pandas dataframe med én rad per kandidat, med APAR-kolonner (første felt per bomstasjon), NVDB-kolonner,
+        likhet stasjonsnavn, likhet anlegg, likhet og rang
+    """
+    stasjoner = apar.drop_duplicates( subset=[ 'operatorId', 'tollStationCode' ], keep='first' )
+    nvdbAlle = nvdbAlle.reset_index( drop=True )
+    stasjonsindeks = Ngramindeks( nvdbAlle['Navn bomstasjon'].tolist() )
+    anleggsindeks = Ngramindeks( nvdbAlle['Navn bompengeanlegg (fra CS)'].tolist()
+                                 if 'Navn bompengeanlegg (fra CS)' in nvdbAlle.columns else [ '' ] * len( nvdbAlle ))
+
+    # Blokker: operatør -> NVDB-rader, kommune -> NVDB-rader uten operatør
+    operator = np.array( [ _tekstId( x ) for x in nvdbAlle['Operatør_Id'] ], dtype=object )
+    kommune = nvdbAlle['kommune'].to_numpy() if 'kommune' in nvdbAlle.columns else np.full( len( nvdbAlle ), None, dtype=object )
+    utenOperator = np.array( [ x is None for x in operator ], dtype=bool )
+    blokker = {}
+    for opId in { _tekstId( x ) for x in stasjoner['operatorId'] }:
+        egne = operator == opId
+        if egne.any():
+            kommuner = set( kommune[egne].tolist() ) - { None }
+            blokker[opId] = egne | ( utenOperator & np.isin( kommune, list( kommuner )))
+        else:
+            blokker[opId] = utenOperator
+
+    aparnr, nvdbnr, likhetStasjon, likhetAnlegg = [], [], [], []
+    for ii, rad in enumerate( stasjoner[ [ 'operatorId', 'tollStationName', 'projectName' ] ].itertuples( index=False )):
+        tillatt = blokker[ _tekstId( rad.operatorId ) ]
+        dok1, l1 = stasjonsindeks.likhet( rad.tollStationName, tillatt )
+        dok2, l2 = anleggsindeks.likhet( rad.projectName, tillatt )
+        dokumenter = np.union1d( dok1, dok2 ).astype( np.int32 )
+        if len( dokumenter ) == 0:
+            continue
+        aparnr.append( np.full( len( dokumenter ), ii, dtype=np.int32 ))
+        nvdbnr.append( dokumenter )
+        s1 = np.zeros( len( dokumenter ))
+        s1[ np.searchsorted( dokumenter, dok1 ) ] = l1
+        s2 = np.zeros( len( dokumenter ))
+        s2[ np.searchsorted( dokumenter, dok2 ) ] = l2
+        likhetStasjon.append( s1 )
+        likhetAnlegg.append( s2 )
+
+    if not aparnr:
+        return _kandidattabell( stasjoner, nvdbAlle, [], [], { 'likhet stasjonsnavn' : [], 'likhet anlegg' : [], 'likhet' : [], 'rang' : [] } )
+
+    aparnr, nvdbnr = np.concatenate( aparnr ), np.concatenate( nvdbnr )
+    likhetStasjon, likhetAnlegg = np.concatenate( likhetStasjon ), np.concatenate( likhetAnlegg )
+    likhet = vekt[0] * likhetStasjon + vekt[1] * likhetAnlegg
+
+    beholdes = likhet >= minLikhet
+    aparnr, nvdbnr, likhetStasjon, likhetAnlegg, likhet = [ x[beholdes] for x in ( aparnr, nvdbnr, likhetStasjon, likhetAnlegg, likhet ) ]
+    rekkefolge = np.lexsort( ( -likhet, aparnr ))
+    aparnr, nvdbnr, likhetStasjon, likhetAnlegg, likhet = [ x[rekkefolge] for x in ( aparnr, nvdbnr, likhetStasjon, likhetAnlegg, likhet ) ]
+    rang = pd.Series( aparnr ).groupby( aparnr ).cumcount().to_numpy() + 1
+    beholdes = rang <= antall
+
+    return _kandidattabell( stasjoner, nvdbAlle, aparnr[beholdes], nvdbnr[beholdes],
+                            { 'likhet stasjonsnavn' : np.round( likhetStasjon[beholdes], 3 ),
+                              'likhet anlegg'       : np.round( likhetAnlegg[beholdes], 3 ),
+                              'likhet'              : np.round( likhet[beholdes], 3 ),
+                              'rang'                : rang[beholdes] } )
@@ -0,0 +1,248 @@
+"""
+Regelmotor for kvalitetskontroll av sammenstilte APAR- og NVDB-data
+
+Hver kontroll er en Regel: Et kolonneuttrykk (funksjon som tar en dataframe og returnerer en boolsk
+kolonne, eller tekst som kan brukes med DataFrame.eval) med alvorlighetsgrad og evt unntaksliste.
+Alle regler evalueres samlet over én kontrolltabell, resultatet er én tabell med funn. Det som flere regler
+trenger (stedfesting, takstavvik) regnes ut én gang i lagKontrolltabell, og rapportkolonner som stedfesting QA og
+tabeller som takstavvik og flertydige NVDB-objekter utledes fra funn-tabellen (se harFunn og stedfestingQA)
+
+Ny kontroll = ny Regel i standardregler, uten egen gjennomgang av dataene eller egen kopi av tabellen
+
+Regler som kun gjelder APAR-feltene (også felt uten kobling til NVDB) ligger i aparregler, og evalueres over
+en egen kontrolltabell med ett APAR-felt per rad
+
+Eksempel:
+    kontroll = kvalitetsregler.lagKontrolltabell( nvdbBomst, apardata )
+    funn = kvalitetsregler.evaluer( kontroll )
+    funn = pd.concat( [ funn, kvalitetsregler.evaluer( kvalitetsregler.lagAparkontroll( apardata, priser ), aparregler ) ] )
+    nvdbBomst['stedfesting QA'] = kvalitetsregler.stedfestingQA( nvdbBomst['nvdbId'], funn )
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+import aparmodell
+import feltplassering
+
+# UNNTAKSLISTE #  Oddernesbrua KRS, som ikke her ferdig før ca Mai 2025
+unntakOddernesbrua = [1022267972, 1022273618]
+
+# Grense for avstand mellom APAR-posisjon og NVDB-geometri (meter)
+maksAvstand = 200
+
+class Regel:
+    """
+    En kvalitetsregel
+
+    ARGUMENTS
+        navn: Navn på regelen
+
+        uttrykk: Funksjon df -> boolsk Series/array, eller tekst til DataFrame.eval. True betyr funn
+
+    KEYWORDS:
+        alvorlighet: 'feil' | 'advarsel' (default) | 'info'
+
+        melding: Beskrivelse av funnet. Default er navn
+
+        unntak: None (default) eller liste med nvdbId som ikke skal gi funn
+
+        verdikolonne: None (default) eller kolonne som tas med som verdi i funn-tabellen
+
+        niva: 'nvdb' (default, ett funn per NVDB-objekt) | 'felt' (ett funn per APAR-felt)
+    """
+    __slots__ = ( 'navn', 'uttrykk', 'alvorlighet', 'melding', 'unntak', 'verdikolonne', 'niva' )
+
+    def __init__( self, navn, uttrykk, alvorlighet='advarsel', melding=None, unntak=None, verdikolonne=None, niva='nvdb' ):
+        self.navn = navn
+        self.uttrykk = uttrykk
+        self.alvorlighet = alvorlighet
+        self.melding = melding or navn
+        self.unntak = unntak
+        self.verdikolonne = verdikolonne
+        self.niva = niva
+
+    def maske( self, df ) -> np.ndarray:
+        if callable( self.uttrykk ):
+            treff = self.uttrykk( df )
+        else:
+            treff = df.eval( self.uttrykk )
+        treff = pd.Series( treff, index=df.index ).fillna( False ).to_numpy( dtype=bool )
+        if self.unntak:
+            treff = treff & ~df['nvdbId'].isin( self.unntak ).to_numpy()
+        return treff
+
+def _flertydig( df ):
+    antall = df.groupby( [ 'Operatør_Id', 'Bomstasjon_Id' ] )['nvdbId'].transform( 'nunique' )
+    return antall > 1
+
+standardregler = [
+    Regel( 'mangler Bomstasjon_Id', lambda df: df['Operatør_Id'].notnull() & df['Bomstasjon_Id'].isnull(), alvorlighet='feil',
+           melding='ALARM - NVDB bomstasjon har Operatør_Id, men mangler Bomstasjon_Id' ),
+    Regel( 'mangler Operatør_Id', lambda df: df['Operatør_Id'].isnull() & df['Bomstasjon_Id'].notnull(), alvorlighet='feil',
+           melding='ALARM - NVDB bomstasjon har Bomstasjon_Id, men mangler Operatør_Id' ),
+    Regel( 'uten autopasskobling', lambda df: df['Operatør_Id'].isnull() & df['Bomstasjon_Id'].isnull(), alvorlighet='info',
+           melding='NVDB bomstasjon mangler både Operatør_Id og Bomstasjon_Id' ),
+    Regel( 'flertydig NVDB', _flertydig, alvorlighet='advarsel',
+           melding='Flere NVDB bomstasjoner har samme Operatør_Id og Bomstasjon_Id' ),
+    Regel( 'ugyldig innkrevningsretning', 'skalHaStedfest < 0', alvorlighet='feil', verdikolonne='Innkrevningsretning' ),
+    Regel( 'ugyldig stedfesting', 'harStedfest < 0', alvorlighet='feil', verdikolonne='stedfesting_felt' ),
+    Regel( 'stedfesting', 'skalHaStedfest >= 0 and harStedfest >= 0 and skalHaStedfest != harStedfest',
+           alvorlighet='advarsel', melding='Stedfesting på kjørefelt stemmer ikke med innkrevningsretning', verdikolonne='stedfesting QA' ),
+    Regel( 'takstavvik', lambda df: df['takstavvik'], alvorlighet='feil', niva='felt',
+           melding='APAR-takst og NVDB-takst er forskjellige' ),
+    Regel( 'geometriavvik', lambda df: df['geomavstand_nvdb_autopass'] > maksAvstand, alvorlighet='advarsel', niva='felt',
+           melding=f"Mer enn {maksAvstand} meter mellom APAR-posisjon og NVDB-geometri", verdikolonne='geomavstand_nvdb_autopass' ),
+    Regel( 'APAR uten aktiv pris', lambda df: df['tollStationKey'].notnull() & df['smallVehicle'].isnull(), alvorlighet='info', niva='felt' ),
+]
+
+aparregler = [
+    Regel( 'overlappende APAR-priser', lambda df: df['overlappende priser'] != '', alvorlighet='feil', niva='felt',
+           melding='Flere APAR-prisintervaller gjelder samtidig, bruker det med senest activeFrom', verdikolonne='overlappende priser' ),
+]
+
+def lagAparkontroll( apardata, priser, tidspunkt=None ):
+    """
+    Kontrolltabell for aparregler, én rad per APAR-felt
+
+    ARGUMENTS
+        apardata: pandas dataframe med apardata
+
+        priser: aparmodell.Pristabell tolket fra de samme radene som apardata, i samme rekkefølge
+
+    KEYWORDS:
+        tidspunkt: None (default, dvs nå) eller datetime
+
+    RETURNS
+        pandas dataframe med operatorId, tollStationCode, tollStationKey og overlappende priser (tekst, '' = ingen)
+    """
+    kontroll = apardata[ [ 'operatorId', 'tollStationCode', 'tollStationKey' ] ].reset_index( drop=True )
+    overlapp = [ '' ] * len( kontroll )
+    for felt, klasse, pristype, antall in priser.overlapp( tidspunkt ):
+        overlapp[felt] = ( overlapp[felt] + ', ' if overlapp[felt] else '' ) + f"{klasse} {pristype} ({antall})"
+    kontroll['overlappende priser'] = overlapp
+    return kontroll
+
+def lagKontrolltabell( nvdbBomst, apardata ):
+    """
+    Kobler alle NVDB bomstasjoner med sine APAR-felt (left join), og regner ut det reglene trenger én gang: Stedfesting
+    (skalHaStedfest, harStedfest og stedfesting QA), antall APAR-felt per NVDB-objekt, takstavvik og avstand mellom
+    APAR-posisjon og NVDB-geometri
+
+    ARGUMENTS
+        nvdbBomst: pandas dataframe med NVDB bomstasjoner, med kolonnene tilgjengeligeKjfelt og APAR-takster
+
+        apardata: pandas dataframe med apardata
+
+    RETURNS
+        pandas dataframe, én rad per NVDB-objekt og APAR-felt (evt én rad for NVDB-objekter uten APAR-felt)
+    """
+    nvdbBomst = nvdbBomst.copy()
+    skal = feltplassering.skalHaStedfest( nvdbBomst, feltplassering.bomstasjon )
+    har = feltplassering.harStedfest( nvdbBomst )
+    nvdbBomst['skalHaStedfest'] = skal
+    nvdbBomst['harStedfest'] = har
+    nvdbBomst['stedfesting QA'] = feltplassering.vurdering( skal, har )
+
+    aparkol = [ 'operatorId', 'tollStationCode', 'tollStationKey', 'smallVehicle', 'lat', 'lon' ]
+    kontroll = pd.merge( nvdbBomst, apardata[aparkol], left_on=[ 'Operatør_Id', 'Bomstasjon_Id' ],
+                         right_on=[ 'operatorId', 'tollStationCode' ], how='left' )
+    kontroll['Antall APAR felt'] = kontroll.groupby( 'nvdbId' )['tollStationKey'].transform( 'count' )
+    kontroll['takstavvik'] = aparmodell.takstavvik( kontroll, kunAparpris=False ).any( axis=1 ) & kontroll['tollStationKey'].notnull().to_numpy()
+
+    trans = Transformer.from_crs( 'EPSG:4326', 'EPSG:25833', always_xy=True )
+    x, y = trans.transform( kontroll['lon'].to_numpy( dtype=float ), kontroll['lat'].to_numpy( dtype=float ))
+    aparpunkt = shapely.points( x, y )
+    nvdbgeom = shapely.force_2d( shapely.from_wkt( kontroll['geometri'].to_numpy(), on_invalid='ignore' ))
+    avstand = shapely.distance( nvdbgeom, aparpunkt )
+    kontroll['geomavstand_nvdb_autopass'] = np.where( np.isfinite( x ) & np.isfinite( y ), avstand, np.nan )
+    return kontroll
+
+def evaluer( df, regler=None ):
+    """
+    Evaluerer alle regler over df og samler funnene i én tabell
+
+    ARGUMENTS
+        df: Kontrolltabell, se lagKontrolltabell
+
+    KEYWORDS:
+        regler: None (default, dvs standardregler) eller liste med Regel
+
+    RETURNS
+        pandas dataframe med kolonnene regel, alvorlighet, melding, verdi, nvdbId, tollStationKey, operatorId, Bomstasjon_Id
+    """
+    if regler is None:
+        regler = standardregler
+
+    treff = np.zeros( ( len( df ), len( regler )), dtype=bool )
+    for jj, regel in enumerate( regler ):
+        treff[:, jj] = regel.maske( df )
+    rad, kol = np.nonzero( treff )
+
+    funn = pd.DataFrame( { 'regel'       : np.array( [ r.navn for r in regler ], dtype=object )[kol],
+                           'alvorlighet' : np.array( [ r.alvorlighet for r in regler ], dtype=object )[kol],
+                           'melding'     : np.array( [ r.melding for r in regler ], dtype=object )[kol],
+                           'verdi'       : None } )
+    for nokkel in [ 'nvdbId', 'tollStationKey', 'operatorId', 'Operatør_Id', 'Bomstasjon_Id' ]:
+        if nokkel in df.columns:
+            funn[nokkel] = df[nokkel].to_numpy()[rad]
+
+    for jj, regel in enumerate( regler ):
+        if regel.verdikolonne and regel.verdikolonne in df.columns:
+            utvalg = kol == jj
+            funn.loc[utvalg, 'verdi'] = df[regel.verdikolonne].to_numpy()[ rad[utvalg] ]
+        if regel.niva == 'nvdb' and 'tollStationKey' in funn.columns:
+            funn.loc[ kol == jj, 'tollStationKey' ] = None
+
+    return funn.drop_duplicates( subset=[ x for x in [ 'regel', 'nvdbId', 'tollStationKey' ] if x in funn.columns ] ).reset_index( drop=True )
+
+def harFunn( df, funn, regler, nokler=( 'nvdbId', ) ):
+    """
+    Hvilke rader i df som har funn for en eller flere regler
+
+    ARGUMENTS
+        df: pandas dataframe med nøkkelkolonnene
+
+        funn: pandas dataframe fra evaluer
+
+        regler: Navn på regel eller liste med navn
+
+    KEYWORDS:
+        nokler: Kolonnene som kobler df og funn, default ( 'nvdbId', ). Med ( 'nvdbId', 'tollStationKey' ) for regler
+                på felt-nivå
+
+    RETURNS
+        numpy array (bool), én verdi per rad i df
+    """
+    regler = [ regler ] if isinstance( regler, str ) else list( regler )
+    utvalg = funn[ funn['regel'].isin( regler ) ]
+    if len( nokler ) == 1:
+        return df[ nokler[0] ].isin( utvalg[ nokler[0] ] ).to_numpy()
+    return pd.MultiIndex.from_frame( df[ list( nokler ) ] ).isin( pd.MultiIndex.from_frame( utvalg[ list( nokler ) ] ))
+
+def stedfestingQA( nvdbId, funn ):
+    """
+    Rapportkolonnen stedfesting QA, utledet fra funnene for stedfestingsreglene: Vurderingen fra regelen stedfesting,
+    'Ugyldig retning eller stedfesting' for ugyldige verdier og 'OK' for NVDB-objekter uten funn
+
+    ARGUMENTS
+        nvdbId: pandas Series med nvdbId
+
+        funn: pandas dataframe fra evaluer
+
+    RETURNS
+        numpy array (tekst), én verdi per nvdbId
+    """
+    tekst = funn.loc[ funn['regel'] == 'stedfesting', [ 'nvdbId', 'verdi' ] ].drop_duplicates( subset='nvdbId' ).set_index( 'nvdbId' )['verdi']
+    qa = nvdbId.map( tekst ).fillna( 'OK' ).to_numpy( dtype=object )
+    ugyldig = nvdbId.isin( funn.loc[ funn['regel'].isin( [ 'ugyldig innkrevningsretning', 'ugyldig stedfesting' ] ), 'nvdbId' ] ).to_numpy()
+    qa[ugyldig] = 'Ugyldig retning eller stedfesting'
+    return qa
+
+def oppsummer( funn ):
+    """
+    Skriver ut antall funn per regel
+    """
+    for ( regel, alvorlighet, melding ), antall in funn.groupby( [ 'regel', 'alvorlighet', 'melding' ] ).size().items():
+        print( f"{alvorlighet.upper()} {regel}: {antall} funn. {melding}")
@@ -0,0 +1,288 @@
+"""
+Lokal stedfortreder for NVDB skrive-API (endringssett), for testing og måling av innsending uten å røre prodskriv
+
+Tar imot de kallene skrivnvdb.endringssett gjør (registrer, startskriving og oppfølging av status) på samme
+form som NVDB skrive-API:
+    POST <prefiks>/endringssett                       registrer, svarer 201 med lenker (self, start, status, fremdrift)
+    POST <prefiks>/endringssett/<id>/start            startskriving, svarer 202
+    GET  <prefiks>/endringssett/<id>/fremdrift        IKKE_STARTET | VENTER | BEHANDLES | UTFØRT | AVVIST
+    GET  <prefiks>/endringssett/<id>/status           fremdrift, antall objekter og evt avvisningsårsak
+    POST <prefiks>/endringssett/<id>/kanseller
+    GET  /statistikk                                  gjennomstrømning og behandlingstid
+    POST <alt som inneholder login eller token>       svarer med en lokal token, slik at login() kan pekes hit
+
+Prefikset kan være hva som helst, f.eks /rest/v3 eller /nvdb/apiskriv/rest/v3
+
+delvisOppdater valideres (typeId, nvdbId, versjon, egenskaper med typeId/verdi/operasjon, evt gyldighetsperiode).
+Behandlingstiden simuleres (fast tid + tid per objekt), og versjonskonflikter oppstår når versjonen i
+endringssettet ikke er den gjeldende versjonen lokalt, eller tilfeldig med gitt andel. Vellykket skriving øker
+versjonen, slik at samme endringssett sendt to ganger gir konflikt akkurat som i NVDB
+
+Bruk:
+    python lokalskriv.py [port]
+    python skrivTakster2nvdb.py --lokal http://127.0.0.1:8090/rest/v3
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+operasjoner = [ 'oppdater', 'slett', 'ny' ]
+
+def valider( data ):
+    """
+    Validerer et endringssett med delvisOppdater
+
+    RETURNS
+        Liste med feilmeldinger, tom liste hvis endringssettet er gyldig
+    """
+    feil = []
+    if not isinstance( data, dict ) or not isinstance( data.get( 'delvisOppdater' ), dict ):
+        return [ 'Endringssettet mangler delvisOppdater' ]
+    vegobjekter = data['delvisOppdater'].get( 'vegobjekter' )
+    if not isinstance( vegobjekter, list ):
+        return [ 'delvisOppdater mangler listen vegobjekter' ]
+
+    sett = set()
+    for nr, obj in enumerate( vegobjekter ):
+        hvor = f"vegobjekter[{nr}]"
+        if not isinstance( obj, dict ):
+            feil.append( f"{hvor}: Vegobjektet er ikke et objekt" )
+            continue
+        for nokkel in [ 'typeId', 'nvdbId', 'versjon' ]:
+            if not isinstance( obj.get( nokkel ), int ) or isinstance( obj.get( nokkel ), bool ):
+                feil.append( f"{hvor}: {nokkel} mangler eller er ikke heltall" )
+        if isinstance( obj.get( 'nvdbId' ), int ) and isinstance( obj.get( 'versjon' ), int ):
+            if ( obj['nvdbId'], obj['versjon'] ) in sett:
+                feil.append( f"{hvor}: nvdbId {obj['nvdbId']} versjon {obj['versjon']} finnes flere ganger" )
+            sett.add( ( obj['nvdbId'], obj['versjon'] ))
+
+        gyldighetsperiode = obj.get( 'gyldighetsperiode' )
+        if gyldighetsperiode is not None and not isinstance( gyldighetsperiode, dict ):
+            feil.append( f"{hvor}: gyldighetsperiode er ikke et objekt" )
+        startdato = gyldighetsperiode.get( 'startdato' ) if isinstance( gyldighetsperiode, dict ) else None
+        if startdato is not None:
+            try:
+                datetime.strptime( startdato, '%Y-%m-%d' )
+            except ( TypeError, ValueError ):
+                feil.append( f"{hvor}: Ugyldig startdato {startdato}" )
+
+        egenskaper = obj.get( 'egenskaper' )
+        if not isinstance( egenskaper, list ) or len( egenskaper ) == 0:
+            feil.append( f"{hvor}: egenskaper mangler eller er tom" )
+            continue
+        for jj, eg in enumerate( egenskaper ):
+            if not isinstance( eg, dict ):
+                feil.append( f"{hvor}.egenskaper[{jj}]: Egenskapen er ikke et objekt" )
+                continue
+            if not isinstance( eg.get( 'typeId' ), int ):
+                feil.append( f"{hvor}.egenskaper[{jj}]: typeId mangler eller er ikke heltall" )
+            if eg.get( 'operasjon' ) not in operasjoner:
+                feil.append( f"{hvor}.egenskaper[{jj}]: Ugyldig operasjon {eg.get( 'operasjon' )}" )
+            if eg.get( 'operasjon' ) != 'slett' and ( not isinstance( eg.get( 'verdi' ), list ) or len( eg['verdi'] ) == 0 ):
+                feil.append( f"{hvor}.egenskaper[{jj}]: verdi må være en ikke-tom liste" )
+    return feil
+
+class Skrivetjeneste:
+    """
+    Tilstanden til den lokale skrivetjenesten: endringssett, gjeldende versjon per objekt og statistikk
+
+    KEYWORDS:
+        fastTid: Simulert behandlingstid per endringssett (sekunder)
+
+        tidPerObjekt: Simulert behandlingstid per vegobjekt (sekunder)
+
+        konfliktandel: Andel vegobjekter som får tilfeldig versjonskonflikt (0 - 1)
+
+        versjoner: None eller dictionary { nvdbId : gjeldende versjon }. Objekter som ikke er med får versjonen
+                   fra det første endringssettet som nevner dem
+
+        frø: Frø for tilfeldige konflikter, slik at en test kan gjentas
+    """
+    def __init__( self, fastTid=0.5, tidPerObjekt=0.01, konfliktandel=0.0, versjoner=None, frø=None ):
+        self.fastTid = fastTid
+        self.tidPerObjekt = tidPerObjekt
+        self.konfliktandel = konfliktandel
+        self.versjoner = dict( versjoner or {} )
+        self.endringssett = {}
+        self._tilfeldig = random.Random( frø )
+        self._laas = threading.Lock()
+        self._startet = time.monotonic()
+
+    def registrer( self, data ):
+        feil = valider( data )
+        if feil:
+            return ( None, feil )
+        esId = uuid.uuid4().hex
+        with self._laas:
+            self.endringssett[esId] = { 'data' : data, 'fremdrift' : 'IKKE_STARTET', 'registrert' : time.monotonic(),
+                                        'startet' : None, 'ferdig' : None, 'antall' : len( data['delvisOppdater']['vegobjekter'] ),
+                                        'avvisningsårsak' : [] }
+        return ( esId, [] )
+
+    def start( self, esId ):
+        with self._laas:
+            es = self.endringssett.get( esId )
+            if es is None or es['fremdrift'] != 'IKKE_STARTET':
+                return False
+            es['fremdrift'] = 'VENTER'
+            es['startet'] = time.monotonic()
+        tid = self.fastTid + self.tidPerObjekt * es['antall']
+        threading.Timer( tid, self._behandle, args=( esId, )).start()
+        return True
+
+    def _behandle( self, esId ):
+        with self._laas:
+            es = self.endringssett[esId]
+            if es['fremdrift'] != 'VENTER':
+                return
+            es['fremdrift'] = 'BEHANDLES'
+            konflikter = []
+            vegobjekter = es['data']['delvisOppdater']['vegobjekter']
+            for obj in vegobjekter:
+                gjeldende = self.versjoner.setdefault( obj['nvdbId'], obj['versjon'] )
+                if obj['versjon'] != gjeldende:
+                    konflikter.append( f"Versjonskonflikt for {obj['nvdbId']}: versjon {obj['versjon']}, gjeldende versjon er {gjeldende}" )
+                elif self.konfliktandel and self._tilfeldig.random() < self.konfliktandel:
+                    konflikter.append( f"Versjonskonflikt for {obj['nvdbId']}: objektet er endret av andre (simulert)" )
+
+            # Som i NVDB: Ett endringssett skrives i sin helhet eller avvises i sin helhet
+            if konflikter:
+                es['fremdrift'] = 'AVVIST'
+                es['avvisningsårsak'] = konflikter
+            else:
+                for obj in vegobjekter:
+                    self.versjoner[ obj['nvdbId'] ] = obj['versjon'] + 1
+                es['fremdrift'] = 'UTFØRT'
+            es['ferdig'] = time.monotonic()
+
+    def kanseller( self, esId ):
+        with self._laas:
+            es = self.endringssett.get( esId )
+            if es is None or es['fremdrift'] not in ( 'IKKE_STARTET', 'VENTER' ):
+                return False
+            es['fremdrift'] = 'KANSELLERT'
+            return True
+
+    def status( self, esId ):
+        with self._laas:
+            es = self.endringssett.get( esId )
+            if es is None:
+                return None
+            return { 'id' : esId, 'fremdrift' : es['fremdrift'], 'antallVegobjekter' : es['antall'],
+                     'avvisningsårsak' : list( es['avvisningsårsak'] ),
+                     'behandlingstid' : None if es['ferdig'] is None else round( es['ferdig'] - es['startet'], 3 ) }
+
+    def statistikk( self ):
+        with self._laas:
+            alle = list( self.endringssett.values() )
+        ferdige = [ x for x in alle if x['ferdig'] is not None ]
+        tid = time.monotonic() - self._startet
+        objekter = sum( [ x['antall'] for x in ferdige if x['fremdrift'] == 'UTFØRT' ] )
+        behandlingstid = [ x['ferdig'] - x['registrert'] for x in ferdige ]
+        return { 'endringssett'         : len( alle ),
+                 'fremdrift'            : { f : len( [ x for x in alle if x['fremdrift'] == f ] ) for f in sorted( { x['fremdrift'] for x in alle } ) },
+                 'skrevneObjekter'      : objekter,
+                 'objekterPerSekund'    : round( objekter / tid, 3 ) if tid > 0 else None,
+                 'endringssettPerSekund': round( len( ferdige ) / tid, 3 ) if tid > 0 else None,
+                 'snittBehandlingstid'  : round( sum( behandlingstid ) / len( behandlingstid ), 3 ) if behandlingstid else None,
+                 'maksBehandlingstid'   : round( max( behandlingstid ), 3 ) if behandlingstid else None,
+                 'sekunderSidenStart'   : round( tid, 1 ) }
+
+class Skrivebehandler( BaseHTTPRequestHandler ):
+    tjeneste = None
+    protocol_version = 'HTTP/1.1'
+    sti = re.compile( r'^(?P<prefiks>.*)/endringssett(?:/(?P<id>[0-9a-f]+)(?:/(?P<handling>start|status|fremdrift|kanseller))?)?/?$' )
+
+    def _svar( self, kode, data, innholdstype='application/json; charset=utf-8' ):
+        if not isinstance( data, bytes ):
+            data = json.dumps( data, ensure_ascii=False ).encode( 'utf-8' )
+        self.send_response( kode )
+        self.send_header( 'Content-Type', innholdstype )
+        self.send_header( 'Content-Length', str( len( data )))
+        self.end_headers()
+        self.wfile.write( data )
+
+    def _les( self ):
+        lengde = int( self.headers.get( 'Content-Length', 0 ))
+        if lengde == 0:
+            return None
+        return json.loads( self.rfile.read( lengde ).decode( 'utf-8' ))
+
+    def _lenker( self, prefiks, esId ):
+        base = f"http://{self.headers.get( 'Host', '127.0.0.1' )}{prefiks}/endringssett/{esId}"
+        return [ { 'rel' : 'self', 'src' : base, 'method' : 'GET' },
+                 { 'rel' : 'start', 'src' : base + '/start', 'method' : 'POST' },
+                 { 'rel' : 'status', 'src' : base + '/status', 'method' : 'GET' },
+                 { 'rel' : 'fremdrift', 'src' : base + '/fremdrift', 'method' : 'GET' },
+                 { 'rel' : 'kanseller', 'src' : base + '/kanseller', 'method' : 'POST' } ]
+
+    def do_POST( self ):
+        url = urlparse( self.path )
+        try:
+            data = self._les()
+        except ( ValueError, UnicodeDecodeError ) as e:
+            return self._svar( 400, { 'feil' : [ f"Ugyldig json: {e}" ] } )
+
+        if 'login' in url.path or 'token' in url.path:
+            return self._svar( 200, { 'idToken' : 'lokal', 'refreshToken' : 'lokal', 'accessToken' : 'lokal' } )
+
+        treff = self.sti.match( url.path )
+        if not treff:
+            return self._svar( 404, { 'feil' : [ f"Ukjent endepunkt {url.path}" ] } )
+        esId, handling = treff.group( 'id' ), treff.group( 'handling' )
+        if esId is None:
+            esId, feil = self.tjeneste.registrer( data )
+            if feil:
+                return self._svar( 400, { 'feil' : feil } )
+            return self._svar( 201, self._lenker( treff.group( 'prefiks' ), esId ))
+        if handling == 'start':
+            return self._svar( 202 if self.tjeneste.start( esId ) else 409, self._lenker( treff.group( 'prefiks' ), esId ))
+        if handling == 'kanseller':
+            return self._svar( 202 if self.tjeneste.kanseller( esId ) else 409, {} )
+        return self._svar( 405, { 'feil' : [ 'Metoden er ikke støttet her' ] } )
+
+    def do_GET( self ):
+        url = urlparse( self.path )
+        if url.path.rstrip( '/' ) == '/statistikk':
+            return self._svar( 200, self.tjeneste.statistikk() )
+        treff = self.sti.match( url.path )
+        if not treff or treff.group( 'id' ) is None:
+            return self._svar( 404, { 'feil' : [ f"Ukjent endepunkt {url.path}" ] } )
+        status = self.tjeneste.status( treff.group( 'id' ))
+        if status is None:
+            return self._svar( 404, { 'feil' : [ f"Ukjent endringssett {treff.group( 'id' )}" ] } )
+        if treff.group( 'handling' ) == 'fremdrift':
+            return self._svar( 200, status['fremdrift'].encode( 'utf-8' ), innholdstype='text/plain; charset=utf-8' )
+        return self._svar( 200, status )
+
+    def log_message( self, format, *args ):
+        pass
+
+def start( port=8090, vert='127.0.0.1', bakgrunn=False, **kwargs ):
+    """
+    Starter den lokale skrivetjenesten
+
+    KEYWORDS:
+        bakgrunn: False (default, blokkerer) | True (kjører i egen tråd og returnerer serveren, for tester)
+
+        Øvrige nøkkelord sendes til Skrivetjeneste (fastTid, tidPerObjekt, konfliktandel, versjoner, frø)
+    """
+    Skrivebehandler.tjeneste = Skrivetjeneste( **kwargs )
+    server = ThreadingHTTPServer( ( vert, port ), Skrivebehandler )
+    print( f"Lokal NVDB skrivetjeneste på http://{vert}:{port}/rest/v3/endringssett")
+    if bakgrunn:
+        threading.Thread( target=server.serve_forever, daemon=True ).start()
+        return server
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    port = int( sys.argv[1] ) if len( sys.argv ) > 1 else 8090
+    start( port=port )
@@ -0,0 +1,173 @@
+"""
+Oversikt per operatør for dashboard: antall koblede, flertydige og ukoblede stasjoner, aktive felt, takstavvik,
+kvalitetsfunn og andel felt uten koordinater
+
+Hver stasjon har et bidrag (én rad med antall) til sin operatør, og summene per operatør er summen av bidragene
+(én groupby, noen tusen stasjoner). Summene publiseres i <mappe>/operatoroversikt.json, slik at et dashboard kan
+lese dem direkte i stedet for å lese inn hele Excel-rapporten. Fila skrives bare på nytt når et bidrag er endret.
+Bidrag og summer ligger i <mappe>/operatoroversikt/tilstand.pkl
+
+Stasjonene er APAR-stasjoner (operatør + bomstasjonskode), NVDB-objekter (nvdbId) og, for kvalitetsfunn uten
+nvdbId, APAR-felt (tollStationKey)
+
+Eksempel:
+    oversikt = operatoroversikt.Operatoroversikt( mappe )
+    oversikt.oppdater( operatoroversikt.stasjonsbidrag( resultat ))
+    oversikt.les()                                      # eller bare les operatoroversikt.json
+"""
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+import publiser
+
+# Tellingene per stasjon, og dermed per operatør
+maal = [ 'enkelKobling', 'flertydigKobling', 'aparUtenKobling', 'nvdbUtenKobling',
+         'felt', 'aktiveFelt', 'feltUtenKoordinater', 'takstavvik', 'kvalitetsfunn' ]
+
+# APAR-felt fra sammenstill, og hvilken kobling de har. Rekkefølgen er prioritet: En stasjon der ett av feltene
+# har enkel kobling regnes som koblet
+feltkilder = [ ( 'merged', 'enkelKobling' ), ( 'flertydig', 'flertydigKobling' ),
+               ( 'apar_utenkobling_medpris', 'aparUtenKobling' ), ( 'apar_utenpris', 'aparUtenKobling' ) ]
+
+def _operator( verdi ):
+    """
+    Operatør ID som tekst, 'ukjent' der den mangler
+    """
+    tall = pd.to_numeric( pd.Series( verdi ), errors='coerce' ).round().astype( 'Int64' )
+    return tall.astype( str ).where( tall.notnull(), 'ukjent' ).to_numpy( dtype=object )
+
+def _tekst( serie ):
+    tall = pd.to_numeric( serie, errors='coerce' )
+    heltall = tall.notnull() & ( tall == tall.round() )
+    tekst = serie.astype( str )
+    tekst[heltall] = tall[heltall].astype( np.int64 ).astype( str )
+    return tekst.to_numpy( dtype=object )
+
+def stasjonsbidrag( resultat ):
+    """
+    Bidraget fra hver stasjon til summene per operatør
+
+    ARGUMENTS
+        resultat: dictionary med tabeller fra tolkapar.sammenstill
+
+    RETURNS
+        pandas dataframe med indeks stasjon og kolonnene operatorId og maal
+    """
+    deler = []
+
+    # APAR-felt, hvert felt telles én gang med den beste koblingen det har
+    felt = []
+    for tabell, kobling in feltkilder:
+        df = resultat[tabell]
+        felt.append( pd.DataFrame( { 'operatorId'      : _operator( df['operatorId'] ),
+                                     'tollStationCode' : _tekst( df['tollStationCode'] ),
+                                     'tollStationKey'  : df['tollStationKey'].astype( str ).to_numpy(),
+                                     'aktiv'           : df['smallVehicle'].notnull().to_numpy(),
+                                     'utenKoordinater' : ( df['lat'].isnull() | df['lon'].isnull() ).to_numpy(),
+                                     'kobling'         : maal.index( kobling ) } ))
+    felt = pd.concat( felt, ignore_index=True ).drop_duplicates( subset='tollStationKey', keep='first' )
+    felt['stasjon'] = 'apar:' + felt['operatorId'] + '_' + felt['tollStationCode']
+    stasjoner = felt.groupby( 'stasjon' ).agg( operatorId=( 'operatorId', 'first' ), kobling=( 'kobling', 'min' ),
+                                               felt=( 'tollStationKey', 'size' ), aktiveFelt=( 'aktiv', 'sum' ),
+                                               feltUtenKoordinater=( 'utenKoordinater', 'sum' ))
+    for kolonne in [ 'enkelKobling', 'flertydigKobling', 'aparUtenKobling' ]:
+        stasjoner[kolonne] = ( stasjoner['kobling'] == maal.index( kolonne )).astype( np.int64 )
+    deler.append( stasjoner.drop( columns='kobling' ))
+
+    # NVDB-objekter uten kobling til APAR
+    df = resultat['nvdb_utenkobling']
+    deler.append( pd.DataFrame( { 'operatorId' : _operator( df['Operatør_Id'] ), 'nvdbUtenKobling' : 1 },
+                                index=pd.Index( 'nvdb:' + _tekst( df['nvdbId'] ), name='stasjon' )))
+
+    # Takstavvik telles per NVDB-objekt
+    df = resultat['takstavvik'].drop_duplicates( subset='nvdbId' )
+    deler.append( pd.DataFrame( { 'operatorId' : _operator( df['operatorId'] ), 'takstavvik' : 1 },
+                                index=pd.Index( 'nvdb:' + _tekst( df['nvdbId'] ), name='stasjon' )))
+
+    # Kvalitetsfunn på NVDB-objektet der vi har det, ellers på APAR-feltet
+    df = resultat['kvalitetsfunn']
+    if len( df ):
+        operator = df['operatorId'] if 'operatorId' in df.columns else pd.Series( [ None ] * len( df ), index=df.index )
+        if 'Operatør_Id' in df.columns:
+            operator = operator.fillna( df['Operatør_Id'] )
+        nvdbId = df['nvdbId'] if 'nvdbId' in df.columns else pd.Series( [ None ] * len( df ), index=df.index )
+        stasjon = np.where( nvdbId.notnull(), 'nvdb:' + pd.Series( _tekst( nvdbId ), index=df.index ),
+                            'felt:' + df['tollStationKey'].astype( str ))
+        funn = pd.DataFrame( { 'stasjon' : stasjon, 'operatorId' : _operator( operator ), 'kvalitetsfunn' : 1 } )
+        deler.append( funn.groupby( 'stasjon' ).agg( operatorId=( 'operatorId', 'first' ), kvalitetsfunn=( 'kvalitetsfunn', 'sum' )))
+
+    bidrag = pd.concat( deler )
+    # Samme stasjon kan komme fra flere deler, operatør er den første som er kjent
+    operator = bidrag['operatorId'].where( bidrag['operatorId'] != 'ukjent' ).groupby( level=0 ).first()
+    bidrag = bidrag.reindex( columns=maal ).fillna( 0 ).astype( np.int64 ).groupby( level=0 ).sum()
+    bidrag.insert( 0, 'operatorId', operator.reindex( bidrag.index ).fillna( 'ukjent' ))
+    return bidrag.sort_index()
+
+class Operatoroversikt:
+    """
+    Summer per operatør, regnet ut fra stasjonsbidragene
+
+    ARGUMENTS
+        mappe: Mappa med resultatfilene. operatoroversikt.json skrives hit, tilstanden til en undermappe
+    """
+    def __init__( self, mappe ):
+        self.mappe = mappe
+        self.tilstandsfil = os.path.join( mappe, 'operatoroversikt', 'tilstand.pkl' )
+        if os.path.isfile( self.tilstandsfil ):
+            tilstand = pd.read_pickle( self.tilstandsfil )
+            self.bidrag, self.summer = tilstand['bidrag'], tilstand['summer']
+        else:
+            self.bidrag = pd.DataFrame( columns=[ 'operatorId' ] + maal ).rename_axis( 'stasjon' )
+            self.summer = pd.DataFrame( columns=maal, dtype=np.int64 ).rename_axis( 'operatorId' )
+
+    def oppdater( self, bidrag ):
+        """
+        Regner ut summene fra bidragene i denne kjøringen. Summene lagres og publiseres bare hvis noen stasjoner har
+        endret bidrag (nye, fjernede, endrede tall eller ny operatør)
+
+        ARGUMENTS
+            bidrag: pandas dataframe fra stasjonsbidrag
+
+        RETURNS
+            Antall stasjoner med endret bidrag
+        """
+        alle = self.bidrag.index.union( bidrag.index )
+        gammel = self.bidrag.reindex( alle )
+        ny = bidrag.reindex( alle )
+        tall = lambda df : df[maal].fillna( 0 ).astype( np.int64 )
+        endret = ( tall( gammel ) != tall( ny )).any( axis=1 ) | ( gammel['operatorId'].fillna( '' ) != ny['operatorId'].fillna( '' ))
+
+        if endret.any():
+            self.summer = tall( bidrag ).groupby( bidrag['operatorId'].fillna( 'ukjent' ).rename( 'operatorId' )).sum().astype( np.int64 )
+            self.bidrag = bidrag.copy()
+            self.lagre()
+
+        print( f"Operatøroversikt: {int( endret.sum() )} stasjoner med endret bidrag, {len( self.summer )} operatører")
+        return int( endret.sum() )
+
+    def tabell( self ):
+        """
+        Summene per operatør, med andel felt uten koordinater
+
+        RETURNS
+            pandas dataframe med én rad per operatør
+        """
+        df = self.summer.reset_index()
+        df['andelUtenKoordinater'] = ( df['feltUtenKoordinater'] / df['felt'].where( df['felt'] > 0 )).round( 4 )
+        return df
+
+    def les( self ):
+        """
+        Summene per operatør som dictionary { operatorId : { maal : antall } }
+        """
+        df = self.tabell().set_index( 'operatorId' )
+        return json.loads( df.to_json( orient='index', force_ascii=False ))
+
+    def lagre( self ):
+        os.makedirs( os.path.dirname( self.tilstandsfil ), exist_ok=True )
+        with publiser.atomisk( self.tilstandsfil ) as tmpfil:
+            pd.to_pickle( { 'bidrag' : self.bidrag, 'summer' : self.summer }, tmpfil )
+        publiser.skrivJson( self.les(), os.path.join( self.mappe, 'operatoroversikt.json' ))
@@ -0,0 +1,344 @@
+"""
+Paritet og ytelse: Kjører to versjoner av analysen (tolkapar) på de samme innspilte inndataene og sammenligner
+alle resultattabeller, endringssettet til NVDB, tidsbruk og minnebruk per steg
+
+Ment som kontroll før optimaliseringer av kobling, takster eller endringssett tas i bruk: Resultatet skal være
+det samme, bare raskere. Et endringssett som er ulikt betyr at feil takster kan bli skrevet til NVDB
+
+Opptak: apardump.json og NVDB bomstasjoner med kjørefelt (etter leggTilKjfelt), slik at kjøringene ikke er
+avhengige av nettverk og gir de samme inndataene hver gang
+
+Hver versjon kjøres i egen prosess, med kildekoden fra en git-revisjon (git archive) eller fra arbeidsmappa (.).
+Da får hver versjon sine egne moduler, og minnebruken måles uavhengig av den andre
+
+Tabellene sammenlignes semantisk: Tabeller med nøkkel i endringsrapport.sammenligninger flettes på nøkkelen,
+øvrige sammenlignes som mengder av rader uavhengig av rekkefølge. Flyttall avrundes, geometrier sammenlignes som WKT.
+Endringssettet sammenlignes per nvdbId og egenskap, uten hensyn til rekkefølge og startdato
+
+Bruk:
+    python paritet.py opptak <mappe med apardump.json> <opptaksmappe>
+    python paritet.py sammenlign <opptaksmappe> <revisjon A> <revisjon B> [utmappe]
+
+    f.eks python paritet.py sammenlign opptak/ HEAD~1 . paritet/
+
+Avslutter med returkode 1 hvis resultatene er ulike, slik at det kan brukes i skript
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+# NB! Moduler fra dette repoet importeres først når de trengs. Under kjøring skal versjonen som testes
+# bruke sine egne moduler, ikke de som ligger i arbeidsmappa
+
+# Toleranse for tidsbruk og minne før det regnes som en forverring (B / A)
+ytelsestoleranse = 1.2
+
+def lagOpptak( mappe, opptaksmappe ):
+    """
+    Lager opptak av inndataene til analysen: apardump.json fra mappe og NVDB bomstasjoner med kjørefelt (hentes nå)
+    """
+    import tolkapar
+
+    os.makedirs( opptaksmappe, exist_ok=True )
+    shutil.copyfile( os.path.join( mappe, 'apardump.json' ), os.path.join( opptaksmappe, 'apardump.json' ))
+    nvdbAlle = tolkapar.leggTilKjfelt( tolkapar.hentNvdbBomstasjoner() )
+    nvdbAlle.to_pickle( os.path.join( opptaksmappe, 'nvdbAlle.pkl' ))
+    print( f"Opptak i {opptaksmappe}: {len( nvdbAlle )} NVDB bomstasjoner")
+
+def kildetre( revisjon, mappe ):
+    """
+    Kildekoden for en git-revisjon pakkes ut i mappe. Revisjon '.' betyr arbeidsmappa slik den er nå
+
+    RETURNS
+        Mappe med kildekoden
+    """
+    repo = os.path.dirname( os.path.abspath( __file__ ))
+    if revisjon == '.':
+        return repo
+    os.makedirs( mappe, exist_ok=True )
+    arkiv = subprocess.run( [ 'git', 'archive', '--format=tar', revisjon ], cwd=repo, check=True, capture_output=True ).stdout
+    subprocess.run( [ 'tar', '-x', '-C', mappe ], input=arkiv, check=True )
+    # Lokale filer som ikke er under versjonskontroll (f.eks nvdbapi-stien) trengs også
+    for navn in [ 'STARTHER.py', 'SECRET.json' ]:
+        if os.path.isfile( os.path.join( repo, navn )) and not os.path.isfile( os.path.join( mappe, navn )):
+            shutil.copyfile( os.path.join( repo, navn ), os.path.join( mappe, navn ))
+    return mappe
+
+def _kjorSteg( opptaksmappe, utmappe, modulnavn='tolkapar', minne=True ):
+    """
+    Kjører analysen steg for steg i denne prosessen, med den versjonen av modulnavn som ligger først i sys.path.
+    Tabeller, endringssett og måling skrives til utmappe
+    """
+    import importlib
+    import resource
+
+    modul = importlib.import_module( modulnavn )
+    maaling = { 'modul' : os.path.abspath( modul.__file__ ), 'steg' : {} }
+    if minne:
+        tracemalloc.start()
+
+    def steg( navn, funksjon, *args, **kwargs ):
+        if minne:
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        svar = funksjon( *args, **kwargs )
+        maaling['steg'][navn] = { 'sekunder' : time.perf_counter() - t0,
+                                  'toppMB'   : tracemalloc.get_traced_memory()[1] / 2**20 if minne else None }
+        return svar
+
+    apardata = steg( 'les apardump', modul.lesApardump, os.path.join( opptaksmappe, 'apardump.json' ))
+    nvdbAlle = pd.read_pickle( os.path.join( opptaksmappe, 'nvdbAlle.pkl' ))
+    resultat = steg( 'sammenstill', modul.sammenstill, apardata, nvdbAlle )
+    endringssett = steg( 'endringssett', modul.lagEndringssett, resultat['sjekkTakster'], outfile=None )
+
+    if minne:
+        tracemalloc.stop()
+    maaling['maksRSS_MB'] = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024
+
+    os.makedirs( os.path.join( utmappe, 'tabeller' ), exist_ok=True )
+    for navn, tabell in resultat.items():
+        if isinstance( tabell, pd.DataFrame ):
+            tabell.to_pickle( os.path.join( utmappe, 'tabeller', navn + '.pkl' ))
+    with open( os.path.join( utmappe, 'bomstasjon_endringssett.json' ), 'w' ) as f:
+        json.dump( endringssett, f, indent=4, ensure_ascii=False )
+    with open( os.path.join( utmappe, 'maaling.json' ), 'w' ) as f:
+        json.dump( maaling, f, indent=4 )
+
+def kjor( revisjon, opptaksmappe, utmappe, modulnavn='tolkapar', minne=True ):
+    """
+    Kjører én versjon av analysen i egen prosess, med kildekoden fra revisjon
+
+    ARGUMENTS
+        revisjon: git-revisjon (f.eks HEAD~1, en gren eller en commit) eller '.' for arbeidsmappa
+
+        opptaksmappe: Mappe med opptak, se lagOpptak
+
+        utmappe: Mappe som resultatene skrives til
+
+    KEYWORDS:
+        modulnavn: Modulen som kjøres, må ha lesApardump, sammenstill og lagEndringssett. tolkapar_OLD er et
+                   rent skript uten disse funksjonene og kan ikke kjøres her, bruk en git-revisjon av tolkapar i stedet
+
+        minne: True (default) | False. Mål toppforbruk av minne per steg med tracemalloc. Gjør kjøringen tregere,
+               men likt for begge versjoner
+
+    RETURNS
+        dictionary med måling (tidsbruk og minne per steg)
+    """
+    kilde = kildetre( revisjon, os.path.join( utmappe, 'kilde' ))
+    kommando = [ sys.executable, os.path.abspath( __file__ ), '--kjor', kilde, os.path.abspath( opptaksmappe ),
+                 os.path.abspath( utmappe ), modulnavn, '1' if minne else '0' ]
+    print( f"Kjører {modulnavn} fra {revisjon}")
+    subprocess.run( kommando, cwd=kilde, check=True )
+    with open( os.path.join( utmappe, 'maaling.json' )) as f:
+        return json.load( f )
+
+def _normaliser( verdi, desimaler=6 ):
+    """
+    Verdi på sammenlignbar form: avrundede flyttall, None for manglende verdier, WKT for geometrier
+    """
+    if hasattr( verdi, 'wkt' ):
+        return verdi.wkt
+    if isinstance( verdi, ( list, tuple, np.ndarray )):
+        return tuple( _normaliser( x, desimaler ) for x in verdi )
+    if isinstance( verdi, dict ):
+        return tuple( sorted( ( k, _normaliser( v, desimaler )) for k, v in verdi.items() ))
+    try:
+        if pd.isnull( verdi ):
+            return None
+    except ( TypeError, ValueError ):
+        pass
+    if isinstance( verdi, ( float, np.floating )):
+        verdi = round( float( verdi ), desimaler )
+        return int( verdi ) if np.isfinite( verdi ) and verdi == int( verdi ) else verdi
+    if isinstance( verdi, ( np.integer, np.bool_ )):
+        return verdi.item()
+    return verdi
+
+def _normaliserTabell( df, kolonner ):
+    return pd.DataFrame( { kol : [ _normaliser( x ) for x in df[kol] ] for kol in kolonner }, index=df.index, dtype=object )
+
+def sammenlignTabell( a, b, navn, nokkel=None ):
+    """
+    Semantisk sammenligning av to versjoner av en tabell
+
+    KEYWORDS:
+        nokkel: None (default, radene sammenlignes som mengder) eller liste med nøkkelkolonner
+
+    RETURNS
+        pandas dataframe med én rad per forskjell (tabell, nokkel, endring, felt, før, etter)
+    """
+    import endringsrapport
+
+    avvik = []
+    for kol in a.columns.difference( b.columns ):
+        avvik.append( { 'nokkel' : None, 'endring' : 'kolonne fjernet', 'felt' : kol } )
+    for kol in b.columns.difference( a.columns ):
+        avvik.append( { 'nokkel' : None, 'endring' : 'kolonne ny', 'felt' : kol } )
+    felles = [ x for x in a.columns if x in b.columns ]
+    avvik = pd.DataFrame( avvik, columns=endringsrapport.endringskolonner )
+
+    if nokkel and all( x in felles for x in nokkel ):
+        radavvik = endringsrapport.sammenlign( _normaliserTabell( a, felles ), _normaliserTabell( b, felles ), nokkel, tabell=navn )
+        # Duplikate nøkler skjules av flettingen, antall rader sammenlignes i tillegg
+        if len( a ) != len( b ):
+            radavvik = pd.concat( [ radavvik, pd.DataFrame( [ { 'endring' : 'antall rader', 'før' : len( a ), 'etter' : len( b ) } ] ) ], ignore_index=True )
+    else:
+        raderA = Counter( map( tuple, _normaliserTabell( a, felles ).itertuples( index=False )))
+        raderB = Counter( map( tuple, _normaliserTabell( b, felles ).itertuples( index=False )))
+        rader = [ { 'nokkel' : str( rad ), 'endring' : 'fjernet', 'før' : antall } for rad, antall in ( raderA - raderB ).items() ]
+        rader += [ { 'nokkel' : str( rad ), 'endring' : 'ny', 'etter' : antall } for rad, antall in ( raderB - raderA ).items() ]
+        radavvik = pd.DataFrame( rader, columns=endringsrapport.endringskolonner )
+
+    alle = pd.concat( [ avvik, radavvik ], ignore_index=True ).reindex( columns=endringsrapport.endringskolonner )
+    alle['tabell'] = navn
+    return alle
+
+def _egenskaper( vegobjekt ):
+    """
+    Egenskapene i et vegobjekt fra endringssettet som dictionary typeId -> ( operasjon, verdier ). Tallverdier
+    sammenlignes som tall, slik at 23 og 23.0 er like
+    """
+    def verdi( x ):
+        try:
+            return float( x )
+        except ( TypeError, ValueError ):
+            return x
+    return { eg['typeId'] : ( eg.get( 'operasjon' ), tuple( verdi( x ) for x in eg.get( 'verdi', [] ))) for eg in vegobjekt.get( 'egenskaper', [] ) }
+
+def sammenlignEndringssett( a, b ):
+    """
+    Semantisk sammenligning av to endringssett (delvisOppdater), per nvdbId og egenskap.
+    Rekkefølge og startdato (dagens dato) betyr ikke noe. Et nvdbId som finnes flere ganger i ett av
+    endringssettene gir endring 'duplikat' med antall i før og etter, egenskapene sammenlignes for det siste
+
+    RETURNS
+        pandas dataframe med kolonnene nvdbId, endring, typeId, før og etter
+    """
+    objA = { x['nvdbId'] : x for x in a['delvisOppdater']['vegobjekter'] }
+    objB = { x['nvdbId'] : x for x in b['delvisOppdater']['vegobjekter'] }
+    antallA = Counter( x['nvdbId'] for x in a['delvisOppdater']['vegobjekter'] )
+    antallB = Counter( x['nvdbId'] for x in b['delvisOppdater']['vegobjekter'] )
+    kolonner = [ 'nvdbId', 'endring', 'typeId', 'før', 'etter' ]
+    rader = []
+    for nvdbId in sorted( set( objA ) | set( objB )):
+        if antallA[nvdbId] > 1 or antallB[nvdbId] > 1:
+            rader.append( { 'nvdbId' : nvdbId, 'endring' : 'duplikat', 'før' : antallA[nvdbId], 'etter' : antallB[nvdbId] } )
+        if nvdbId not in objB:
+            rader.append( { 'nvdbId' : nvdbId, 'endring' : 'kun i A', 'før' : json.dumps( objA[nvdbId]['egenskaper'], ensure_ascii=False ) } )
+            continue
+        if nvdbId not in objA:
+            rader.append( { 'nvdbId' : nvdbId, 'endring' : 'kun i B', 'etter' : json.dumps( objB[nvdbId]['egenskaper'], ensure_ascii=False ) } )
+            continue
+        for felt in [ 'typeId', 'versjon' ]:
+            if objA[nvdbId].get( felt ) != objB[nvdbId].get( felt ):
+                rader.append( { 'nvdbId' : nvdbId, 'endring' : 'ulik ' + felt, 'før' : objA[nvdbId].get( felt ), 'etter' : objB[nvdbId].get( felt ) } )
+        egA, egB = _egenskaper( objA[nvdbId] ), _egenskaper( objB[nvdbId] )
+        for typeId in sorted( set( egA ) | set( egB )):
+            if egA.get( typeId ) != egB.get( typeId ):
+                rader.append( { 'nvdbId' : nvdbId, 'endring' : 'ulik egenskap', 'typeId' : typeId,
+                                'før' : str( egA.get( typeId )), 'etter' : str( egB.get( typeId )) } )
+    return pd.DataFrame( rader, columns=kolonner )
+
+def sammenlignYtelse( maalingA, maalingB, toleranse=ytelsestoleranse ):
+    """
+    Tidsbruk og toppforbruk av minne per steg for A og B, med forholdstall B/A
+
+    RETURNS
+        pandas dataframe, kolonnen forverret er True der B / A er over toleranse
+    """
+    rader = []
+    for navn in maalingA['steg']:
+        a, b = maalingA['steg'][navn], maalingB['steg'].get( navn, {} )
+        for maal in [ 'sekunder', 'toppMB' ]:
+            if a.get( maal ) is None or b.get( maal ) is None:
+                continue
+            forhold = b[maal] / a[maal] if a[maal] else None
+            rader.append( { 'steg' : navn, 'mål' : maal, 'A' : round( a[maal], 3 ), 'B' : round( b[maal], 3 ),
+                            'B / A' : None if forhold is None else round( forhold, 3 ),
+                            'forverret' : forhold is not None and forhold > toleranse } )
+    rader.append( { 'steg' : 'hele prosessen', 'mål' : 'maksRSS_MB', 'A' : round( maalingA['maksRSS_MB'], 1 ), 'B' : round( maalingB['maksRSS_MB'], 1 ),
+                    'B / A' : round( maalingB['maksRSS_MB'] / maalingA['maksRSS_MB'], 3 ),
+                    'forverret' : maalingB['maksRSS_MB'] / maalingA['maksRSS_MB'] > toleranse } )
+    return pd.DataFrame( rader )
+
+def sammenlign( opptaksmappe, revisjonA, revisjonB, utmappe=None, modulnavn='tolkapar', minne=True ):
+    """
+    Kjører revisjon A og B på samme opptak og sammenligner tabeller, endringssett og ytelse. Rapporten skrives
+    til utmappe/paritet.xlsx
+
+    RETURNS
+        tuple ( lik : bool, tabellavvik, endringssettavvik, ytelse ) der de tre siste er pandas dataframe
+    """
+    import endringsrapport
+    import nvdbgeotricks
+
+    if utmappe is None:
+        utmappe = tempfile.mkdtemp( prefix='paritet' )
+    mappeA, mappeB = os.path.join( utmappe, 'A' ), os.path.join( utmappe, 'B' )
+    maalingA = kjor( revisjonA, opptaksmappe, mappeA, modulnavn=modulnavn, minne=minne )
+    maalingB = kjor( revisjonB, opptaksmappe, mappeB, modulnavn=modulnavn, minne=minne )
+
+    nokler = { x['tabell'] : x['nokkel'] for x in endringsrapport.sammenligninger }
+    tabellnavn = sorted( set( os.listdir( os.path.join( mappeA, 'tabeller' ))) | set( os.listdir( os.path.join( mappeB, 'tabeller' ))))
+    deler = []
+    for filnavn in tabellnavn:
+        navn = filnavn[:-4]
+        a, b = [ os.path.join( x, 'tabeller', filnavn ) for x in ( mappeA, mappeB ) ]
+        if not os.path.isfile( a ) or not os.path.isfile( b ):
+            deler.append( pd.DataFrame( [ { 'tabell' : navn, 'endring' : 'tabell kun i ' + ( 'A' if os.path.isfile( a ) else 'B' ) } ] ))
+            continue
+        deler.append( sammenlignTabell( pd.read_pickle( a ), pd.read_pickle( b ), navn, nokkel=nokler.get( navn )))
+    tabellavvik = pd.concat( deler, ignore_index=True ).reindex( columns=endringsrapport.endringskolonner ) if deler else pd.DataFrame( columns=endringsrapport.endringskolonner )
+
+    endringssett = []
+    for mappe in ( mappeA, mappeB ):
+        with open( os.path.join( mappe, 'bomstasjon_endringssett.json' )) as f:
+            endringssett.append( json.load( f ))
+    endringssettavvik = sammenlignEndringssett( *endringssett )
+    ytelse = sammenlignYtelse( maalingA, maalingB )
+
+    lik = len( tabellavvik ) == 0 and len( endringssettavvik ) == 0
+    oppsummering = pd.DataFrame( [ { 'A' : revisjonA, 'B' : revisjonB, 'lik' : lik,
+                                     'tabeller med avvik' : tabellavvik['tabell'].nunique(),
+                                     'avvik i tabeller' : len( tabellavvik ),
+                                     'avvik i endringssett' : len( endringssettavvik ),
+                                     'forverret ytelse' : int( ytelse['forverret'].sum() ) } ] )
+    utdata = tabellavvik.copy()
+    for kol in [ 'før', 'etter' ]:
+        utdata[kol] = utdata[kol].apply( lambda x : x if x is None or isinstance( x, ( int, float, str, bool )) else str( x ))
+    nvdbgeotricks.skrivexcel( os.path.join( utmappe, 'paritet.xlsx' ), [ oppsummering, endringssettavvik, utdata, ytelse ],
+                              sheet_nameListe=[ 'Oppsummering', 'Endringssett', 'Tabeller', 'Ytelse' ] )
+
+    print( f"Paritet {revisjonA} -> {revisjonB}: {'LIK' if lik else 'ULIK'}. {len( endringssettavvik )} avvik i endringssett, "
+           f"{len( tabellavvik )} avvik i {tabellavvik['tabell'].nunique()} tabeller")
+    for _, rad in ytelse.iterrows():
+        print( f"  {rad['steg']:<16} {rad['mål']:<11} A={rad['A']:<10} B={rad['B']:<10} B/A={rad['B / A']}{'  FORVERRET' if rad['forverret'] else ''}")
+    return ( lik, tabellavvik, endringssettavvik, ytelse )
+
+
+if __name__ == '__main__':
+    if len( sys.argv ) > 1 and sys.argv[1] == '--kjor':
+        # Intern: Kjører én versjon, se kjor(). Kildetreet skal ligge først i søkestien
+        kilde, opptaksmappe, utmappe, modulnavn, minne = sys.argv[2:7]
+        sys.path.insert( 0, kilde )
+        _kjorSteg( opptaksmappe, utmappe, modulnavn=modulnavn, minne=minne == '1' )
+
+    elif len( sys.argv ) == 4 and sys.argv[1] == 'opptak':
+        lagOpptak( sys.argv[2], sys.argv[3] )
+
+    elif len( sys.argv ) in ( 5, 6 ) and sys.argv[1] == 'sammenlign':
+        lik, _, _, _ = sammenlign( sys.argv[2], sys.argv[3], sys.argv[4], utmappe=sys.argv[5] if len( sys.argv ) == 6 else None )
+        sys.exit( 0 if lik else 1 )
+
+    else:
+        print( __doc__ )
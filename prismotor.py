@@ -0,0 +1,287 @@
+"""
+Prismotor: Beregner hva en passering koster, ut fra tolkede APAR-data
+
+For hver passering (tollStationKey, tidspunkt, kjøretøyklasse og evt kjøretøy ID) finnes gjeldende takst,
+med rushtidstakst innenfor rushtidsvinduene til stasjonen. Med kjøretøy ID brukes også timesregelen
+(betaler kun for dyreste passering innenfor samme timesregel-gruppe og varighet) og månedstaket
+(maksimalt antall betalte passeringer per operatør og kalendermåned)
+
+Alt som kan beregnes på forhånd gjøres når Prismotor lages: Taksttabell med sorteringsnøkkel for oppslag med
+searchsorted, rushtidsvinduer som en tabell med ett flagg per minutt i uka (én tabell per unike vindu-sett) og
+timesregel og gruppe per felt. Månedstaket ligger i taksttabellen og slås opp for tidspunktet til hver passering. En batch med passeringer prises dermed med vektoriserte oppslag,
+kun timesregelen krever en gjennomgang av passeringene (sortert, og kun for de feltene som har timesregel)
+
+Tolkning av APAR-feltene:
+    rushHour:              Liste med vinduer { 'from' : 'HH:MM', 'to' : 'HH:MM', 'days' : [1..7] } eller tekst
+                           'HH:MM-HH:MM,HH:MM-HH:MM'. Uten dager gjelder vinduet mandag-fredag
+    timeRuleType:          Timesregel gjelder hvis verdien er satt og ikke er 'NONE', 'NO' eller 'INGEN'
+    timeRuleDuration:      Varighet i minutter, default 60
+    timeRuleGroup:         Passeringer i samme gruppe (og hos samme operatør) deler timesregel
+    monthlyMaximumCharges: Maks antall betalte passeringer per kalendermåned, per operatør
+    freeHandicap:          Gratis passering med HC-brikke (kolonnen hc i passeringene)
+
+Eksempel:
+    motor = prismotor.Prismotor( aparmodell.AparData.fraApar( apardump ))
+    resultat = motor.pris( passeringer )     # dataframe med tollStationKey, tidspunkt, klasse, (kjoretoy)
+    print( resultat['belastet'].sum() / 100, 'kroner' )
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+import aparmodell
+
+minutterPerUke = 7 * 24 * 60
+
+# Pristyper som brukes utenfor og innenfor rushtid
+normalpris = 'priceNoRebate'
+rushpris = 'priceRushHourNoRebate'
+
+# 1970-01-01 var en torsdag (ukedag 3 når mandag er 0)
+_ukedagEpoke = 3
+
+def _minutt( tekst ):
+    timer, minutter = re.match( r'\s*(\d{1,2})[:.]?(\d{2})?', str( tekst )).groups()
+    return int( timer ) * 60 + int( minutter or 0 )
+
+def _rushvinduer( verdi ):
+    """
+    Tolker rushHour til liste med ( ukedag, fra minutt, til minutt ), ukedag 0 = mandag
+    """
+    if verdi is None or verdi is False or ( isinstance( verdi, float ) and np.isnan( verdi )):
+        return []
+    if isinstance( verdi, dict ):
+        verdi = [ verdi ]
+    if isinstance( verdi, str ):
+        verdi = [ { 'from' : x.split( '-' )[0], 'to' : x.split( '-' )[1] } for x in re.split( r'[,;]', verdi ) if '-' in x ]
+    if not isinstance( verdi, list ):
+        return []
+
+    vinduer = []
+    for vindu in verdi:
+        if not isinstance( vindu, dict ):
+            continue
+        fra = vindu.get( 'from', vindu.get( 'fromTime', vindu.get( 'start' )))
+        til = vindu.get( 'to', vindu.get( 'toTime', vindu.get( 'end' )))
+        if fra is None or til is None:
+            continue
+        dager = vindu.get( 'days', vindu.get( 'weekdays', [ 1, 2, 3, 4, 5 ] ))
+        for dag in dager:
+            vinduer.append( ( ( int( dag ) - 1 ) % 7, _minutt( fra ), _minutt( til )))
+    return vinduer
+
+def _timesregel( felt ):
+    regel = felt.timeRuleType
+    if not regel or str( regel ).strip().upper() in ( 'NONE', 'NO', 'INGEN', 'FALSE' ):
+        return 0
+    try:
+        varighet = int( float( felt.timeRuleDuration ))
+    except ( TypeError, ValueError ):
+        varighet = 60
+    return varighet * 60
+
+def _sekunder( tidspunkt ):
+    """
+    Sekunder siden 1970 som int64, begrenset til 32 bit (år 1970 - 2106)
+    """
+    return np.clip( np.asarray( tidspunkt, dtype='datetime64[s]' ).astype( np.int64 ), 0, 2**32 - 1 )
+
+def _sant( verdi ):
+    return verdi is True or str( verdi ).strip().lower() in ( 'true', 'ja', 'yes', '1' )
+
+class Prismotor:
+    """
+    Forhåndskompilerte takster og rushtidsvinduer for alle felt i APAR-data
+
+    ARGUMENTS
+        apar: aparmodell.AparData
+    """
+    def __init__( self, apar ):
+        self.apar = apar
+        priser = apar.priser
+        self.klasser = pd.Index( priser.klasser )
+        # Første felt per tollStationKey, som i AparData.indeks
+        nokler = pd.Series( [ str( f.tollStationKey ) for f in apar.felt ] )
+        self.nokler = pd.Index( nokler.drop_duplicates( keep='first' ))
+        self._feltnr = nokler.drop_duplicates( keep='first' ).index.to_numpy( dtype=np.int32 )
+        antallFelt = len( apar.felt )
+
+        # Én int64-nøkkel per prisintervall: ( felt, klasse, pristype ) i de øverste bitene og fra-tidspunkt (sekunder)
+        # i de nederste 32. Pristabell er allerede sortert på felt, klasse, pristype og fra, dvs nøkkelen er sortert
+        self._antallKlasser = len( priser.klasser )
+        self._antallTyper = len( priser.pristyper )
+        self._celle = ( priser.felt.astype( np.int64 ) * self._antallKlasser + priser.klasse ) * self._antallTyper + priser.pristype
+        self._nokkel = ( self._celle << 32 ) | _sekunder( priser.fra )
+        assert np.all( np.diff( self._nokkel ) >= 0 ), "Pristabell er ikke sortert"
+        self._til = priser.til.astype( np.int64 )
+        self._ore = priser.ore
+        self._pristype = { navn : ii for ii, navn in enumerate( priser.pristyper ) }
+
+        # Rushtidsvinduer: én minutt-tabell per unike sett med vinduer
+        planer = {}
+        self.planIndeks = np.zeros( antallFelt, dtype=np.int32 )
+        for ii, felt in enumerate( apar.felt ):
+            vinduer = tuple( sorted( _rushvinduer( felt.rushHour )))
+            self.planIndeks[ii] = planer.setdefault( vinduer, len( planer ))
+        self.planer = np.zeros( ( max( 1, len( planer )), minutterPerUke ), dtype=bool )
+        for vinduer, nr in planer.items():
+            for dag, fra, til in vinduer:
+                # Vinduer over midnatt fortsetter på neste dag (og søndag går over i mandag)
+                minutter = ( dag * 1440 + fra + np.arange( ( til - fra ) % 1440 )) % minutterPerUke
+                self.planer[ nr, minutter ] = True
+
+        # Timesregel, månedstak og HC-fritak per felt
+        self.timesregel = np.array( [ _timesregel( f ) for f in apar.felt ], dtype=np.int64 )
+        operatorer = pd.Index( sorted( { str( f.operatorId ) for f in apar.felt } ))
+        self.operator = operatorer.get_indexer( [ str( f.operatorId ) for f in apar.felt ] ).astype( np.int32 )
+        grupper = [ f"{f.operatorId}_{f.timeRuleGroup if f.timeRuleGroup not in ( None, '' ) else f.tollStationKey}" for f in apar.felt ]
+        self.gruppe = pd.factorize( pd.Series( grupper ))[0].astype( np.int32 )
+        self.fritakHC = np.array( [ _sant( f.freeHandicap ) for f in apar.felt ], dtype=bool )
+        self._takklasse = priser.klasser.index( 'monthlyMaximumCharges' ) if 'monthlyMaximumCharges' in priser.klasser else -1
+
+    def _maanedstak( self, felt, t ):
+        """
+        Maks antall betalte passeringer per måned for hver passering, 0 = ingen tak. Bruker taket som gjelder på
+        tidspunktet for passeringen (høyeste verdi over pristypene), slik at et tak som endres gjelder fra sin måned
+        """
+        tak = np.zeros( len( felt ), dtype=np.int32 )
+        if self._takklasse < 0:
+            return tak
+        klasse = np.full( len( felt ), self._takklasse, dtype=np.int64 )
+        for pristype in self._pristype:
+            tak = np.maximum( tak, np.maximum( self._oppslag( felt, klasse, pristype, t ), 0 ) // 100 )
+        return tak
+
+    def _oppslag( self, felt, klasse, pristype, t ):
+        """
+        Takst i øre for hver passering, -1 der det ikke finnes gjeldende takst
+        """
+        ore = np.full( len( felt ), -1, dtype=np.int32 )
+        if pristype not in self._pristype or len( self._nokkel ) == 0:
+            return ore
+        gyldig = ( felt >= 0 ) & ( klasse >= 0 )
+        celle = ( felt.astype( np.int64 ) * self._antallKlasser + klasse ) * self._antallTyper + self._pristype[pristype]
+
+        # Siste prisintervall med samme felt, klasse og pristype som starter før eller samtidig med passeringen
+        treff = np.searchsorted( self._nokkel, ( celle << 32 ) | _sekunder( t ), side='right' ) - 1
+        ok = gyldig & ( treff >= 0 )
+        ok[ok] &= ( self._celle[ treff[ok] ] == celle[ok] ) & ( self._til[ treff[ok] ] > t[ok].astype( np.int64 ))
+        ore[ok] = self._ore[ treff[ok] ]
+        return ore
+
+    def pris( self, passeringer ):
+        """
+        Beregner belastet beløp for en batch med passeringer
+
+        ARGUMENTS
+            passeringer: pandas dataframe med kolonnene tollStationKey, tidspunkt (lokal tid) og klasse (APAR
+                         kjøretøyklasse, f.eks 'smallVehicle'). Med kolonne kjoretoy brukes timesregel og månedstak,
+                         med kolonne hc (True/False) brukes fritak for HC-brikke
+
+        RETURNS
+            pandas dataframe med samme indeks som passeringer og kolonnene rushtid, takst (øre, <NA> der vi ikke
+            finner takst), belastet (øre) og regel ('', 'timesregel', 'månedstak', 'HC-fritak' eller 'mangler takst')
+        """
+        antall = len( passeringer )
+        indeks = self.nokler.get_indexer( passeringer['tollStationKey'].astype( str ))
+        felt = np.where( indeks >= 0, self._feltnr[ np.maximum( indeks, 0 ) ], -1 ).astype( np.int32 )
+        kjent = felt >= 0
+        feltOk = np.where( kjent, felt, 0 )
+        klasse = self.klasser.get_indexer( passeringer['klasse'] )
+        t = aparmodell.lokaltid( pd.to_datetime( passeringer['tidspunkt'] ))
+        sek = t.astype( np.int64 )
+
+        # Rushtid: minutt i uka (mandag 00:00 = 0) slås opp i den forhåndskompilerte tabellen for feltet
+        minutt = (( sek // 86400 + _ukedagEpoke ) % 7 ) * 1440 + ( sek % 86400 ) // 60
+        rushtid = self.planer[ self.planIndeks[feltOk], minutt ] & kjent
+
+        normal = self._oppslag( felt, klasse, normalpris, t )
+        rush = self._oppslag( felt, klasse, rushpris, t )
+        # Rushtidspris 0 kr betyr ingen egen rushtidstakst, som i aparmodell.endringsavvik
+        takst = np.where( rushtid & ( rush > 0 ), rush, normal )
+        mangler = takst < 0
+        belastet = np.where( mangler, 0, takst ).astype( np.int32 )
+        regel = np.where( mangler, 'mangler takst', '' ).astype( object )
+
+        if 'hc' in passeringer.columns:
+            fri = passeringer['hc'].fillna( False ).to_numpy( dtype=bool ) & self.fritakHC[feltOk] & kjent & ( belastet > 0 )
+            belastet[fri] = 0
+            regel[fri] = 'HC-fritak'
+
+        if 'kjoretoy' in passeringer.columns:
+            kjoretoy = pd.factorize( passeringer['kjoretoy'] )[0]
+            self._brukTimesregel( kjoretoy, feltOk, kjent, sek, belastet, regel )
+            self._brukMaanedstak( kjoretoy, feltOk, kjent, t, belastet, regel )
+
+        return pd.DataFrame( { 'rushtid'  : rushtid,
+                               'takst'    : pd.arrays.IntegerArray( np.maximum( takst, 0 ).astype( np.int32 ), mangler ),
+                               'belastet' : belastet,
+                               'regel'    : regel }, index=passeringer.index )
+
+    def _brukTimesregel( self, kjoretoy, felt, kjent, sek, belastet, regel ):
+        """
+        Timesregel: Innenfor varigheten fra første passering i et vindu betales kun differansen opp til dyreste passering
+        """
+        utvalg = np.nonzero( kjent & ( kjoretoy >= 0 ) & ( self.timesregel[felt] > 0 ) & ( belastet > 0 ))[0]
+        if len( utvalg ) == 0:
+            return
+        gruppe = self.gruppe[ felt[utvalg] ]
+        utvalg = utvalg[ np.lexsort( ( sek[utvalg], gruppe, kjoretoy[utvalg] )) ]
+
+        forrige = None
+        start = maks = 0
+        for ii, nokkel, tt, pris, varighet in zip( utvalg.tolist(), zip( kjoretoy[utvalg].tolist(), self.gruppe[ felt[utvalg] ].tolist() ),
+                                                  sek[utvalg].tolist(), belastet[utvalg].tolist(), self.timesregel[ felt[utvalg] ].tolist() ):
+            if nokkel != forrige or tt - start >= varighet:
+                forrige, start, maks = nokkel, tt, pris
+            else:
+                belastet[ii] = max( 0, pris - maks )
+                maks = max( maks, pris )
+                regel[ii] = 'timesregel'
+
+    def _brukMaanedstak( self, kjoretoy, felt, kjent, t, belastet, regel ):
+        """
+        Månedstak: Passeringer utover maks antall betalte passeringer per kjøretøy, operatør og kalendermåned er gratis
+        """
+        utvalg = np.nonzero( kjent & ( kjoretoy >= 0 ) & ( belastet > 0 ))[0]
+        tak = self._maanedstak( felt[utvalg], t[utvalg] )
+        utvalg, tak = utvalg[ tak > 0 ], tak[ tak > 0 ]
+        if len( utvalg ) == 0:
+            return
+        df = pd.DataFrame( { 'rad'      : utvalg,
+                             'kjoretoy' : kjoretoy[utvalg],
+                             'operator' : self.operator[ felt[utvalg] ],
+                             'maaned'   : t[utvalg].astype( 'datetime64[M]' ),
+                             'tid'      : t[utvalg],
+                             'tak'      : tak } ).sort_values( 'tid', kind='stable' )
+        nummer = df.groupby( [ 'kjoretoy', 'operator', 'maaned' ] ).cumcount().to_numpy()
+        over = df['rad'].to_numpy()[ nummer >= df['tak'].to_numpy() ]
+        belastet[over] = 0
+        regel[over] = 'månedstak'
+
+def inntekt( passeringer, resultat, etter=( 'tollStationKey', ) ):
+    """
+    Summerer belastet beløp (kroner) og antall passeringer, gruppert på kolonnene i etter
+    """
+    df = passeringer[ list( etter ) ].assign( belastet=resultat['belastet'] / 100, passeringer=1 )
+    return df.groupby( list( etter )).sum().reset_index()
+
+
+if __name__ == '__main__':
+    import sys
+    import json
+    from datetime import datetime
+
+    mappe = '/mnt/c/DATA/leveranser/apardata/'
+    t0 = datetime.now()
+    with open( mappe + 'apardump.json' ) as f:
+        motor = Prismotor( aparmodell.AparData.fraApar( json.load( f )))
+    print( f"Prismotor klar: {len( motor.apar )} felt, {len( motor.planer )} ulike rushtidsplaner, {datetime.now()-t0}")
+
+    # Passeringslogg som csv med kolonnene tollStationKey, tidspunkt, klasse (og evt kjoretoy, hc)
+    passeringer = pd.read_csv( sys.argv[1] if len( sys.argv ) > 1 else mappe + 'passeringer.csv' )
+    t0 = datetime.now()
+    resultat = motor.pris( passeringer )
+    print( f"Priset {len( passeringer )} passeringer på {datetime.now()-t0}")
+    print( inntekt( passeringer, resultat ))
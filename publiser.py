@@ -0,0 +1,207 @@
+"""
+Publisering av resultatfiler til webmappa (f.eks /var/www/html/apardata/)
+
+- Filene skrives først til en midlertidig fil i samme mappe og flyttes på plass med os.replace,
+  slik at de som leser aldri ser en halvskrevet fil
+- For formater der samme innhold gir samme bytes (json) sammenlignes fila med forrige publiserte versjon
+  (sha256), og uendrede filer blir ikke skrevet på nytt. Excel og geopackage har tidsstempel inne i fila,
+  og publiseres alltid
+- For json-filer lages ferdig komprimerte varianter (.gz og evt .br) og en .etag-fil med ETag-verdien. Alt
+  skrives ferdig til midlertidige filer før noe flyttes, og hovedfila flyttes på plass først, slik at en
+  variant aldri er nyere enn fila den er laget fra
+
+Eksempel:
+    publiser.skrivJson( data, mappe + 'apardump.json' )
+
+    with publiser.atomisk( mappe + 'takstavvik.gpkg' ) as tmpfil:
+        minGeoDataFrame.to_file( tmpfil )
+"""
+import os
+import json
+import gzip
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Filformater der samme innhold alltid gir samme fil, og sjekksummen dermed kan avgjøre om fila er endret
+deterministiske = ( '.json', )
+
+def sjekksum( filnavn, blokkstr=1 << 20 ) -> str:
+    """
+    Regner ut sha256 for innholdet i en fil, eller None hvis fila ikke finnes
+    """
+    if not os.path.isfile( filnavn ):
+        return None
+    h = hashlib.sha256()
+    with open( filnavn, 'rb' ) as f:
+        for blokk in iter( lambda: f.read( blokkstr ), b'' ):
+            h.update( blokk )
+    return h.hexdigest()
+
+def _tempfil( filnavn ):
+    """
+    Lager midlertidig filnavn i samme mappe som filnavn, slik at os.replace blir atomisk
+    """
+    mappe, navn = os.path.split( os.path.abspath( filnavn ))
+    # Beholder filendelsen, den brukes av bl.a. GPKG- og Excel-skriverne
+    _, endelse = os.path.splitext( navn )
+    fd, tmpfil = tempfile.mkstemp( prefix='.' + navn + '.', suffix='.tmp' + endelse, dir=mappe )
+    os.close( fd )
+    # Noen skrivere (f.eks GPKG-driveren) vil selv lage fila
+    os.remove( tmpfil )
+    return tmpfil
+
+def _flyttPaaPlass( tmpfil, filnavn ):
+    with open( tmpfil, 'rb' ) as f:
+        os.fsync( f.fileno() )
+    os.chmod( tmpfil, 0o644 )
+    os.replace( tmpfil, filnavn )
+
+def _skrivVarianter( filnavn, kildefil, etag, blokkstr=1 << 20 ):
+    """
+    Skriver komprimerte varianter (.gz, .br) og .etag for en publisert fil til midlertidige filer. Kildefila
+    leses og komprimeres blokkvis, slik at store filer ikke holdes i minnet
+
+    RETURNS
+        Liste med ( midlertidig fil, publisert filnavn ), i den rekkefølgen de skal flyttes på plass
+    """
+    varianter = [ ( _tempfil( filnavn + '.gz' ), filnavn + '.gz' ) ]
+    if brotli:
+        varianter.append( ( _tempfil( filnavn + '.br' ), filnavn + '.br' ))
+    varianter.append( ( _tempfil( filnavn + '.etag' ), filnavn + '.etag' ))
+    try:
+        tmpBr = varianter[1][0] if brotli else None
+        komprimering = brotli.Compressor( quality=11 ) if brotli else None
+        with open( kildefil, 'rb' ) as kilde, open( varianter[0][0], 'wb' ) as fGz, open( tmpBr or os.devnull, 'wb' ) as fBr:
+            with gzip.GzipFile( filename='', mode='wb', fileobj=fGz, compresslevel=9, mtime=0 ) as gz:
+                for blokk in iter( lambda: kilde.read( blokkstr ), b'' ):
+                    gz.write( blokk )
+                    if komprimering:
+                        fBr.write( komprimering.process( blokk ))
+            if komprimering:
+                fBr.write( komprimering.finish() )
+
+        with open( varianter[-1][0], 'wb' ) as f:
+            f.write( ( '"' + etag + '"' ).encode( 'ascii' ))
+    except BaseException:
+        _rydd( [ tmp for tmp, _ in varianter ] )
+        raise
+    return varianter
+
+def _rydd( tmpfiler ):
+    """
+    Sletter midlertidige filer som finnes
+    """
+    for tmpfil in tmpfiler:
+        if os.path.isfile( tmpfil ):
+            os.remove( tmpfil )
+
+def publiserFil( tmpfil, filnavn, komprimer=None, hoppOverUendret=None ) -> bool:
+    """
+    Publiserer en ferdig skrevet midlertidig fil til filnavn, hvis innholdet er endret
+
+    ARGUMENTS
+        tmpfil: Midlertidig fil, skal ligge i samme mappe som filnavn
+
+        filnavn: Publisert filnavn
+
+    KEYWORDS:
+        komprimer: None (default) | True | False. Lag .gz/.br/.etag-varianter. None => kun for .json
+
+        hoppOverUendret: None (default) | True | False. Publiser ikke hvis sjekksummen er den samme som for
+                         publisert fil. None => kun for formatene i deterministiske
+
+    RETURNS
+        True hvis fila ble publisert, False hvis innholdet var uendret
+    """
+    if komprimer is None:
+        komprimer = filnavn.endswith( '.json' )
+    if hoppOverUendret is None:
+        hoppOverUendret = filnavn.endswith( deterministiske )
+
+    nySum = sjekksum( tmpfil )
+    if hoppOverUendret and nySum == sjekksum( filnavn ) and ( not komprimer or os.path.isfile( filnavn + '.etag' )):
+        os.remove( tmpfil )
+        print( f"Uendret, publiserer ikke {filnavn}")
+        return False
+
+    # Alt skrives ferdig før noe flyttes. Hovedfila først, deretter variantene, med .etag til sist
+    try:
+        varianter = _skrivVarianter( filnavn, tmpfil, nySum ) if komprimer else []
+    except BaseException:
+        _rydd( [ tmpfil ] )
+        raise
+    _flyttPaaPlass( tmpfil, filnavn )
+    for tmpVariant, variant in varianter:
+        _flyttPaaPlass( tmpVariant, variant )
+    return True
+
+@contextmanager
+def atomisk( filnavn, komprimer=None, hoppOverUendret=None ):
+    """
+    Context manager som gir et midlertidig filnavn å skrive til. Når blokken er ferdig publiseres fila
+    med publiserFil. Hvis blokken feiler slettes den midlertidige fila, og forrige versjon blir stående
+    """
+    tmpfil = _tempfil( filnavn )
+    try:
+        yield tmpfil
+    except BaseException:
+        _rydd( [ tmpfil ] )
+        raise
+    publiserFil( tmpfil, filnavn, komprimer=komprimer, hoppOverUendret=hoppOverUendret )
+
+def skrivJson( data, filnavn, **kwargs ) -> bool:
+    """
+    Skriver data som json (indent=4, ensure_ascii=False) og publiserer fila hvis den er endret
+
+    RETURNS
+        True hvis fila ble publisert, False hvis innholdet var uendret
+    """
+    tmpfil = _tempfil( filnavn )
+    try:
+        with open( tmpfil, 'w' ) as f:
+            json.dump( data, f, indent=4, ensure_ascii=False )
+    except BaseException:
+        _rydd( [ tmpfil ] )
+        raise
+    return publiserFil( tmpfil, filnavn, **kwargs )
+
+class JsonListe:
+    """
+    Skriver elementene i en json-liste etter hvert, se jsonListe
+    """
+    def __init__( self, f ):
+        self._f = f
+        self.antall = 0
+
+    def skriv( self, elementer ):
+        """
+        Legger elementer (liste eller annen iterator) til i lista
+        """
+        for element in elementer:
+            self._f.write( '[\n    ' if self.antall == 0 else ',\n    ' )
+            # Samme innrykk som json.dump( liste, indent=4 ) gir for elementer i en liste
+            self._f.write( json.dumps( element, indent=4, ensure_ascii=False ).replace( '\n', '\n    ' ))
+            self.antall += 1
+
+@contextmanager
+def jsonListe( filnavn, **kwargs ):
+    """
+    Context manager for å skrive en stor json-liste i bolker, uten å ha hele lista i minnet. Resultatet er
+    identisk med skrivJson( liste, filnavn ), og publiseres på samme måte når blokken er ferdig
+
+    Eksempel:
+        with publiser.jsonListe( mappe + 'apardump.json' ) as apardump:
+            for bolk in bolker:
+                apardump.skriv( bolk )
+    """
+    with atomisk( filnavn, **kwargs ) as tmpfil:
+        with open( tmpfil, 'w' ) as f:
+            liste = JsonListe( f )
+            yield liste
+            f.write( '\n]' if liste.antall else '[]' )
@@ -1,14 +1,18 @@
 """
 Henter generert endringssett for bomstasjoner og skriver til NVDB
+
+Med --lokal [url] sendes endringssettet i stedet til den lokale stedfortrederen for skrive-API (lokalskriv.py),
+default http://127.0.0.1:8090/rest/v3
 """
 
+import sys
 import json
 import STARTHER
 import skrivnvdb
-import requests
+import httpcache
 
 if __name__ == '__main__': 
-    data = requests.get( 'https://langbein.npra.io/apardata/bomstasjon_endringssett.json' ).json()
+    data = httpcache.get( 'https://langbein.npra.io/apardata/bomstasjon_endringssett.json' ).json()
     assert 'delvisOppdater' in data, "Dette er ikke endringssett for delvisOppdater"
     assert 'vegobjekter' in  data['delvisOppdater'], "Dette er ikke endringssett for delvisOppdater - mangler vegobjekter"
     assert isinstance(  data['delvisOppdater']['vegobjekter'], list  ), "vegobjekter-elementet må være en liste"
@@ -17,7 +21,13 @@ if __name__ == '__main__':
         print( f"{len( data['delvisOppdater']['vegobjekter']) } bomstasjoner har fått nye takster, lagrer til NVDB")
 
         endr = skrivnvdb.endringssett( data )
-        endr.forbindelse.login( miljo='prodskriv' )
+        if '--lokal' in sys.argv:
+            ix = sys.argv.index( '--lokal' )
+            lokalurl = sys.argv[ix+1] if len( sys.argv ) > ix+1 else 'http://127.0.0.1:8090/rest/v3'
+            print( f"Skriver til lokal skrivetjeneste {lokalurl}, ikke til NVDB")
+            endr.forbindelse.apiurl = lokalurl
+        else:
+            endr.forbindelse.login( miljo='prodskriv' )
         endr.registrer()
         endr.startskriving()
 
@@ -0,0 +1,223 @@
+"""
+Kobling mellom APAR og NVDB som SQL i en innebygd database: DuckDB hvis det er installert, ellers sqlite3
+
+Brukes av tolkapar.sammenstill( ..., sql=sqlkobling.Sqlmotor() ) for
+    - kobling på operatør ID og bomstasjon ID (enkel og flertydig kobling)
+    - APAR-felt og NVDB-bomstasjoner uten kobling (anti-join med NOT EXISTS)
+    - takstavvik (APAR-takst ulik NVDB-takst, sammenlignet som heltall øre med flagg for manglende takst)
+
+Kun nøkkelkolonnene og et radnummer lastes inn i databasen. Spørringene returnerer radnummer, og tabellene
+settes sammen igjen i pandas med iloc, slik at resultatet er identisk med pandas-versjonen (se paritet.py).
+Nøklene lastes inn som tall, manglende nøkler og tekst som ikke er tall blir NULL og kobles aldri. Pandas-versjonen
+(koblePandas) fjerner de samme radene før pd.merge, som ellers ville koblet NaN mot NaN
+Med DuckDB kjøres spørringene parallelt, og med filnavn og minnegrense skrives mellomresultater til disk når
+de ikke får plass i minnet
+
+For analyser over mange øyeblikksbilder kan historikken (parquet) spørres direkte med registrerParquet, uten å
+lese alt inn i pandas først (med sqlite leses filene inn med pandas)
+
+Eksempel:
+    sql = sqlkobling.Sqlmotor( filnavn=mappe + 'kobling.duckdb', minnegrense='2GB' )
+    resultat = tolkapar.sammenstill( apardata, nvdbAlle, sql=sql )
+
+    sql.registrerParquet( 'apar', glob.glob( mappe + 'historikk/apar/dato=*/del-*.parquet' ))
+    sql.sporring( "SELECT operatorId, count(*) FROM apar WHERE endring = 'endret' GROUP BY operatorId" )
+"""
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import aparmodell
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+KOBLING_SQL = """
+    SELECT a._rad AS aparrad, n._rad AS nvdbrad
+    FROM apar a JOIN {nvdbtabell} n ON a.operatorId = n.operatorId AND a.tollStationCode = n.tollStationCode
+    ORDER BY a._rad, n._rad
+"""
+
+APAR_UTEN_KOBLING_SQL = """
+    SELECT a._rad FROM apar a
+    WHERE NOT EXISTS ( SELECT 1 FROM nvdb n WHERE n.operatorId = a.operatorId AND n.tollStationCode = a.tollStationCode )
+    ORDER BY a._rad
+"""
+
+NVDB_UTEN_KOBLING_SQL = """
+    SELECT alle._rad FROM nvdballe alle
+    WHERE NOT EXISTS ( SELECT 1 FROM nvdb n JOIN apar a ON n.operatorId = a.operatorId AND n.tollStationCode = a.tollStationCode
+                       WHERE n.nvdbId = alle.nvdbId )
+    ORDER BY alle._rad
+"""
+
+class Sqlmotor:
+    """
+    Innebygd SQL-database for koblingen, se modulbeskrivelsen
+
+    KEYWORDS:
+        motor: None (default, duckdb hvis installert, ellers sqlite) | 'duckdb' | 'sqlite'
+
+        filnavn: None (default, i minnet) eller databasefil. Med fil kan DuckDB skrive mellomresultater til disk
+
+        minnegrense: None (default) eller minnegrense for DuckDB, f.eks '2GB'
+
+        traader: None (default, alle kjerner) eller antall tråder for DuckDB
+    """
+    def __init__( self, motor=None, filnavn=None, minnegrense=None, traader=None ):
+        if motor is None:
+            motor = 'duckdb' if duckdb else 'sqlite'
+        if motor == 'duckdb' and duckdb is None:
+            raise ImportError( "Sqlmotor: duckdb er ikke installert, bruk motor='sqlite'" )
+        self.motor = motor
+        if motor == 'duckdb':
+            self.con = duckdb.connect( filnavn or ':memory:' )
+            if minnegrense:
+                self.con.execute( f"SET memory_limit = '{minnegrense}'" )
+            if traader:
+                self.con.execute( f"SET threads = {int( traader )}" )
+        else:
+            self.con = sqlite3.connect( filnavn or ':memory:', check_same_thread=False )
+
+    def registrer( self, navn, df ):
+        """
+        Laster en dataframe inn som tabell (erstatter evt tabell med samme navn)
+        """
+        if self.motor == 'duckdb':
+            self.con.register( '_df', df )
+            self.con.execute( f"CREATE OR REPLACE TABLE {navn} AS SELECT * FROM _df" )
+            self.con.unregister( '_df' )
+        else:
+            df.to_sql( navn, self.con, if_exists='replace', index=False )
+            kolonner = [ x for x in [ 'operatorId', 'tollStationCode' ] if x in df.columns ]
+            if len( kolonner ) == 2:
+                self.con.execute( f"CREATE INDEX IF NOT EXISTS {navn}_stasjon ON {navn} ( operatorId, tollStationCode )" )
+
+    def registrerParquet( self, navn, filer ):
+        """
+        Gjør parquet-filer (f.eks historikken) tilgjengelig som view, uten å lese dem inn. sqlite kan ikke lese
+        parquet, der leses filene inn med pandas (krever pyarrow) og lagres som tabell, med kolonner for
+        hive-partisjonene (f.eks dato=2025-01-01) som DuckDB
+        """
+        if self.motor != 'duckdb':
+            deler = []
+            for fil in filer:
+                df = pd.read_parquet( fil )
+                for mappe in os.path.normpath( str( fil )).split( os.sep )[:-1]:
+                    if '=' in mappe:
+                        kol, verdi = mappe.split( '=', 1 )
+                        df[kol] = verdi
+                deler.append( df )
+            if not deler:
+                raise ValueError( f"registrerParquet: Ingen filer for {navn}" )
+            self.registrer( navn, pd.concat( deler, ignore_index=True ))
+            return
+        filliste = ', '.join( [ "'" + str( x ).replace( "'", "''" ) + "'" for x in filer ] )
+        self.con.execute( f"CREATE OR REPLACE VIEW {navn} AS SELECT * FROM read_parquet( [ {filliste} ], hive_partitioning = true, union_by_name = true )" )
+
+    def sporring( self, sql, parametre=None ):
+        """
+        Kjører en spørring og returnerer resultatet som pandas dataframe
+        """
+        if self.motor == 'duckdb':
+            return self.con.execute( sql, parametre or [] ).df()
+        return pd.read_sql_query( sql, self.con, params=parametre )
+
+    def radnummer( self, sql ):
+        """
+        Første kolonne i resultatet som numpy array (int64), for spørringer som returnerer radnummer
+        """
+        df = self.sporring( sql )
+        return df.iloc[:, 0].to_numpy( dtype=np.int64 ) if len( df ) else np.zeros( 0, dtype=np.int64 )
+
+def _nokler( df, operatorkolonne, stasjonskolonne, ekstra=None ):
+    """
+    Nøkkelkolonnene og radnummer (posisjon i df) som skal inn i databasen, med felles kolonnenavn. Nøklene er tall,
+    manglende nøkler og tekst som ikke er tall blir NULL (kobles aldri, se koblePandas)
+    """
+    nokler = pd.DataFrame( { '_rad'            : np.arange( len( df ), dtype=np.int64 ),
+                             'operatorId'      : pd.to_numeric( df[operatorkolonne], errors='coerce' ).to_numpy( dtype=float ),
+                             'tollStationCode' : pd.to_numeric( df[stasjonskolonne], errors='coerce' ).to_numpy( dtype=float ) } )
+    for kol in ekstra or []:
+        nokler[kol] = df[kol].to_numpy()
+    return nokler
+
+def koblePandas( apardata, nvdb ):
+    """
+    Kobling som i kobling, men med pd.merge: Inner join mellom APAR-felt og NVDB-bomstasjoner på operatør ID og
+    bomstasjon ID. Rader med nøkler som mangler eller ikke er tall tas ikke med, slik de heller ikke kobles i SQL
+
+    RETURNS
+        pandas dataframe, som pd.merge( apardata, nvdb, how='inner' )
+    """
+    gyldig = lambda df, kolonner : np.logical_and.reduce( [ pd.to_numeric( df[kol], errors='coerce' ).notnull().to_numpy() for kol in kolonner ] )
+    return pd.merge( apardata[ gyldig( apardata, [ 'operatorId', 'tollStationCode' ] ) ], nvdb[ gyldig( nvdb, [ 'Operatør_Id', 'Bomstasjon_Id' ] ) ],
+                     left_on=[ 'operatorId', 'tollStationCode' ], right_on=[ 'Operatør_Id', 'Bomstasjon_Id' ], how='inner' )
+
+def _slaSammen( apardata, nvdb, par ):
+    """
+    Setter sammen koblede rader på samme måte som pd.merge( apardata, nvdb, how='inner' )
+    """
+    venstre = apardata.iloc[ par['aparrad'].to_numpy( dtype=np.int64 ) ].reset_index( drop=True )
+    hoyre = nvdb.iloc[ par['nvdbrad'].to_numpy( dtype=np.int64 ) ].reset_index( drop=True )
+    return pd.merge( venstre, hoyre, left_index=True, right_index=True, how='inner' )
+
+def kobling( sql, apardata, nvdbBomst, nvdb_duplikatId, nvdbAlle ):
+    """
+    Enkel og flertydig kobling, og APAR og NVDB uten kobling, som SQL
+
+    ARGUMENTS
+        sql: Sqlmotor
+
+        apardata: APAR-felt (uten kolonnen nvdbId)
+
+        nvdbBomst: NVDB-bomstasjoner med entydig operatør ID + bomstasjon ID
+
+        nvdb_duplikatId: NVDB-bomstasjoner der operatør ID + bomstasjon ID forekommer flere ganger
+
+        nvdbAlle: Alle NVDB-bomstasjoner
+
+    RETURNS
+        dictionary med merged, flertydig, apar_uten_kobling og nvdb_utenkobling (pandas dataframe)
+    """
+    sql.registrer( 'apar', _nokler( apardata, 'operatorId', 'tollStationCode' ))
+    sql.registrer( 'nvdbentydig', _nokler( nvdbBomst, 'Operatør_Id', 'Bomstasjon_Id', ekstra=[ 'nvdbId' ] ))
+    sql.registrer( 'nvdbflertydig', _nokler( nvdb_duplikatId, 'Operatør_Id', 'Bomstasjon_Id', ekstra=[ 'nvdbId' ] ))
+    sql.registrer( 'nvdb', pd.concat( [ _nokler( nvdbBomst, 'Operatør_Id', 'Bomstasjon_Id', ekstra=[ 'nvdbId' ] ),
+                                        _nokler( nvdb_duplikatId, 'Operatør_Id', 'Bomstasjon_Id', ekstra=[ 'nvdbId' ] ) ], ignore_index=True ))
+    sql.registrer( 'nvdballe', pd.DataFrame( { '_rad' : np.arange( len( nvdbAlle ), dtype=np.int64 ), 'nvdbId' : nvdbAlle['nvdbId'].to_numpy() } ))
+
+    merged = _slaSammen( apardata, nvdbBomst, sql.sporring( KOBLING_SQL.format( nvdbtabell='nvdbentydig' )))
+    flertydig = _slaSammen( apardata, nvdb_duplikatId, sql.sporring( KOBLING_SQL.format( nvdbtabell='nvdbflertydig' )))
+    return { 'merged'            : merged,
+             'flertydig'         : flertydig,
+             'apar_uten_kobling' : apardata.iloc[ sql.radnummer( APAR_UTEN_KOBLING_SQL ) ],
+             'nvdb_utenkobling'  : nvdbAlle.iloc[ sql.radnummer( NVDB_UTEN_KOBLING_SQL ) ] }
+
+def takstavvik( sql, df, takster=None, kunAparpris=True ):
+    """
+    Som aparmodell.takstavvik, men som SQL: Rader der minst én APAR-takst er ulik NVDB-taksten. Takstene lastes
+    inn som heltall øre pluss et flagg for manglende takst (SQL NULL brukes ikke, da NULL aldri er lik NULL)
+
+    RETURNS
+        Radene i df med avvik
+    """
+    if takster is None:
+        takster = aparmodell.nvdbtakster
+    apar, aparMangler = aparmodell.aparOre( df, takster )
+    nvdb, nvdbMangler = aparmodell.tilOre( df[ [ t['nvdb'] for t in takster ] ].to_numpy( dtype=float ))
+    tabell = pd.DataFrame( { '_rad' : np.arange( len( df ), dtype=np.int64 ) } )
+    vilkar = []
+    for ii in range( len( takster )):
+        tabell[ f"apar{ii}" ] = apar[:, ii].astype( np.int64 )
+        tabell[ f"nvdb{ii}" ] = nvdb[:, ii].astype( np.int64 )
+        tabell[ f"aparmangler{ii}" ] = aparMangler[:, ii].astype( np.int64 )
+        tabell[ f"nvdbmangler{ii}" ] = nvdbMangler[:, ii].astype( np.int64 )
+        avvik = f"( aparmangler{ii} <> nvdbmangler{ii} OR ( aparmangler{ii} = 0 AND nvdbmangler{ii} = 0 AND apar{ii} <> nvdb{ii} ))"
+        vilkar.append( f"( {avvik} AND aparmangler{ii} = 0 )" if kunAparpris else avvik )
+    sql.registrer( 'takster', tabell )
+    return df.iloc[ sql.radnummer( "SELECT _rad FROM takster WHERE " + ' OR '.join( vilkar ) + " ORDER BY _rad" ) ]
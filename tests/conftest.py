@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modulene ligger flatt i rota av repoet
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ))))
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import aparmodell
+
+def _rader( apar, nvdb ):
+    """
+    Én rad per par av ( APAR-takster, NVDB-takster ) i kroner, None = mangler. Rekkefølge som i nvdbtakster
+    """
+    df = pd.DataFrame( { t['apar'] : [ a[ii] for a in apar ] for ii, t in enumerate( aparmodell.nvdbtakster ) } )
+    for ii, t in enumerate( aparmodell.nvdbtakster ):
+        df[ t['nvdb'] ] = [ n[ii] for n in nvdb ]
+    return df.astype( float )
+
+def test_takstavvik_skiller_mangler_og_null():
+    df = _rader( [ [ 0, 20, None, None ], [ 20, 20, 30, 30 ] ],
+                 [ [ None, 20, 0, None ], [ 20, 21, 30, 30 ] ] )
+    avvik = aparmodell.takstavvik( df, kunAparpris=False )
+    assert avvik.tolist() == [ [ True, False, True, False ], [ False, True, False, False ] ]
+
+def test_endringsavvik_skriver_ikke_null_kroner():
+    # 0 kr grunntakst og 0 kr rushtidstakst i APAR er ingen takst, og skal ikke skrives til NVDB
+    df = _rader( [ [ 0, 20, 0, 0 ], [ 25, 0, 35, None ] ],
+                 [ [ 15, 15, 10, None ], [ 20, 10, 30, 30 ] ] )
+    skriv, ore, mangler = aparmodell.endringsavvik( df )
+    assert skriv.tolist() == [ [ False, True, False, False ], [ True, False, True, False ] ]
+    assert ore[0].tolist() == [ 0, 2000, 0, 0 ]
+    assert mangler[1].tolist() == [ False, False, False, True ]
+    # Rapporten ser fortsatt avvikene
+    assert aparmodell.takstavvik( df, kunAparpris=False )[0].tolist() == [ True, True, True, True ]
+
+def test_endringsavvik_med_orekolonner():
+    df = _rader( [ [ 20, 0, 0, 0 ] ], [ [ 21, 5, 5, None ] ] )
+    for ii, t in enumerate( aparmodell.nvdbtakster ):
+        df[ t['ore'] ] = aparmodell.orekolonne( np.array( [ [ 2000, 0, 0, 0 ][ii] ], dtype=np.int32 ), np.array( [ ii == 3 ] ))
+    skriv, _, _ = aparmodell.endringsavvik( df )
+    assert skriv.tolist() == [ [ True, False, False, False ] ]
+
+def test_lokaltid_regner_om_tidssoner():
+    tider = aparmodell.lokaltid( [ '2026-01-01T00:00:00+01:00', '2025-12-31T23:00:00Z', '2026-07-01T08:00:00+02:00',
+                                   '2026-01-01T00:00:00', '2026-01-01', None ] )
+    assert tider.astype( str ).tolist() == [ '2026-01-01T00:00:00', '2026-01-01T00:00:00', '2026-07-01T08:00:00',
+                                             '2026-01-01T00:00:00', '2026-01-01T00:00:00', 'NaT' ]
+    assert len( aparmodell.lokaltid( [] )) == 0
+
+def test_aktiv_pris_med_tidssone():
+    # 08:00 sommertid er 06:00 UTC. Prisen gjelder ikke klokka 07:30 lokal tid
+    pris = { 'price' : 30, 'activeFrom' : '2026-10-19T08:00:00+02:00', 'activeTo' : '2099-01-01T00:00:00Z' }
+    apar = aparmodell.AparData.fraApar( [ { 'operatorId' : 1, 'tollStationCode' : 'A', 'tollStationKey' : 'A',
+                                            'smallVehicle' : { 'priceNoRebate' : [ pris ] } } ] )
+    ore, mangler = apar.priser.aktiveOre( 'smallVehicle', 'priceNoRebate', tidspunkt=datetime( 2026, 10, 19, 7, 30 ))
+    assert mangler.tolist() == [ True ]
+    ore, mangler = apar.priser.aktiveOre( 'smallVehicle', 'priceNoRebate', tidspunkt=datetime( 2026, 10, 19, 8, 30 ))
+    assert ( ore.tolist(), mangler.tolist() ) == ( [ 3000 ], [ False ] )
@@ -0,0 +1,26 @@
+import lokalskriv
+
+def _sett( *vegobjekter ):
+    return { 'delvisOppdater' : { 'vegobjekter' : list( vegobjekter ) } }
+
+def _objekt( **endret ):
+    obj = { 'typeId' : 45, 'nvdbId' : 1, 'versjon' : 1, 'gyldighetsperiode' : { 'startdato' : '2026-10-19' },
+            'egenskaper' : [ { 'typeId' : 1820, 'operasjon' : 'oppdater', 'verdi' : [ '20' ] } ] }
+    obj.update( endret )
+    return obj
+
+def test_gyldig_endringssett():
+    assert lokalskriv.valider( _sett( _objekt(), _objekt( nvdbId=2 ))) == []
+
+def test_ugyldige_objekter_gir_feilmeldinger():
+    feil = lokalskriv.valider( _sett( 'tekst', _objekt( gyldighetsperiode=None ), _objekt( nvdbId=2, gyldighetsperiode='2026-10-19' ),
+                                      _objekt( nvdbId=3, egenskaper=[ None, 7 ] ), _objekt( nvdbId=[ 4 ] )))
+    assert feil == [ 'vegobjekter[0]: Vegobjektet er ikke et objekt',
+                     'vegobjekter[2]: gyldighetsperiode er ikke et objekt',
+                     'vegobjekter[3].egenskaper[0]: Egenskapen er ikke et objekt',
+                     'vegobjekter[3].egenskaper[1]: Egenskapen er ikke et objekt',
+                     'vegobjekter[4]: nvdbId mangler eller er ikke heltall' ]
+
+def test_registrer_avviser_ugyldig_endringssett():
+    esId, feil = lokalskriv.Skrivetjeneste( fastTid=0 ).registrer( _sett( _objekt( egenskaper=[ 'x' ] )))
+    assert esId is None and len( feil ) == 1
@@ -0,0 +1,19 @@
+import paritet
+
+def _sett( *vegobjekter ):
+    return { 'delvisOppdater' : { 'vegobjekter' : list( vegobjekter ) } }
+
+def _objekt( nvdbId, takst ):
+    return { 'nvdbId' : nvdbId, 'typeId' : 45, 'versjon' : 1,
+             'egenskaper' : [ { 'typeId' : 1820, 'operasjon' : 'oppdater', 'verdi' : [ takst ] } ] }
+
+def test_like_endringssett_uten_hensyn_til_rekkefolge():
+    a = _sett( _objekt( 1, 20 ), _objekt( 2, '30' ))
+    b = _sett( _objekt( 2, 30.0 ), _objekt( 1, 20 ))
+    assert len( paritet.sammenlignEndringssett( a, b )) == 0
+
+def test_duplikate_nvdbid_rapporteres():
+    a = _sett( _objekt( 1, 20 ), _objekt( 2, 30 ))
+    b = _sett( _objekt( 1, 20 ), _objekt( 2, 30 ), _objekt( 2, 30 ))
+    avvik = paritet.sammenlignEndringssett( a, b )
+    assert avvik[['nvdbId', 'endring', 'før', 'etter']].values.tolist() == [ [ 2, 'duplikat', 1, 2 ] ]
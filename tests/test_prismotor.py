@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import aparmodell
+import prismotor
+
+def _pris( kroner, fra='2020-01-01T00:00:00', til='2099-01-01T00:00:00' ):
+    return { 'price' : kroner, 'activeFrom' : fra, 'activeTo' : til }
+
+def _felt( nokkel, operator=1, **egenskaper ):
+    rad = { 'operatorId' : operator, 'tollStationCode' : nokkel, 'tollStationKey' : nokkel,
+            'smallVehicle' : { 'priceNoRebate' : [ _pris( 20 ) ], 'priceRushHourNoRebate' : [ _pris( 30 ) ] } }
+    rad.update( egenskaper )
+    return rad
+
+def _motor( *rader ):
+    return prismotor.Prismotor( aparmodell.AparData.fraApar( list( rader )))
+
+def _passeringer( nokkel, tidspunkter, **kolonner ):
+    return pd.DataFrame( dict( { 'tollStationKey' : nokkel, 'tidspunkt' : pd.to_datetime( tidspunkter ), 'klasse' : 'smallVehicle' }, **kolonner ))
+
+# 2026-10-19 er en mandag
+
+def test_rushtid_ukedager():
+    motor = _motor( _felt( 'A', rushHour=[ { 'from' : '07:00', 'to' : '09:00', 'days' : [ 1, 2, 3, 4, 5 ] } ] ),
+                    _felt( 'S', rushHour=[ { 'from' : '07:00', 'to' : '09:00', 'days' : [ 7 ] } ] ))
+    tider = [ '2026-10-19 07:30', '2026-10-23 08:59', '2026-10-24 07:30', '2026-10-25 07:30', '2026-10-19 09:00', '2026-10-19 06:59' ]
+    assert motor.pris( _passeringer( 'A', tider ))['rushtid'].tolist() == [ True, True, False, False, False, False ]
+    # Dag 7 er søndag
+    assert motor.pris( _passeringer( 'S', tider ))['rushtid'].tolist() == [ False, False, False, True, False, False ]
+
+def test_rushtid_uten_dager_er_hverdager():
+    motor = _motor( _felt( 'A', rushHour='07:00-09:00,15:00-17:00' ))
+    tider = [ '2026-10-19 16:00', '2026-10-24 16:00', '2026-10-19 12:00' ]
+    resultat = motor.pris( _passeringer( 'A', tider ))
+    assert resultat['rushtid'].tolist() == [ True, False, False ]
+    assert resultat['belastet'].tolist() == [ 3000, 2000, 2000 ]
+
+def test_rushtid_over_midnatt():
+    motor = _motor( _felt( 'A', rushHour=[ { 'from' : '23:00', 'to' : '01:00', 'days' : [ 7 ] } ] ))
+    tider = [ '2026-10-25 23:30', '2026-10-26 00:30', '2026-10-26 01:00', '2026-10-25 00:30' ]
+    assert motor.pris( _passeringer( 'A', tider ))['rushtid'].tolist() == [ True, True, False, False ]
+
+def test_rushtid_fra_lik_til_er_tomt_vindu():
+    motor = _motor( _felt( 'A', rushHour=[ { 'from' : '08:00', 'to' : '08:00', 'days' : [ 1 ] } ] ))
+    tider = pd.date_range( '2026-10-19 00:00', periods=24 * 7, freq='h' )
+    assert not motor.pris( _passeringer( 'A', tider ))['rushtid'].any()
+
+def test_rushtidspris_0_kr_gir_normaltakst():
+    rad = _felt( 'A', rushHour='07:00-09:00' )
+    rad['smallVehicle']['priceRushHourNoRebate'] = [ _pris( 0 ) ]
+    resultat = _motor( rad ).pris( _passeringer( 'A', [ '2026-10-19 08:00', '2026-10-19 12:00' ] ))
+    assert resultat['rushtid'].tolist() == [ True, False ]
+    assert resultat['takst'].tolist() == [ 2000, 2000 ]
+
+def test_timesregel_betaler_dyreste_i_vinduet():
+    rush = [ { 'from' : '07:00', 'to' : '08:00', 'days' : [ 1 ] } ]
+    motor = _motor( _felt( 'A', timeRuleType='HOUR', timeRuleDuration=60, timeRuleGroup='g', rushHour=rush ),
+                    _felt( 'B', timeRuleType='HOUR', timeRuleDuration=60, timeRuleGroup='g' ))
+    passeringer = pd.concat( [ _passeringer( 'B', [ '2026-10-19 06:50' ], kjoretoy='x' ),
+                               _passeringer( 'A', [ '2026-10-19 07:10' ], kjoretoy='x' ),
+                               _passeringer( 'B', [ '2026-10-19 07:40' ], kjoretoy='x' ),
+                               # Nytt vindu, 60 minutter etter første passering
+                               _passeringer( 'B', [ '2026-10-19 07:50' ], kjoretoy='x' ) ], ignore_index=True )
+    resultat = motor.pris( passeringer )
+    assert resultat['takst'].tolist() == [ 2000, 3000, 2000, 2000 ]
+    # Innenfor vinduet betales til sammen den dyreste passeringen
+    assert resultat['belastet'][:3].sum() == 3000
+    assert resultat['belastet'].tolist() == [ 2000, 1000, 0, 2000 ]
+    assert resultat['regel'].tolist() == [ '', 'timesregel', 'timesregel', '' ]
+
+def test_timesregel_per_kjoretoy_og_gruppe():
+    motor = _motor( _felt( 'A', timeRuleType='HOUR', timeRuleGroup='g1' ), _felt( 'B', timeRuleType='HOUR', timeRuleGroup='g2' ))
+    passeringer = pd.concat( [ _passeringer( 'A', [ '2026-10-19 10:00', '2026-10-19 10:10' ], kjoretoy=[ 'x', 'y' ] ),
+                               _passeringer( 'B', [ '2026-10-19 10:20' ], kjoretoy='x' ) ], ignore_index=True )
+    assert motor.pris( passeringer )['belastet'].tolist() == [ 2000, 2000, 2000 ]
+
+def test_maanedstak_i_tidsrekkefolge():
+    tak = { 'priceNoRebate' : [ _pris( 2 ) ] }
+    motor = _motor( _felt( 'A', monthlyMaximumCharges=tak ))
+    # Passeringene kommer ikke i tidsrekkefølge, det er de siste i måneden som blir gratis
+    tider = [ '2026-10-30 12:00', '2026-10-02 12:00', '2026-10-15 12:00', '2026-11-01 12:00' ]
+    resultat = motor.pris( _passeringer( 'A', tider, kjoretoy='x' ))
+    assert resultat['belastet'].tolist() == [ 0, 2000, 2000, 2000 ]
+    assert resultat['regel'].tolist() == [ 'månedstak', '', '', '' ]
+
+def test_maanedstak_teller_ikke_gratis_passeringer():
+    tak = { 'priceNoRebate' : [ _pris( 2 ) ] }
+    motor = _motor( _felt( 'A', monthlyMaximumCharges=tak, timeRuleType='HOUR' ))
+    tider = [ '2026-10-19 10:00', '2026-10-19 10:30', '2026-10-20 10:00', '2026-10-21 10:00' ]
+    resultat = motor.pris( _passeringer( 'A', tider, kjoretoy='x' ))
+    assert resultat['regel'].tolist() == [ '', 'timesregel', '', 'månedstak' ]
+    assert resultat['belastet'].sum() == 4000
+
+def test_maanedstak_fra_passeringens_maaned():
+    tak = { 'priceNoRebate' : [ _pris( 1, til='2026-11-01T00:00:00' ), _pris( 2, fra='2026-11-01T00:00:00' ) ] }
+    motor = _motor( _felt( 'A', monthlyMaximumCharges=tak ))
+    tider = [ '2026-10-05 12:00', '2026-10-06 12:00', '2026-11-05 12:00', '2026-11-06 12:00', '2026-11-07 12:00' ]
+    resultat = motor.pris( _passeringer( 'A', tider, kjoretoy='x' ))
+    assert resultat['belastet'].tolist() == [ 2000, 0, 2000, 2000, 0 ]
+
+@pytest.mark.parametrize( 'tidspunkt, forventet', [
+    ( '2025-12-31T23:59:59', -1 ),
+    ( '2026-01-01T00:00:00', 1000 ),
+    ( '2026-06-30T23:59:59', 1000 ),
+    ( '2026-07-01T00:00:00', 1500 ),
+    ( '2026-12-31T23:59:59', 1500 ),
+    ( '2027-01-01T00:00:00', -1 ),
+] )
+def test_oppslag_ved_intervallgrenser( tidspunkt, forventet ):
+    priser = [ _pris( 10, '2026-01-01T00:00:00', '2026-07-01T00:00:00' ), _pris( 15, '2026-07-01T00:00:00', '2027-01-01T00:00:00' ) ]
+    motor = _motor( _felt( 'A', smallVehicle={ 'priceNoRebate' : priser } ), _felt( 'B' ))
+    felt = np.array( [ 0, -1 ], dtype=np.int32 )
+    klasse = np.array( [ 0, 0 ] )
+    t = np.array( [ tidspunkt, tidspunkt ], dtype='datetime64[s]' )
+    assert motor._oppslag( felt, klasse, prismotor.normalpris, t ).tolist() == [ forventet, -1 ]
+
+def test_ukjent_stasjon_og_manglende_takst():
+    motor = _motor( _felt( 'A' ))
+    resultat = motor.pris( pd.DataFrame( { 'tollStationKey' : [ 'A', 'X' ], 'tidspunkt' : pd.to_datetime( [ '2026-10-19 10:00' ] * 2 ),
+                                           'klasse' : [ 'largePetrol', 'smallVehicle' ] } ))
+    assert resultat['takst'].isna().tolist() == [ True, True ]
+    assert resultat['regel'].tolist() == [ 'mangler takst', 'mangler takst' ]
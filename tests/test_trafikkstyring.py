@@ -0,0 +1,31 @@
+import trafikkstyring
+
+
+def test_grense_tas_opp_igjen_etter_varig_tregere_server():
+    styrer = trafikkstyring.Trafikkstyrer( samtidige=8, minSamtidige=1, maksSamtidige=8, latensvindu=20 )
+    for _ in range( 20 ):
+        styrer._registrerSvartid( 0.1 )
+    assert styrer.grense == 8
+
+    for _ in range( 10 ):
+        styrer._registrerSvartid( 2.0 )
+    assert styrer.grense == styrer.minSamtidige
+
+    # Når de raske svarene er ute av vinduet er 2 sekunder den nye normalen
+    for _ in range( 200 ):
+        styrer._registrerSvartid( 2.0 )
+    assert styrer.grense == 8
+
+
+def test_grense_tas_opp_igjen_etter_kort_topp():
+    styrer = trafikkstyring.Trafikkstyrer( samtidige=8, minSamtidige=1, maksSamtidige=8 )
+    for _ in range( 20 ):
+        styrer._registrerSvartid( 0.1 )
+    for _ in range( 5 ):
+        styrer._registrerSvartid( 2.0 )
+    nedtrappet = styrer.grense
+    assert nedtrappet < 8
+
+    for _ in range( 200 ):
+        styrer._registrerSvartid( 0.1 )
+    assert styrer.grense == 8
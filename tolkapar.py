@@ -1,9 +1,11 @@
 import requests 
 import json
 import sys
+import os
 from datetime import datetime
 import ipdb 
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np 
 import pandas as pd
@@ -21,157 +23,94 @@ import STARTHER
 import nvdbapiv4 
 import skrivnvdb
 import nvdbgeotricks
-
-def lagStedfesting( row ): 
+import publiser
+import trafikkstyring
+import aparmodell
+import historikk
+import kvalitetsregler
+import fingeravtrykk
+import kandidatkobling
+import endringsrapport
+import hendelseslogg
+import sqlkobling
+import operatoroversikt
+import feltplassering
+import flertydighet
+
+def finnAparTakstmatrise( nvdbBomst, apardata, aparpriser ): 
     """
-    Avgjør om det er stedfesting på kj.felt 1 (med metrering) eller 2 (mot metrering) basert på bomstasjondata og vegnett fra NVDB
+    APAR-pris for alle kjøretøyklasser og pristyper for alle NVDB bomstasjoner, i én vektorisert operasjon 
 
-    Tar hensyn til om metreringen er snudd (kj.felt 1 == MOT, kj.felt 2 == MED) på stedet 
+    Som finnAparTakst2nvdbData i tolkapar_OLD.py brukes prisene til første APAR-felt som matcher operatør ID og bomstasjon ID
 
     ARGUMENTS
-        row: Dictionary eller pandas Series 
+        nvdbBomst: pandas dataframe med NVDB bomstasjoner 
 
-    KEYWORDS: 
-        N/A
-    
-    RETURNS 
-        tallet 0 (ingen stedfesting på kj.felt), 1 (kj.felt 1, evt 1,3,5,..) eller 2 
-    """
-    def byttom( tall:int) -> int:  
-        """
-        Bytter om på stedfesting hvis metrering er snudd: 
-            2 -> 1
-            1 -> 2 
-            0 -> 0 
-        """
-        if tall == 2: 
-            return 1
-        elif tall == 1: 
-            return 2
-        elif tall == 0: 
-            return 0
-        else: 
-            raise ValueError( "Input skal være heltall 0, 1 eller 2")
-
-    stedfest = 0 
-    # datatype float betyr at vi har verdien np.isnan
-    if row['Innkrevningsretning'] == 'Begge retninger' or isinstance( row['Innkrevningsretning'], float ): 
-        stedfest = 0 
-    elif row['Innkrevningsretning'] == 'Med metrering': 
-        stedfest = 1
-    elif row['Innkrevningsretning'] == 'Mot metrering': 
-        stedfest = 2
-    else: 
-        raise ValueError( f"Ugyldig dataverdi for innkrevingsretning {row['Innkrevningsretning']}")
-
-    if row['segmentretning'] == 'MOT': 
-        stedfest = byttom( stedfest )
+        apardata: pandas dataframe med apardata 
 
-    return stedfest 
+        aparpriser: aparmodell.Pristabell tolket fra de samme radene som apardata, i samme rekkefølge
 
-def hentFeltPunkt( stedfesting ): 
-    """
-    Henter kjørefelt for stedfesting som kommaseparert tekst 
+    RETURNS 
+        pandas dataframe med samme indeks som nvdbBomst og én kolonne per kjøretøyklasse og pristype 
+        (se aparmodell.matrisekolonne). Takstene er heltall øre (Int32), <NA> der vi ikke finner pris 
     """
-    pos, vid = stedfesting.split( '@' )
-    pos = float( pos )
-    
-    r = requests.get( 'https://nvdbapiles.atlas.vegvesen.no/vegnett/veglenkesekvenser/segmentert/' + \
-                    vid + '.json' )
-    feltoversikt = ''
-    if r.ok: 
-        mydf = pd.DataFrame( r.json())
-        mydf2 = mydf[ (mydf['startposisjon'] <= pos) & (mydf['sluttposisjon'] > pos) ]
-        assert len( mydf2 ) == 1, "Skal ha kun ett svar på dette filteret"
-        if isinstance( mydf2.iloc[0]['feltoversikt'] , list ): 
-            feltoversikt = ','.join( mydf2.iloc[0]['feltoversikt'] ) 
-    
-    return feltoversikt 
-
-def tellAparFelt( row, apardata ) -> int: 
+    ore, mangler = aparpriser.prismatrise()
+    kolonner = [ aparmodell.matrisekolonne( klasse, pristype ) for klasse in aparpriser.klasser for pristype in aparpriser.pristyper ]
+    ore = ore.reshape( len( ore ), -1 )
+    mangler = mangler.reshape( len( mangler ), -1 )
+    forste = pd.DataFrame( { kol : pd.arrays.IntegerArray( ore[:, jj], mangler[:, jj] ) for jj, kol in enumerate( kolonner ) } )
+    forste['operatorId']        = apardata['operatorId'].values
+    forste['tollStationCode']   = apardata['tollStationCode'].values
+    forste = forste.drop_duplicates( subset=['operatorId', 'tollStationCode'], keep='first' )
+    koblet = pd.merge( nvdbBomst[['Operatør_Id', 'Bomstasjon_Id']], forste, left_on=['Operatør_Id', 'Bomstasjon_Id'], 
+                      right_on=['operatorId', 'tollStationCode'], how='left' )
+
+    # Takstene vi sammenligner med NVDB kommer først og finnes alltid, øvrige kombinasjoner kun hvis noen stasjon har pris 
+    pakrevd = [ aparmodell.matrisekolonne( t['klasse'], t['pristype'] ) for t in aparmodell.nvdbtakster ]
+    kolonner = [ x for x in kolonner if x not in pakrevd and koblet[x].notnull().any() ]
+    return koblet.reindex( columns=pakrevd + kolonner ).set_axis( nvdbBomst.index ).astype( 'Int32' )
+
+def lagPrisstart( apardata, nvdbBomst, aparpriser ): 
     """
-    Teller hvor mange apar-oppføringer (dvs antall kjørefelt-oppføringer fra APAR) som matcher en NVDB bomstasjon
+    Når gjeldende APAR-pris startet (activeFrom) for takstfeltene i tabellene merged (nøkkel tollStationKey) og 
+    takstmatrise (nøkkel nvdbId, første APAR-felt per stasjon som i finnAparTakstmatrise). Brukes som gyldigFra 
+    for takstendringer i hendelsesloggen 
 
     ARGUMENTS
-        row : pandas series eller dictionary med en NVDB bomstasjon 
-
         apardata: pandas dataframe med apardata 
 
-    KEYWORDS: 
-        N/A
+        nvdbBomst: pandas dataframe med NVDB bomstasjoner 
 
-    RETURNS 
-        antallAparFelt: int 
+        aparpriser: aparmodell.Pristabell tolket fra de samme radene som apardata, i samme rekkefølge
 
+    RETURNS 
+        pandas dataframe med kolonnene tabell, nokkel (tekst, som i endringsrapport), felt og gyldigFra (datetime64), 
+        kun der det finnes gjeldende pris 
     """
-
-    treff = apardata[( apardata['operatorId'] == row['Operatør_Id']) & (apardata['tollStationCode'] == row['Bomstasjon_Id'])]
-    return len( treff )
-
-
-def vurderStedfest( row ) -> str: 
-    """
-    Integritetssjekk - sammenligner innkrevingsretning med stedfesting og retning på vegnett 
-    """
-    skalHaStedfest = lagStedfesting( row )
-    harStedfest = 0
-    felt = row['stedfesting_felt']
-    # hvis felt er float, ikke string så er det fordi felt = np.nan 
-    if isinstance( felt, float ) or row['stedfesting_felt'] == row['tilgjengeligeKjfelt'] or ( '1' in row['stedfesting_felt'] and '2' in row['stedfesting_felt'] ): 
-        harStedfest = 0
-    elif '1' in row['stedfesting_felt'] and '2' not in row['stedfesting_felt']: 
-        harStedfest = 1
-    elif '2' in row['stedfesting_felt'] and '1' not in row['stedfesting_felt']: 
-        harStedfest = 2
-    else: 
-        raise ValueError( 'vurderstedfest: Ugyldig datakombinasjon')
-
-    if skalHaStedfest == harStedfest: 
-        return 'OK'
-    elif skalHaStedfest > 0 and harStedfest == 0: 
-        return f"Innkr sier felt {skalHaStedfest}"
-    elif skalHaStedfest > 0 and harStedfest > 0: 
-        return f"Snudd stedfesting {harStedfest} ift metrering {skalHaStedfest}"
-    elif skalHaStedfest == 0 and harStedfest > 0: 
-        return f"Skal IKKE ha kj.felt stedfesting"
-    else: 
-        raise ValueError (f"Rar datakombinasjon: Skal ha stedfest={skalHaStedfest} har stedfest={harStedfest}")
-
-
-def finnTakst( row, takstType={ 'vehicle' : 'smallVehicle', 'priceType' : 'priceNoRebate' } ) -> float: 
-    """
-    Finner takst liten bil uten rabatt (hvis den finnes for dagens dato)
-    """
-    pris = np.nan 
-    if takstType['vehicle'] in row and isinstance( row[ takstType['vehicle'] ], dict) and takstType['priceType'] in row[ takstType['vehicle'] ]:
-        prisListe = row[ takstType['vehicle'] ][ takstType['priceType'] ] 
-        if len( prisListe ) > 0: 
-            prisListe = [ { 'price' :  x['price'], 'activeFrom' : datetime.fromisoformat( x['activeFrom'] ), 'activeTo' : datetime.fromisoformat( x['activeTo'] ) } for x in prisListe ]
-            now = datetime.now()
-            dennePrisen = [ x for x in prisListe if x['activeFrom'] <= now and x['activeTo'] > now]
-            assert len( dennePrisen) <= 1, f"Fant {len(dennePrisen)} ulike priser av type  {takstType} for tidspunkt {now}"
-            if len( dennePrisen ) == 1: 
-                pris = dennePrisen[0]['price']
-
-    return pris
-
-def finnAparTakst2nvdbData( nvdbrow, apardata, takstType={ 'vehicle' : 'smallVehicle', 'priceType' : 'priceNoRebate' } ) -> float: 
-    """
-    Bruker funksjonen finntakst for å finne APAR-pris som matcher NVDB bomstasjon 
-    """
-
-    pris = np.nan
-    aparmatch = apardata[ (nvdbrow['Operatør_Id'] == apardata['operatorId']) & (nvdbrow['Bomstasjon_Id'] == apardata['tollStationCode'])]
-    priser = set()
-    for junk, row in aparmatch.iterrows(): 
-        priser.add( finnTakst( aparmatch.iloc[0], takstType=takstType ))
-
-    if len( priser ) > 1: 
-        print( f"{nvdbrow['nvdbId']} {nvdbrow['Navn bomstasjon']} operator={nvdbrow['Operatør_Id']} key={nvdbrow['Bomstasjon_Id']} har {len(priser)} prisoppføringer i APAR ")
-    elif len( priser ) == 1: 
-        pris = list( priser)[0]
-
-    return pris
+    fra = aparpriser.startdatoer()
+    deler = []
+    for takst in aparmodell.nvdbtakster: 
+        if takst['klasse'] in aparpriser.klasser and takst['pristype'] in aparpriser.pristyper: 
+            deler.append( pd.DataFrame( { 'tabell' : 'merged', 'nokkel' : apardata['tollStationKey'].values, 'felt' : takst['apar'], 
+                'gyldigFra' : fra[ :, aparpriser.klasser.index( takst['klasse'] ), aparpriser.pristyper.index( takst['pristype'] ) ] } ))
+
+    forste = pd.DataFrame( { 'operatorId'      : apardata['operatorId'].values, 
+                             'tollStationCode' : apardata['tollStationCode'].values, 
+                             'feltnr'          : np.arange( len( apardata )) } )
+    forste = forste.drop_duplicates( subset=['operatorId', 'tollStationCode'], keep='first' )
+    koblet = pd.merge( nvdbBomst[['nvdbId', 'Operatør_Id', 'Bomstasjon_Id']], forste, left_on=['Operatør_Id', 'Bomstasjon_Id'], 
+                      right_on=['operatorId', 'tollStationCode'], how='inner' )
+    for kk, klasse in enumerate( aparpriser.klasser ): 
+        for pp, pristype in enumerate( aparpriser.pristyper ): 
+            deler.append( pd.DataFrame( { 'tabell' : 'takstmatrise', 'nokkel' : koblet['nvdbId'].values, 
+                                          'felt' : aparmodell.matrisekolonne( klasse, pristype ), 
+                                          'gyldigFra' : fra[ koblet['feltnr'].to_numpy(), kk, pp ] } ))
+
+    if not deler: 
+        return pd.DataFrame( columns=[ 'tabell', 'nokkel', 'felt', 'gyldigFra' ] )
+    prisstart = pd.concat( deler, ignore_index=True )
+    prisstart['nokkel'] = endringsrapport.nokkeltekst( prisstart, [ 'nokkel' ] )
+    return prisstart[ prisstart['gyldigFra'].notnull() ].reset_index( drop=True )
 
 def lagEndringssett( myDataFrame, outfile='bomstasjon_endringssett.json' ):
     """
@@ -180,33 +119,37 @@ def lagEndringssett( myDataFrame, outfile='bomstasjon_endringssett.json' ):
     Forutsetter at det kun finnes EN takstverdi per NVDB objekt. 
     """ 
 
-    takstmatch = {               'APAR takst liten bil' : { 'navn' : 'Takst liten bil', 'id' : 1820 }, 
-                            'APAR takst stor bensinbil' : { 'navn' : 'Takst stor bil',   'id' : 1819 }, 
-                        'APAR Rustid takst liten bil'   : { 'navn' :  'Rushtidstakst liten bil', 'id' : 9410 }, 
-                   'APAR Rustid takst stor bensinbil'   : { 'navn' : 'Rushtidstakst stor bil', 'id' : 9411} }
+    takstmatch = aparmodell.nvdbtakster
 
     egenskap_mal =  {  "typeId": -1, "verdi": [ ], "operasjon": "oppdater" }
     delvisOppdater = []
 
-    for nvdbId in myDataFrame['nvdbId'].unique(): 
-        subset = myDataFrame[ myDataFrame['nvdbId'] == nvdbId].iloc[0]
+    # Sammenligner APAR takster med nvdb takster for alle objekter på en gang (første rad per nvdbId)
+    forste = myDataFrame.drop_duplicates( subset='nvdbId', keep='first' )
+    # Kun APAR-takster over 0 kr skrives, se aparmodell.endringsavvik 
+    avvik, aparOre, aparMangler = aparmodell.endringsavvik( forste, takstmatch )
+    # Ingen rushtidstakst i APAR (mangler eller 0 kr) betyr at taksten ikke er tidsdifferensiert 
+    rushtid = [ x['apar'] for x in takstmatch ].index( 'APAR Rustid takst liten bil' )
+    harRushtid = ~aparMangler[:, rushtid] & ( aparOre[:, rushtid] > 0 )
+
+    for ii in range( len( forste )): 
+        subset = forste.iloc[ii]
         endrede_egenskaper = []
-        #   |=apar |=nvdb   
-        for myKey, myVal in takstmatch.items(): # Sammenligner APAR takster med nvdb takster 
-            if subset[myKey] > 0 and subset[myKey] != subset[myVal['navn']]: 
+        for jj, myVal in enumerate( takstmatch ): 
+            if avvik[ii, jj]: 
                 nyEgenskap = deepcopy ( egenskap_mal )
                 nyEgenskap['typeId'] = myVal['id']
-                nyEgenskap['verdi'] = [ str( round( subset[myKey], 2 )) ]
+                nyEgenskap['verdi'] = [ aparmodell.kronetekst( aparOre[ii, jj] ) ]
                 endrede_egenskaper.append( nyEgenskap )
 
         # Sjekker om vi har rushtidtakst - i så fall skal vi ha Tidsvariabel takst == Ja
         # Evt motsatt: Ingen rushtid => tidsvariabel takst == Nei
         nyEgenskap = deepcopy( egenskap_mal)
         nyEgenskap['typeId'] = 9409
-        if subset['APAR Rustid takst liten bil'] > 0 and subset['Tidsdifferensiert takst'] == 'Nei':
+        if harRushtid[ii] and subset['Tidsdifferensiert takst'] == 'Nei':
             nyEgenskap['verdi'] = [ 'Ja' ]
             endrede_egenskaper.append( nyEgenskap )
-        elif subset['APAR Rustid takst liten bil'] == 0 and subset['Tidsdifferensiert takst'] == 'Ja':
+        elif not harRushtid[ii] and subset['Tidsdifferensiert takst'] == 'Ja':
             nyEgenskap['verdi'] = [ 'Nei' ]
             endrede_egenskaper.append( nyEgenskap )
 
@@ -223,8 +166,10 @@ def lagEndringssett( myDataFrame, outfile='bomstasjon_endringssett.json' ):
     # if len( delvisOppdater ) > 0: 
     skrivemal =  skrivnvdb.endringssett_mal()
     skrivemal['delvisOppdater']['vegobjekter'] = delvisOppdater
-    with open( outfile, 'w') as f: 
-        json.dump( skrivemal, f, indent=4, ensure_ascii=False )       
+    if outfile: 
+        publiser.skrivJson( skrivemal, outfile )
+
+    return skrivemal 
 
 
 #    takstCol = [ 'Takst liten bil', 'Takst stor bil', 'Rushtidstakst liten bil', 'Rushtidstakst stor bil',         
@@ -233,79 +178,9 @@ def lagEndringssett( myDataFrame, outfile='bomstasjon_endringssett.json' ):
 
 
 
-if __name__ == '__main__':
-    t0 = datetime.now() 
-
-    mappe = './' 
-    mappe = '/var/www/html/apardata/' 
-    mappe = '/mnt/c/DATA/leveranser/apardata/' 
-
-    with open(  mappe +  'apardump.json') as f: 
-    # with open( 'takstendringMai2024/endret_bomstasjoner_sisteuker20240527.json') as f: 
-        apardump = json.load( f )
-    apardata = pd.DataFrame( apardump )
-
-    # Fjerner duplikater
-    apardata.drop_duplicates( subset='tollStationKey', inplace=True )
-
-    apardata['lat'] = apardata['positionY'].apply( lambda x : float(x) if x and len(x.strip()) > 3 else np.nan )
-    apardata['lon'] = apardata['positionX'].apply( lambda x : float(x) if x and len(x.strip()) > 3 else np.nan )
-    # apardata['APAR takst liten bil'] = apardata.apply( finnTakst, axis=1 )
-
-    # nvdbJson = nvdbapiv3.nvdbFagdata(45).to_records() 
-    # with open( 'nvdbdump.json', 'w') as f: 
-    #     json.dump( nvdbJson, f, indent=4, ensure_ascii=False )
-    nvdbAlle = pd.DataFrame( nvdbapiv4.nvdbFagdata(45, debug=True ).to_records( relasjoner=False ) )
-    nvdbAlle['stedfest'] = nvdbAlle['relativPosisjon'].astype(str) + '@' + nvdbAlle['veglenkesekvensid'].astype(str)
-    nvdbAlle['tilgjengeligeKjfelt'] = nvdbAlle['stedfest'].apply( hentFeltPunkt )
-
-    # nvdbAlle = pd.read_excel( 'nvdbBomst.xlsx' )
-
-    # with open( 'nvdbdump.json') as f:
-        # nvdbJson = json.load( f )
-    # nvdbBomst = pd.DataFrame( nvdbJson )
-    # nvdbAlle  = pd.DataFrame( nvdbJson )
-    
-    vegkartURL = 'https://vegkart.atlas.vegvesen.no/#valgt:'
-    nvdbAlle['vegkart lenke'] = vegkartURL + nvdbAlle['nvdbId'].astype( 'str') + ':45' 
-
-    nvdbBomst = nvdbAlle.copy()
-    nvdbBomst['stedfesting QA']                     = nvdbAlle.apply( vurderStedfest, axis=1 )
-    nvdbBomst[ 'Antall APAR felt']                  = nvdbAlle.apply( lambda row: tellAparFelt(row, apardata), axis=1)
-
-    nvdbBomst['APAR takst liten bil']               = nvdbBomst.apply( lambda row: finnAparTakst2nvdbData( row, apardata, takstType={'vehicle' : 'smallVehicle', 'priceType' : 'priceNoRebate' } ), axis=1 )
-    nvdbBomst['APAR Rustid takst liten bil']        = nvdbBomst.apply( lambda row: finnAparTakst2nvdbData( row, apardata, takstType={'vehicle' : 'smallVehicle', 'priceType' : 'priceRushHourNoRebate' } ), axis=1 )
-    nvdbBomst['APAR takst stor bensinbil']          = nvdbBomst.apply( lambda row: finnAparTakst2nvdbData( row, apardata, takstType={'vehicle' : 'largePetrol', 'priceType' : 'priceNoRebate' } ), axis=1 )
-    nvdbBomst['APAR Rustid takst stor bensinbil']   = nvdbBomst.apply( lambda row: finnAparTakst2nvdbData( row, apardata, takstType={'vehicle' : 'largePetrol', 'priceType' : 'priceRushHourNoRebate' } ), axis=1 )
-
-    # Hvilke NVDB-bomstasjoner mangler operatør ID og Bomstasjon ID? 
-    nvdb_uten_autopasskobling = nvdbBomst[ (nvdbBomst['Operatør_Id'].isnull() ) | (nvdbBomst['Bomstasjon_Id'].isnull() )]
-    print( f"{len( nvdb_uten_autopasskobling )} bomstasjoner uten Operatør ID eller Bomstasjon ID")
-    if len( nvdb_uten_autopasskobling[ ~nvdb_uten_autopasskobling['Operatør_Id'].isnull() ] ) > 0: 
-        print( f"ALARM - {len( nvdb_uten_autopasskobling[ ~nvdb_uten_autopasskobling['Operatør_Id'].isnull() ] )} bomstasjoner mangler Bomstasjon ID")
-    if len( nvdb_uten_autopasskobling[ ~nvdb_uten_autopasskobling['Bomstasjon_Id'].isnull() ] ) > 0: 
-        print( f"ALARM - {len( nvdb_uten_autopasskobling[ ~nvdb_uten_autopasskobling['Bomstasjon_Id'].isnull() ] )} bomstasjoner mangler Operatør ID")
-
-    nvdbBomst = nvdbBomst[ ~nvdbBomst['nvdbId'].isin( nvdb_uten_autopasskobling['nvdbId'].to_list() )]
-    nvdbBomst2 = nvdbBomst.copy()
-
-    # Finner de bomstasjonene der vi har mer enn 1 forekomst i NVDB på operatør ID + bomstasjon ID 
-    nvdb_duplikatId = nvdbBomst[  nvdbBomst.duplicated( subset=['Operatør_Id', 'Bomstasjon_Id'], keep=False ) ]
-    print( f"Flertydig NVDB-representasjon: {len(nvdb_uten_autopasskobling)} bomstasjoner på {len(nvdb_duplikatId['Operatør_Id'].unique())} operatører")
-
-    nvdbBomst = nvdbBomst[  ~nvdbBomst['nvdbId'].isin( nvdb_duplikatId['nvdbId'].to_list() ) ]
-
-    apardata.drop( columns='nvdbId', inplace=True  )
-    merged = pd.merge(  apardata, nvdbBomst, left_on=[ 'operatorId', 'tollStationCode' ], right_on=['Operatør_Id', 'Bomstasjon_Id'], how='inner'  )
-
-    geometrikontroll = merged[ ( ~merged['lat'].isnull()) | ( ~merged['lon'].isnull() )].copy()
-    geometrikontroll['nvdbgeom'] = geometrikontroll['geometri'].apply( wkt.loads )
-    geometrikontroll = gpd.GeoDataFrame( geometrikontroll, geometry=gpd.points_from_xy( geometrikontroll['lon'], geometrikontroll['lat'] ), crs=4326 )
-    geometrikontroll = geometrikontroll.to_crs( 5973 )
-
-    geometrikontroll['geomavstand_nvdb_autopass'] = geometrikontroll.apply( lambda row: row['nvdbgeom'].distance(row['geometry']), axis=1)
 
-    mycols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
+# Kolonneutvalg for rapportene 
+mycols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
        'tollStationName', 'projectNumber', 'projectName', 'link',
        'tollStationLane', 'tollStationDirection', 'smallVehicle',
        'smallDiesel', 'smallPetrol', 'smallChargableHybrid', 'smallElectric',
@@ -331,18 +206,16 @@ if __name__ == '__main__':
        'Vedlikeholdsansvarlig', 'Eier', 'Prosjektreferanse',
        'Tilleggsinformasjon', 'segmentretning', 'ProsjektInternObjekt_ID',
        'nvdbgeom', 'geometry', 'geomavstand_nvdb_autopass' ]
-    
 
-    geomcols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
+
+geomcols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
        'tollStationName', 'tollStationLane', 'tollStationDirection', 'nvdbId',
        'Innkrevningsretning', 'Navn bompengeanlegg (fra CS)',  'Navn bomstasjon',  'kommune',
        # 'APAR takst liten bil', 'Takst liten bil', 
         'vref', 'geomavstand_nvdb_autopass',  'Antall APAR felt', 'stedfesting QA', 'geometry']
 
-    # geometrikontroll[geomcols].to_file( mappe +  'aparkontroll.gpkg', layer='geometrikontroll_enkel_juni', driver='GPKG')
-
-    # Disse koblingene er vi skråsikre på
-    mergedcols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
+# Disse koblingene er vi skråsikre på
+mergedcols = [ 'operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
        'tollStationName', 'tollStationLane', 'tollStationDirection', 
        'APAR takst liten bil', 'Takst liten bil', 
         'APAR Rustid takst liten bil', 'Rushtidstakst liten bil', 
@@ -352,10 +225,325 @@ if __name__ == '__main__':
        'Innkrevningsretning',  'stedfesting_felt', 'tilgjengeligeKjfelt',  'stedfesting QA', 'Antall APAR felt', 
         'segmentretning',  'Navn bompengeanlegg (fra CS)',  'Navn bomstasjon',  'kommune',
         'vref', 'vegkart lenke' ]
+
+aparcols = ['operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
+       'tollStationName', 'projectNumber', 'projectName', 'link',
+       'tollStationLane', 'tollStationDirection', 'smallVehicle', # 'APAR takst liten bil',
+        'lat', 'lon']
+
+nvdbCol = [ 'nvdbId', 'vegkart lenke', 'Innkrevningsretning',
+       'Navn bompengeanlegg (fra CS)', 'Link til bomstasjon',
+        'Operatør_Id', 'Navn bomstasjon',
+       'Bomstasjon_Id',
+       # 'Bompengeanlegg_Id',
+        'kommune','vref', 'Vedlikeholdsansvarlig',
+       'Eier', 'Prosjektreferanse', 'Tilleggsinformasjon', 
+       'ProsjektInternObjekt_ID']
+
+stedfestingQAcol =  [  'nvdbId', 'Navn bompengeanlegg (fra CS)',  'Navn bomstasjon', 'Operatør_Id', 'Bomstasjon_Id',
+                     'APAR takst liten bil', 'Takst liten bil', 
+                     'APAR takst stor bensinbil', 'Takst stor bil', 
+                      'Innkrevningsretning',  'stedfesting_felt', 'tilgjengeligeKjfelt',  'stedfesting QA', 'Antall APAR felt', 
+                    'segmentretning',   'kommune',
+                    'vref', 'vegkart lenke' ]
+
+takstCol = [ 'Takst liten bil', 'Takst stor bil', 'Rushtidstakst liten bil', 'Rushtidstakst stor bil',         
+                'APAR takst liten bil', 'APAR takst stor bensinbil',  
+                'APAR Rustid takst liten bil', 'APAR Rustid takst stor bensinbil' ]
+
+betalingskolonne = [ 'smallVehicle',
+   'smallDiesel', 'smallPetrol', 'smallChargableHybrid', 'smallElectric',
+   'smallHydrogen', 'euro5', 'euro6', 'largeElectric', 'largeHydrogen',
+   'largeHybrid', 'largePetrol', 'monthlyMaximumCharges',
+   'priceDifferentiationTime', 'rushHour', 'timeRuleType',
+   'timeRuleDuration', 'timeRuleGroup', 'freeHandicap' ]
+
+nvdbCol2 = [ 'nvdbId', 'Navn bomstasjon',
+            # 'Tidsdifferensiert takst', 'Timesregel',
+             'Innkrevningsretning',
+            # 'Navn bompengeanlegg (fra CS)',  'Link til bomstasjon',
+            'Takst liten bil', 'APAR takst liten bil', #  'Operatør_Id', 'Bomstasjonstype', 
+            'Takst stor bil', 'APAR takst stor bensinbil',
+            # 'Bomstasjon_Id', 'Gratis gjennomkjøring ved HC-brikke', 'relasjoner',
+            # 'veglenkesekvensid', 'detaljnivå', 'typeVeg', 'kommune', 'fylke',
+            'vref', #  'veglenkeType', 'vegkategori', 'fase', 'vegnummer',
+            # 'relativPosisjon', 'adskilte_lop', 'trafikantgruppe', 
+            # 'geometri', 'stedfesting_retning',
+            'stedfesting_felt',  'sideposisjon', 'segmentretning',
+            # 'Rushtid morgen, til', 'Rushtidstakst liten bil',
+            # 'Rushtidstakst stor bil', 'Timesregel, passeringsgruppe',
+            # 'Timesregel, varighet', 'Etableringsår', 'Rushtid ettermiddag, fra',
+            # 'Rushtid ettermiddag, til', 'Rushtid morgen, fra', 'Vedtatt til år',
+            # 'Vedlikeholdsansvarlig', 'Eier', 'Prosjektreferanse',
+            # 'Tilleggsinformasjon',  'ProsjektInternObjekt_ID',
+            'stedfest', 'tilgjengeligeKjfelt', 'stedfesting QA', 
+            'Antall APAR felt', 
+            'vegkart lenke', 
+            'geometry']
+
+aparCol2 = ['NVDB navn', 'tollStationName', 'NVDB Id', 'tollStationLane', 'tollStationDirection',
+             'operatorId', 'tollStationKey', 'projectNumber',
+            'projectName', 'tollStationCode', 'geometry']
+
+# Tabellene fra sammenstill() som lagres som mellomresultat og slås sammen ved shard-kjøring 
+resultattabeller = [ 'merged', 'flertydig', 'flere', 'apar_utenkobling_medpris', 'apar_utenpris', 
+                    'nvdb_utenkobling', 'nvdbBomst', 'nvdbBomst2', 'takstavvik', 'aparRediger', 'sjekkTakster', 'kvalitetsfunn', 
+                    'takstmatrise', 'kandidater_avstand', 'kandidater_navn', 'flertydig_tildeling' ]
+
+# UNNTAKSLISTE #  Oddernesbrua KRS, som ikke her ferdig før ca Mai 2025 
+unntak = kvalitetsregler.unntakOddernesbrua
+
+
+def lesApardump( filnavn ): 
+    """
+    Leser APAR-dump (json) og lager dataframe med lat/lon-kolonner, duplikater på tollStationKey er fjernet 
+
+    ARGUMENTS
+        filnavn: Filnavn for APAR-dump, evt liste med APAR-data 
+
+    KEYWORDS: 
+        N/A
+
+    RETURNS 
+        apardata: pandas dataframe 
+    """
+    if isinstance( filnavn, list ): 
+        apardump = filnavn 
+    else: 
+        with open( filnavn ) as f: 
+            apardump = json.load( f )
+    apardata = pd.DataFrame( apardump )
+
+    # Fjerner duplikater, første forekomst beholdes. Duplikater med ulikt innhold skrives ut, der har vi valgt én versjon 
+    duplikat = apardata.duplicated( subset='tollStationKey', keep='first' )
+    if duplikat.any(): 
+        alle = apardata[ apardata['tollStationKey'].isin( apardata.loc[ duplikat, 'tollStationKey' ] ) ]
+        ulike = alle.astype( str ).drop_duplicates()
+        ulike = sorted( ulike.loc[ ulike.duplicated( subset='tollStationKey' ), 'tollStationKey' ].unique() )
+        print( f"lesApardump: Fjerner {int( duplikat.sum() )} duplikater på tollStationKey, {len( ulike )} med ulikt innhold: {ulike}")
+    apardata = apardata[ ~duplikat ].copy()
+
+    apardata['lat'] = apardata['positionY'].apply( lambda x : float(x) if x and len(x.strip()) > 3 else np.nan )
+    apardata['lon'] = apardata['positionX'].apply( lambda x : float(x) if x and len(x.strip()) > 3 else np.nan )
+    return apardata 
+
+def hentNvdbBomstasjoner( ): 
+    """
+    Henter alle bomstasjoner (objekttype 45) fra NVDB, uten oppslag på kjørefelt 
+
+    RETURNS 
+        nvdbAlle: pandas dataframe 
+    """
+    # Paginert nedlasting i nvdbapiv4, teller som ett langvarig kall i trafikkstyringen 
+    nvdbAlle = pd.DataFrame( trafikkstyring.nvdb.utfor( lambda : nvdbapiv4.nvdbFagdata(45, debug=True ).to_records( relasjoner=False ), maalSvartid=False ))
+    nvdbAlle['stedfest'] = nvdbAlle['relativPosisjon'].astype(str) + '@' + nvdbAlle['veglenkesekvensid'].astype(str)
+
+    vegkartURL = 'https://vegkart.atlas.vegvesen.no/#valgt:'
+    nvdbAlle['vegkart lenke'] = vegkartURL + nvdbAlle['nvdbId'].astype( 'str') + ':45' 
+    return nvdbAlle 
+
+# Maksimal alder (sekunder) for kjørefelt-oppslag i stasjonscachen, se leggTilKjfelt 
+kjfeltMaksAlder = 7 * 24 * 3600 
+
+def leggTilKjfelt( nvdbAlle, cache=None ): 
+    """
+    Slår opp tilgjengelige kjørefelt på vegnettet for hver NVDB bomstasjon (kolonne tilgjengeligeKjfelt)
+
+    Vegnettet hentes i bolker via den felles vegnettcachen i feltplassering.py, innenfor grensene til 
+    trafikkstyring.nvdb. Med cache slås kun de bomstasjonene opp der nvdbId, versjon, stedfesting eller 
+    segmentretning er endret siden forrige kjøring. Vegnettet kan endres uten at bomstasjonen endres, derfor slås 
+    alle bomstasjoner opp på nytt når oppslaget er eldre enn kjfeltMaksAlder
+
+    KEYWORDS: 
+        cache: None (default) eller fingeravtrykk.Stasjonscache
+    """
+    vegnett = feltplassering.standardcache()
+    if cache is None: 
+        nvdbAlle['tilgjengeligeKjfelt'] = vegnett.feltoversikt( nvdbAlle['veglenkesekvensid'], nvdbAlle['relativPosisjon'] )
+    else: 
+        avtrykk = fingeravtrykk.stasjonsavtrykk( nvdbAlle, {}, kolonner=('nvdbId', 'versjon', 'stedfest', 'segmentretning') )
+        nvdbAlle['tilgjengeligeKjfelt'] = cache.beregn( 'tilgjengeligeKjfelt', nvdbAlle['nvdbId'].tolist(), avtrykk, 
+                                    lambda radnr : vegnett.feltoversikt( nvdbAlle['veglenkesekvensid'].iloc[radnr], nvdbAlle['relativPosisjon'].iloc[radnr] ), 
+                                    maksAlder=kjfeltMaksAlder )
+        cache.rydd( 'tilgjengeligeKjfelt', nvdbAlle['nvdbId'].tolist() )
+    print( f"Kjørefelt-oppslag: {vegnett.status()} {trafikkstyring.nvdb.status()}")
+    return nvdbAlle 
+
+def filtrerOperatorer( apardata, nvdbAlle, operatorer, utenOperator=False ): 
+    """
+    Plukker ut de APAR- og NVDB-dataene som hører til en gruppe operatører (en shard)
+
+    Alle tabeller i analysen partisjonerer rent på operatør ID, slik at hver shard kan analyseres for seg 
+
+    ARGUMENTS
+        apardata: pandas dataframe med APAR-data 
+
+        nvdbAlle: pandas dataframe med NVDB bomstasjoner 
+
+        operatorer: Liste med operatør ID 
+
+    KEYWORDS: 
+        utenOperator: False (default) | True. Ta med NVDB bomstasjoner som mangler Operatør_Id
+
+    RETURNS 
+        tuple (apardata, nvdbAlle) med de radene som hører til denne shard'en 
+    """
+    operatorer = [ int( x ) for x in operatorer ]
+    apardata = apardata[ apardata['operatorId'].astype( int ).isin( operatorer ) ].copy()
+    utvalg = nvdbAlle['Operatør_Id'].isin( operatorer )
+    if utenOperator: 
+        utvalg = utvalg | nvdbAlle['Operatør_Id'].isnull()
+    nvdbAlle = nvdbAlle[ utvalg ].copy()
+    return ( apardata, nvdbAlle )
+
+def lagRedigeringsrader( temp2, nvdbAlle, trans ): 
+    """
+    Lager rader (med geometri) til redigering av APAR-data for alle felt i én APAR-bomstasjon 
+
+    ARGUMENTS
+        temp2: pandas dataframe med APAR-feltene for én kombinasjon av operatorId og tollStationCode 
+
+        nvdbAlle: pandas dataframe med NVDB bomstasjoner 
+
+        trans: pyproj Transformer fra EPSG:4326 til EPSG:25833
+
+    RETURNS 
+        liste med dictionaries, én per felt 
+    """
+    rader = []
+    nvdb = nvdbAlle[ (nvdbAlle['Operatør_Id'] == temp2.iloc[0]['operatorId'] ) & (nvdbAlle['Bomstasjon_Id'] == temp2.iloc[0]['tollStationCode'] ) ]
+
+    if len( nvdb ) == 0: 
+        nvdbId = -999
+        navn = f"Finner ikke NVDB bomstasjon med operatør={temp2.iloc[0]['operatorId']} og ID={temp2.iloc[0]['tollStationCode']}"
+    elif len( nvdb ) == 1: 
+        nvdbId = nvdb.iloc[0]['nvdbId']
+        navn   = nvdb.iloc[0]['Navn bomstasjon']
+    else: 
+        nvdbId = -1
+        tmpNavneliste = nvdb.loc[ ~nvdb['Navn bomstasjon'].isnull() ]['Navn bomstasjon'].to_list()
+
+        navn  = f"Flere NVDB bomstasjoner: ','.join(tmpNavneliste)"
+        # nvdb.loc[ ~nvdb['Navn bomstasjon'].isnull() ]['Navn bomstasjon'].to_list()
+
+    print( f"Analyserer NVDB bomstasjoner: {navn}")
+
+    count = 0
+    for junk, row in temp2.iterrows():
+        count += 1
+        data = { 'NVDB navn'            : navn, 
+                 'NVDB Id'              : nvdbId,
+                  'tollStationLane'     : row['tollStationLane'], 
+                 'tollStationDirection' : row['tollStationDirection'], 
+                 'tollStationName'      : row['tollStationName'], 
+                 'operatorId'           : row['operatorId'],
+                 'tollStationKey'       : row['tollStationKey'], 
+                 'projectNumber'        : row['projectNumber'], 
+                 'projectName'          : row['projectName'], 
+                 'tollStationCode'      : row['tollStationCode'], 
+                }
+        # Henter geometri - enten fra APAR eller fra NVDB
+        if row['positionX'] and len( row['positionX'].strip() ) > 3:
+            X, Y  = trans.transform( float( row['positionY']), float( row['positionX'] ) )
+            Y += count
+            data['geometry'] = Point( X, Y)
+        else:
+            print(f"Mangler geometri for APAR-oppføring {data['tollStationName']} {data['tollStationKey']} ")
+            if len(  nvdb ) > 0: 
+                data['geometry'] = wkt.loads( nvdb.iloc[0]['geometri'] ) 
+            else: 
+                print( f"Konstruerer fiktiv geometri for APAR-opføring  {data['tollStationName']} {data['tollStationKey']}")
+                data['geometry'] = wkt.loads( 'POINT( 144400 7189000)' ) 
+
+        rader.append( data )
+
+    return rader 
+
+def sammenstill( apardata, nvdbAlle, cache=None, sql=None ): 
+    """
+    Sammenstiller APAR og NVDB bomstasjoner: kobling, flertydig kobling, manglende kobling, takstavvik og geometri 
+
+    ARGUMENTS
+        apardata: pandas dataframe fra lesApardump 
+
+        nvdbAlle: pandas dataframe fra hentNvdbBomstasjoner, med kolonne tilgjengeligeKjfelt 
+
+    KEYWORDS: 
+        cache: None (default) eller fingeravtrykk.Stasjonscache. Med cache beregnes geometri for redigering 
+               kun for de stasjonene der NVDB- eller APAR-data er endret
+
+        sql: None (default) eller sqlkobling.Sqlmotor. Med sql gjøres koblingen, anti-joins for manglende 
+             kobling som SQL i DuckDB / sqlite, med samme resultat. Takstavvik kommer fra kvalitetsreglene 
+
+    RETURNS 
+        dictionary med de tabellene som inngår i rapportene, se resultattabeller 
+    """
+    apardata = apardata.copy()
+    if cache is None: 
+        cache = fingeravtrykk.Stasjonscache()
+
+    # Fingeravtrykk per APAR-stasjon, brukes for geometri for redigering 
+    aparsummer = fingeravtrykk.aparAvtrykk( apardata )
+
+    nvdbBomst = nvdbAlle.copy()
+
+    # APAR-prisene tolkes én gang, til sammenhengende arrays 
+    aparpriser = aparmodell.AparData.fraApar( apardata.to_dict( 'records' ) ).priser
+    # Gjeldende pris for alle kjøretøyklasser og pristyper finnes i én operasjon, takstene vi sammenligner med NVDB er et utvalg 
+    takstmatrise = finnAparTakstmatrise( nvdbBomst, apardata, aparpriser )
+    # Øre-kolonnene (Int32, <NA> = ingen takst) brukes til sammenligning og endringssett, kronekolonnene i rapportene 
+    for takst in aparmodell.nvdbtakster: 
+        kolonne = takstmatrise[ takst['ore'] ].array
+        nvdbBomst[ takst['ore'] ] = kolonne
+        nvdbBomst[ takst['apar'] ] = aparmodell.tilKroner( kolonne.to_numpy( dtype=np.int32, na_value=0 ), kolonne.isna() )
+    takstmatrise = pd.concat( [ nvdbBomst[['nvdbId', 'Navn bomstasjon', 'Operatør_Id', 'Bomstasjon_Id']], takstmatrise ], axis=1 )
+    takstmatrise = takstmatrise[ takstmatrise['Operatør_Id'].notnull() ]
+
+    # Alle kvalitetskontroller i én omgang, se kvalitetsregler.standardregler. Rapportkolonner og tabeller under utledes fra funnene 
+    kontroll = kvalitetsregler.lagKontrolltabell( nvdbBomst, apardata )
+    kvalitetsfunn = pd.concat( [ kvalitetsregler.evaluer( kontroll ), 
+                                 kvalitetsregler.evaluer( kvalitetsregler.lagAparkontroll( apardata, aparpriser ), kvalitetsregler.aparregler ) ], 
+                               ignore_index=True )
+    kvalitetsregler.oppsummer( kvalitetsfunn )
+    nvdbBomst['stedfesting QA']   = kvalitetsregler.stedfestingQA( nvdbBomst['nvdbId'], kvalitetsfunn )
+    nvdbBomst['Antall APAR felt'] = nvdbBomst['nvdbId'].map( kontroll.groupby( 'nvdbId' )['Antall APAR felt'].first() ).to_numpy()
+
+    # Hvilke NVDB-bomstasjoner mangler operatør ID og Bomstasjon ID? 
+    nvdb_uten_autopasskobling = nvdbBomst[ kvalitetsregler.harFunn( nvdbBomst, kvalitetsfunn, [ 'mangler Bomstasjon_Id', 'mangler Operatør_Id', 'uten autopasskobling' ] ) ]
+    print( f"{len( nvdb_uten_autopasskobling )} bomstasjoner uten Operatør ID eller Bomstasjon ID")
+
+    nvdbBomst = nvdbBomst[ ~nvdbBomst['nvdbId'].isin( nvdb_uten_autopasskobling['nvdbId'].to_list() )]
+    nvdbBomst2 = nvdbBomst.copy()
+
+    # Bomstasjonene der vi har mer enn 1 forekomst i NVDB på operatør ID + bomstasjon ID 
+    nvdb_duplikatId = nvdbBomst[ kvalitetsregler.harFunn( nvdbBomst, kvalitetsfunn, 'flertydig NVDB' ) ]
+    print( f"Flertydig NVDB-representasjon: {len(nvdb_uten_autopasskobling)} bomstasjoner på {len(nvdb_duplikatId['Operatør_Id'].unique())} operatører")
+
+    nvdbBomst = nvdbBomst[  ~nvdbBomst['nvdbId'].isin( nvdb_duplikatId['nvdbId'].to_list() ) ]
+
+    apardata.drop( columns='nvdbId', inplace=True  )
+    if sql is not None: 
+        koblinger = sqlkobling.kobling( sql, apardata, nvdbBomst, nvdb_duplikatId, nvdbAlle )
+        merged = koblinger['merged']
+    else: 
+        merged = sqlkobling.koblePandas( apardata, nvdbBomst )
+
+    geometrikontroll = merged[ ( ~merged['lat'].isnull()) | ( ~merged['lon'].isnull() )].copy()
+    geometrikontroll['nvdbgeom'] = geometrikontroll['geometri'].apply( wkt.loads )
+    geometrikontroll = gpd.GeoDataFrame( geometrikontroll, geometry=gpd.points_from_xy( geometrikontroll['lon'], geometrikontroll['lat'] ), crs=4326 )
+    geometrikontroll = geometrikontroll.to_crs( 5973 )
+
+    geometrikontroll['geomavstand_nvdb_autopass'] = geometrikontroll.apply( lambda row: row['nvdbgeom'].distance(row['geometry']), axis=1)
+
+    # geometrikontroll[geomcols].to_file( mappe +  'aparkontroll.gpkg', layer='geometrikontroll_enkel_juni', driver='GPKG')
+
     # nvdbgeotricks.skrivexcel( mappe + 'enkelNVDBkobling.xlsx',  merged[ mergedcols] )
 
     # Mer avansert flertydig kobling 
-    flertydig = pd.merge(  apardata, nvdb_duplikatId, left_on=[ 'operatorId', 'tollStationCode' ], right_on=['Operatør_Id', 'Bomstasjon_Id'], how='inner'  )
+    if sql is not None: 
+        flertydig = koblinger['flertydig']
+    else: 
+        flertydig = sqlkobling.koblePandas( apardata, nvdb_duplikatId )
     flertydig['geometry'] = flertydig['geometri'].apply( wkt.loads )
     flertydig = gpd.GeoDataFrame( flertydig, geometry='geometry', crs=5973 )
     # flertydig[ mergedcols + ['geometry'] ].to_file( mappe + 'aparkontroll.gpkg', layer='flertydigkobling', driver='GPKG')
@@ -374,14 +562,11 @@ if __name__ == '__main__':
     # nvdbgeotricks.skrivexcel( mappe + 'flertydigkobling.xlsx', flere )
 
     # Er det noen APAR-data som ikke er koblet mot NVDB? 
-    apar_koblede = list( merged['tollStationKey'].unique() ) + list( flertydig['tollStationKey'].unique() )
-
-    apar_uten_kobling = apardata[ ~apardata['tollStationKey'].isin( apar_koblede )]
-    aparcols = ['operatorId', 'operatorName', 'tollStationKey', 'tollStationCode',
-       'tollStationName', 'projectNumber', 'projectName', 'link',
-       'tollStationLane', 'tollStationDirection', 'smallVehicle', # 'APAR takst liten bil',
-        'lat', 'lon']
-    
+    if sql is not None: 
+        apar_uten_kobling = koblinger['apar_uten_kobling']
+    else: 
+        apar_koblede = list( merged['tollStationKey'].unique() ) + list( flertydig['tollStationKey'].unique() )
+        apar_uten_kobling = apardata[ ~apardata['tollStationKey'].isin( apar_koblede )]
 
     # Av disse APAR-stasjonene som mangler NVDB-kobling, hvem mangler aktiv prisinformasjon? 
     apar_utenpris = apar_uten_kobling[ apar_uten_kobling['smallVehicle'].isnull() ]
@@ -390,162 +575,266 @@ if __name__ == '__main__':
     apar_utenkobling_medpris = apar_uten_kobling[ ~apar_uten_kobling['smallVehicle'].isnull() ]
 
     # Hvilke NVDB-bomstasjoner mangler kobling til APAR? 
-    nvdb_koblede = list( merged['nvdbId'].unique() ) + list( flertydig['nvdbId'].unique() )    
-    nvdb_utenkobling = nvdbAlle[ ~nvdbAlle['nvdbId'].isin( nvdb_koblede )]
-    nvdbCol = [ 'nvdbId', 'vegkart lenke', 'Innkrevningsretning',
-       'Navn bompengeanlegg (fra CS)', 'Link til bomstasjon',
-        'Operatør_Id', 'Navn bomstasjon',
-       'Bomstasjon_Id',
-       # 'Bompengeanlegg_Id',
-        'kommune','vref', 'Vedlikeholdsansvarlig',
-       'Eier', 'Prosjektreferanse', 'Tilleggsinformasjon', 
-       'ProsjektInternObjekt_ID']
-    
-    stedfestingQAcol =  [  'nvdbId', 'Navn bompengeanlegg (fra CS)',  'Navn bomstasjon', 'Operatør_Id', 'Bomstasjon_Id',
-                         'APAR takst liten bil', 'Takst liten bil', 
-                         'APAR takst stor bensinbil', 'Takst stor bil', 
-                          'Innkrevningsretning',  'stedfesting_felt', 'tilgjengeligeKjfelt',  'stedfesting QA', 'Antall APAR felt', 
-                        'segmentretning',   'kommune',
-                        'vref', 'vegkart lenke' ]
-    
-
-    takstCol = [ 'Takst liten bil', 'Takst stor bil', 'Rushtidstakst liten bil', 'Rushtidstakst stor bil',         
-                    'APAR takst liten bil', 'APAR takst stor bensinbil',  
-                    'APAR Rustid takst liten bil', 'APAR Rustid takst stor bensinbil' ]
-    for myCol in takstCol: 
-        merged[myCol] = merged[myCol].fillna( 0 )
-
-    takstavvik = merged[ (merged['Takst liten bil']         != merged['APAR takst liten bil']             ) | \
-                         (merged['Rushtidstakst liten bil'] != merged['APAR Rustid takst liten bil']      ) | \
-                         (merged['Takst stor bil']          != merged['APAR takst stor bensinbil']        ) | \
-                         (merged['Rushtidstakst stor bil']  != merged['APAR Rustid takst stor bensinbil'] )   ]
+    if sql is not None: 
+        nvdb_utenkobling = koblinger['nvdb_utenkobling']
+    else: 
+        nvdb_koblede = list( merged['nvdbId'].unique() ) + list( flertydig['nvdbId'].unique() )    
+        nvdb_utenkobling = nvdbAlle[ ~nvdbAlle['nvdbId'].isin( nvdb_koblede )]
 
-    takstavvik_geom = takstavvik.copy()
-    takstavvik_geom['geometry'] = takstavvik_geom['geometri'].apply( wkt.loads )
-    takstavvik_geom = gpd.GeoDataFrame( takstavvik_geom, geometry='geometry' )
-    takstavvik_geom[ mergedcols + ['geometry'] ].to_file(  mappe + 'takstavvik.gpkg')
+    # Forslag til kobling for APAR-felt uten kobling: nærmeste NVDB bomstasjoner 
+    kandidater_avstand = kandidatkobling.naermesteKandidater( apar_uten_kobling, nvdbAlle, k=3, maksAvstand=500 )
+    print( f"Kandidatkobling: {kandidater_avstand['tollStationKey'].nunique()} av {len(apar_uten_kobling)} ukoblede APAR-felt har NVDB bomstasjon innen 500m")
 
+    # APAR-felt uten posisjon kan kun kobles på navn 
+    aparUtenPosisjon = apar_uten_kobling[ apar_uten_kobling['lat'].isnull() | apar_uten_kobling['lon'].isnull() ]
+    kandidater_navn = kandidatkobling.navnekandidater( aparUtenPosisjon, nvdbAlle, antall=3 )
+    print( f"Kandidatkobling: {kandidater_navn[['operatorId', 'tollStationCode']].drop_duplicates().shape[0]} ukoblede APAR-bomstasjoner uten posisjon har navnekandidater i NVDB")
 
-    nvdbgeotricks.skrivexcel( mappe +  'koblingNvdbAutopass.xlsx', 
-                          [ merged[mergedcols], flere, apar_utenkobling_medpris[aparcols], nvdb_utenkobling[nvdbCol],  apar_utenpris[aparcols], nvdbBomst[stedfestingQAcol], takstavvik[mergedcols] ], 
-        sheet_nameListe = ['Enkel kobling', 'Flertydig kobling', 'APAR uten kobling', 'Nvdb uten kobling', 'inaktive Apar', 'NVDB stedfesting QA', 'Takst avvik'] )
-    
+    # Takstavvik per APAR-felt fra regelen takstavvik 
+    takstavvik = merged[ kvalitetsregler.harFunn( merged, kvalitetsfunn, 'takstavvik', nokler=( 'nvdbId', 'tollStationKey' )) ]
 
-    betalingskolonne = [ 'smallVehicle',
-       'smallDiesel', 'smallPetrol', 'smallChargableHybrid', 'smallElectric',
-       'smallHydrogen', 'euro5', 'euro6', 'largeElectric', 'largeHydrogen',
-       'largeHybrid', 'largePetrol', 'monthlyMaximumCharges',
-       'priceDifferentiationTime', 'rushHour', 'timeRuleType',
-       'timeRuleDuration', 'timeRuleGroup', 'freeHandicap' ]
-    
     # Ny versjon av geometrikontroll: 
     trans = Transformer.from_crs( "EPSG:4326", "EPSG:25833" )
     temp = apardata[ ~apardata['positionX'].isnull()].copy()
     temp = temp[  temp['positionX'] != '' ].copy()
     temp['_myKey'] = temp['operatorId'].astype(str) + '_' + temp['tollStationCode'].astype(str)
-    myList = []
-    for key in list( temp['_myKey'].unique()):
-        temp2 = temp[ temp['_myKey'] == key]
-        nvdb = nvdbAlle[ (nvdbAlle['Operatør_Id'] == temp2.iloc[0]['operatorId'] ) & (nvdbAlle['Bomstasjon_Id'] == temp2.iloc[0]['tollStationCode'] ) ]
-
-        if len( nvdb ) == 0: 
-            nvdbId = -999
-            navn = f"Finner ikke NVDB bomstasjon med operatør={temp2.iloc[0]['operatorId']} og ID={temp2.iloc[0]['tollStationCode']}"
-        elif len( nvdb ) == 1: 
-            nvdbId = nvdb.iloc[0]['nvdbId']
-            navn   = nvdb.iloc[0]['Navn bomstasjon']
-        else: 
-            nvdbId = -1
-            tmpNavneliste = nvdb.loc[ ~nvdb['Navn bomstasjon'].isnull() ]['Navn bomstasjon'].to_list()
-
-            navn  = f"Flere NVDB bomstasjoner: ','.join(tmpNavneliste)"
-            # nvdb.loc[ ~nvdb['Navn bomstasjon'].isnull() ]['Navn bomstasjon'].to_list()
-
-        print( f"Analyserer NVDB bomstasjoner: {navn}")
-
-        count = 0
-        for junk, row in temp2.iterrows():
-            count += 1
-            data = { 'NVDB navn'            : navn, 
-                     'NVDB Id'              : nvdbId,
-                      'tollStationLane'     : row['tollStationLane'], 
-                     'tollStationDirection' : row['tollStationDirection'], 
-                     'tollStationName'      : row['tollStationName'], 
-                     'operatorId'           : row['operatorId'],
-                     'tollStationKey'       : row['tollStationKey'], 
-                     'projectNumber'        : row['projectNumber'], 
-                     'projectName'          : row['projectName'], 
-                     'tollStationCode'      : row['tollStationCode'], 
-                    }
-            # Henter geometri - enten fra APAR eller fra NVDB
-            if row['positionX'] and len( row['positionX'].strip() ) > 3:
-                X, Y  = trans.transform( float( row['positionY']), float( row['positionX'] ) )
-                Y += count
-                data['geometry'] = Point( X, Y)
-            else:
-                print(f"Mangler geometri for APAR-oppføring {data['tollStationName']} {data['tollStationKey']} ")
-                if len(  nvdb ) > 0: 
-                    data['geometry'] = wkt.loads( nvdb.iloc[0]['geometri'] ) 
-                else: 
-                    print( f"Konstruerer fiktiv geometri for APAR-opføring  {data['tollStationName']} {data['tollStationKey']}")
-                    data['geometry'] = wkt.loads( 'POINT( 144400 7189000)' ) 
-
-            myList.append( data )
-
-
-    aparRediger = pd.DataFrame( myList )
+    grupper = dict( list( temp.groupby( '_myKey', sort=False ) ))
+    nokler = list( grupper.keys() )
+    nvdbsummer = fingeravtrykk.nvdbAvtrykk( nvdbAlle )
+    redigeringsavtrykk = [ fingeravtrykk.sjekksum( aparsummer.get( stasjon, '' ), nvdbsummer.get( stasjon, '' ))
+                            for stasjon in [ ( grupper[k].iloc[0]['operatorId'], grupper[k].iloc[0]['tollStationCode'] ) for k in nokler ] ]
+    radlister = cache.beregn( 'aparRediger', nokler, redigeringsavtrykk, 
+                              lambda radnr : [ lagRedigeringsrader( grupper[ nokler[ii] ], nvdbAlle, trans ) for ii in radnr ] )
+    cache.rydd( 'aparRediger', nokler )
+    myList = [ data for rader in radlister for data in rader ]
+
+    aparRediger = pd.DataFrame( myList, columns=aparCol2 )
     aparRediger = gpd.GeoDataFrame( aparRediger, geometry='geometry', crs=25833 )
 
     nvdbBomst2['geometry'] = nvdbBomst2['geometri'].apply( lambda x : Point ( wkb.loads( wkb.dumps( wkt.loads( x ), output_dimension=2  ))))
     nvdbBomst2 = gpd.GeoDataFrame( nvdbBomst2, geometry='geometry', crs=25833 )
 
-    nvdbCol2 = [ 'nvdbId', 'Navn bomstasjon',
-                # 'Tidsdifferensiert takst', 'Timesregel',
-                 'Innkrevningsretning',
-                # 'Navn bompengeanlegg (fra CS)',  'Link til bomstasjon',
-                'Takst liten bil', 'APAR takst liten bil', #  'Operatør_Id', 'Bomstasjonstype', 
-                'Takst stor bil', 'APAR takst stor bensinbil',
-                # 'Bomstasjon_Id', 'Gratis gjennomkjøring ved HC-brikke', 'relasjoner',
-                # 'veglenkesekvensid', 'detaljnivå', 'typeVeg', 'kommune', 'fylke',
-                'vref', #  'veglenkeType', 'vegkategori', 'fase', 'vegnummer',
-                # 'relativPosisjon', 'adskilte_lop', 'trafikantgruppe', 
-                # 'geometri', 'stedfesting_retning',
-                'stedfesting_felt',  'sideposisjon', 'segmentretning',
-                # 'Rushtid morgen, til', 'Rushtidstakst liten bil',
-                # 'Rushtidstakst stor bil', 'Timesregel, passeringsgruppe',
-                # 'Timesregel, varighet', 'Etableringsår', 'Rushtid ettermiddag, fra',
-                # 'Rushtid ettermiddag, til', 'Rushtid morgen, fra', 'Vedtatt til år',
-                # 'Vedlikeholdsansvarlig', 'Eier', 'Prosjektreferanse',
-                # 'Tilleggsinformasjon',  'ProsjektInternObjekt_ID',
-                'stedfest', 'tilgjengeligeKjfelt', 'stedfesting QA', 
-                'Antall APAR felt', 
-                'vegkart lenke', 
-                'geometry']
-    
-    aparCol2 = ['NVDB navn', 'tollStationName', 'NVDB Id', 'tollStationLane', 'tollStationDirection',
-                 'operatorId', 'tollStationKey', 'projectNumber',
-                'projectName', 'tollStationCode', 'geometry']
-    
-    nvdbBomst2[ nvdbCol2 ].to_file( mappe + 'nyApardump.gpkg', layer='nvdb bomstasjon', driver='GPKG')
-    aparRediger[ aparCol2].to_file( mappe + 'nyApardump.gpkg', layer='apar bomstasjon felt', driver='GPKG')
-
-    # for flertydige stasjoner - sjekker at vi har entydige TAKSTER. Dvs at alle NVDB ID har samme apartakst. 
-    # Utnytter .duplicated-funksjonalitet, som skal gi samme svar for nvdbId alene og nvdbID med apartakst-kolonnene 
-    testCol = ['nvdbId',  'APAR takst liten bil', 'APAR takst stor bensinbil', 'APAR Rustid takst liten bil', 'APAR Rustid takst stor bensinbil' ]
-    if len(  flertydig[flertydig.duplicated( subset=testCol)] ) == len(  flertydig[flertydig.duplicated( subset='nvdbId')] ): 
-        # GODKJENT
-        sjekkTakster = pd.concat( [ flertydig[flertydig.duplicated( subset=testCol)], merged], ignore_index=True ) 
-
-    else: 
-        sjekkTakster = merged 
-        print( f"Feil for nvdb-duplikater! Har variasjon i APAR-takster for en og samme nvdbId")
+    # For flertydige stasjoner tildeles APAR-feltene til NVDB-objekt der det er entydig, se flertydighet.py. 
+    # Takstene tas med i endringssettet for de NVDB-objektene der vi har entydige APAR-takster 
+    felttakster = pd.DataFrame( { 'tollStationKey' : apardata['tollStationKey'].to_numpy() } )
+    for takst in aparmodell.nvdbtakster: 
+        ore, mangler = aparpriser.aktiveOre( takst['klasse'], takst['pristype'] )
+        felttakster[ takst['apar'] ] = aparmodell.tilKroner( ore, mangler )
+        felttakster[ takst['ore'] ] = aparmodell.orekolonne( ore, mangler )
+    flertydig_tildeling = flertydighet.losFlertydige( flertydig )['tildeling']
+    sjekkTakster = pd.concat( [ flertydighet.takstrader( flertydig, flertydig_tildeling, felttakster ), merged ], ignore_index=True )
 
-    # UNNTAKSLISTE #  Oddernesbrua KRS, som ikke her ferdig før ca Mai 2025 
-    unntak = [1022267972, 1022273618]
     sjekkTakster = sjekkTakster[ ~sjekkTakster['nvdbId'].isin( unntak )]
     print( f"UNNTAK - fjern cirka mai 2025: Hopper over takstinformasjon for Oppdernesbrua KRS NDB ID {unntak}")
+
+    return { 'merged'                   : merged, 
+             'geometrikontroll'         : geometrikontroll, 
+             'flertydig'                : flertydig, 
+             'flere'                    : flere, 
+             'apar_utenkobling_medpris' : apar_utenkobling_medpris, 
+             'apar_utenpris'            : apar_utenpris, 
+             'nvdb_utenkobling'         : nvdb_utenkobling, 
+             'nvdbBomst'                : nvdbBomst, 
+             'nvdbBomst2'               : nvdbBomst2, 
+             'takstavvik'               : takstavvik, 
+             'aparRediger'              : aparRediger, 
+             'sjekkTakster'             : sjekkTakster, 
+             'kvalitetsfunn'            : kvalitetsfunn, 
+             'takstmatrise'             : takstmatrise, 
+             'kandidater_avstand'       : kandidater_avstand, 
+             'kandidater_navn'          : kandidater_navn, 
+             'flertydig_tildeling'      : flertydig_tildeling, 
+             'prisstart'                : lagPrisstart( apardata, nvdbBomst2, aparpriser ) }
+
+def _skrivTakstavvik( resultat, mappe ): 
+    takstavvik_geom = resultat['takstavvik'].copy()
+    takstavvik_geom['geometry'] = takstavvik_geom['geometri'].apply( wkt.loads )
+    takstavvik_geom = gpd.GeoDataFrame( takstavvik_geom, geometry='geometry' )
+    with publiser.atomisk( mappe + 'takstavvik.gpkg' ) as tmpfil: 
+        takstavvik_geom[ mergedcols + ['geometry'] ].to_file( tmpfil )
+
+def _skrivExcel( resultat, mappe ): 
+    with publiser.atomisk( mappe +  'koblingNvdbAutopass.xlsx' ) as tmpfil: 
+        nvdbgeotricks.skrivexcel( tmpfil, 
+                          [ resultat['merged'][mergedcols], resultat['flere'], resultat['apar_utenkobling_medpris'][aparcols], 
+                           resultat['nvdb_utenkobling'][nvdbCol],  resultat['apar_utenpris'][aparcols], 
+                           resultat['nvdbBomst'][stedfestingQAcol], resultat['takstavvik'][mergedcols], resultat['kvalitetsfunn'], 
+                           resultat['takstmatrise'], resultat['kandidater_avstand'], 
+                           resultat['kandidater_navn'], resultat['flertydig_tildeling'] ], 
+            sheet_nameListe = ['Enkel kobling', 'Flertydig kobling', 'APAR uten kobling', 'Nvdb uten kobling', 'inaktive Apar', 'NVDB stedfesting QA', 'Takst avvik', 'QA funn', 
+                               'APAR takstmatrise (øre)', 'Kandidater nærmeste', 'Kandidater navn', 'Flertydig tildeling'] )
+
+def _skrivNyApardump( resultat, mappe ): 
+    # Begge lagene skrives til samme midlertidige fil før den publiseres 
+    with publiser.atomisk( mappe + 'nyApardump.gpkg' ) as tmpfil: 
+        resultat['nvdbBomst2'][ nvdbCol2 ].to_file( tmpfil, layer='nvdb bomstasjon', driver='GPKG')
+        resultat['aparRediger'][ aparCol2].to_file( tmpfil, layer='apar bomstasjon felt', driver='GPKG')
+
+def skrivRapporter( resultat, mappe, bakgrunn=None ): 
+    """
+    Skriver takstavvik.gpkg, koblingNvdbAutopass.xlsx og nyApardump.gpkg basert på resultatet fra sammenstill
+
+    ARGUMENTS
+        resultat: dictionary med tabeller fra sammenstill 
+
+        mappe: Mappe som rapportene skrives til 
+
+    KEYWORDS: 
+        bakgrunn: None (default) eller concurrent.futures.Executor. Med bakgrunn skrives hver fil i egen 
+                  tråd, og funksjonen returnerer med en gang. Tabellene i resultat skal ikke endres før skrivingen er ferdig
+
+    RETURNS 
+        Liste med Future-objekter for skrivejobbene (tom liste uten bakgrunn)
+    """
+    skrivere = [ _skrivTakstavvik, _skrivExcel, _skrivNyApardump ]
+    if bakgrunn is None: 
+        for skriver in skrivere: 
+            skriver( resultat, mappe )
+        return []
+
+    return [ bakgrunn.submit( skriver, resultat, mappe ) for skriver in skrivere ]
+
+def lagreMedHendelser( resultat, endringer, forrige, mappe ): 
+    """
+    Legger endringene siden forrige kjøring til i hendelsesloggen, og lagrer deretter tabellene. Rekkefølgen er fast: 
+    Feiler hendelsesloggen lagres ikke tabellene, og neste kjøring finner de samme endringene på nytt. Feiler 
+    lagringen av tabellene, kjenner hendelsesloggen igjen endringene fra samme utgangspunkt (sjekksum av forrige 
+    tabeller) og legger dem ikke til to ganger 
+
+    ARGUMENTS
+        resultat: dictionary med tabeller fra sammenstill 
+
+        endringer: pandas dataframe fra endringsrapport.sammenlignKjoringer 
+
+        forrige: dictionary med tabellene fra forrige kjøring, se endringsrapport.lesForrige 
+
+        mappe: Mappa med resultatfilene, hendelsesloggen ligger i undermappa hendelser/ og tabellene i tabeller/ 
+    """
+    # Første kjøring har ingenting å sammenligne med 
+    if forrige: 
+        hendelseslogg.Hendelseslogg( mappe + 'hendelser/' ).leggTilEndringer( endringer, prisstart=resultat.get( 'prisstart' ), 
+                                                                          kjoring=endringsrapport.sjekksumForrige( mappe + 'tabeller/' ))
+    lagreTabeller( resultat, mappe + 'tabeller/' )
+
+def lagreTabeller( resultat, mappe ): 
+    """
+    Lagrer tabellene fra sammenstill som mellomresultat (pickle), en fil per tabell i mappe 
+    """
+    os.makedirs( mappe, exist_ok=True )
+    for navn in resultattabeller: 
+        resultat[navn].to_pickle( os.path.join( mappe, navn + '.pkl' ) )
+
+def lesTabeller( mappe ): 
+    """
+    Leser tabeller lagret med lagreTabeller 
+    """
+    return { navn : pd.read_pickle( os.path.join( mappe, navn + '.pkl' ) ) for navn in resultattabeller }
+
+
+def kjorOverlappet( mappe, cache=None, sql=None ): 
+    """
+    Hele analysen med overlappende I/O og beregning: 
+
+      - NVDB-nedlasting og kjørefelt-oppslag starter i egen tråd mens APAR-dumpen leses 
+      - NVDB-historikk oppdateres i bakgrunnen mens APAR og NVDB sammenstilles 
+      - Rapporter, tabeller og stasjonscache skrives i bakgrunnen mens endringssettet lages 
+
+    Tidsbruken nærmer seg dermed det lengste steget, i stedet for summen av alle 
+
+    ARGUMENTS
+        mappe: Mappe med apardump.json, og som resultatene skrives til 
+
+    KEYWORDS: 
+        cache: None (default) eller fingeravtrykk.Stasjonscache
+
+        sql: None (default) eller sqlkobling.Sqlmotor, se sammenstill 
+
+    RETURNS 
+        dictionary med tabeller fra sammenstill 
+    """
+    tider = {}
+    def tidtaker( navn, funksjon, *args, **kwargs ): 
+        t0 = datetime.now()
+        svar = funksjon( *args, **kwargs )
+        tider[navn] = datetime.now() - t0 
+        return svar 
+
+    with ThreadPoolExecutor( max_workers=6, thread_name_prefix='tolkapar' ) as bakgrunn: 
+        nvdbJobb = bakgrunn.submit( tidtaker, 'NVDB og kjørefelt', lambda : leggTilKjfelt( hentNvdbBomstasjoner(), cache=cache ))
+        forrigeJobb = bakgrunn.submit( endringsrapport.lesForrige, mappe + 'tabeller/' )
+        apardata = tidtaker( 'APAR', lesApardump, mappe + 'apardump.json' )
+        nvdbAlle = nvdbJobb.result()
+
+        historikkJobb = bakgrunn.submit( tidtaker, 'historikk', historikk.Historikk( mappe + 'historikk/' ).leggTilNvdb, nvdbAlle.copy() )
+        resultat = tidtaker( 'sammenstilling', sammenstill, apardata, nvdbAlle, cache=cache, sql=sql )
+
+        # Endringer sammenlignes mot tabellene fra forrige kjøring før de overskrives 
+        forrige = forrigeJobb.result()
+        endringer = tidtaker( 'endringsrapport', endringsrapport.sammenlignKjoringer, forrige, resultat )
+        skrivejobber = skrivRapporter( resultat, mappe, bakgrunn=bakgrunn )
+        skrivejobber.append( bakgrunn.submit( endringsrapport.skrivRapport, endringer, mappe ))
+        # Hendelser først, deretter tabellene (for bomstasjonstjeneste.py og andre som vil slippe å lese Excel-fila) 
+        skrivejobber.append( bakgrunn.submit( lagreMedHendelser, resultat, endringer, forrige, mappe ))
+        skrivejobber.append( bakgrunn.submit( lambda : operatoroversikt.Operatoroversikt( mappe ).oppdater( operatoroversikt.stasjonsbidrag( resultat ))))
+        if cache is not None: 
+            cache.oppsummer()
+            skrivejobber.append( bakgrunn.submit( cache.skriv ))
+
+        tidtaker( 'endringssett', lagEndringssett, resultat['sjekkTakster'], outfile=mappe+'bomstasjon_endringssett.json' )
+
+        # Venter på bakgrunnsjobbene, evt feil kastes videre herfra 
+        t0 = datetime.now()
+        for jobb in skrivejobber: 
+            jobb.result()
+        tider['venter på skriving'] = datetime.now() - t0 
+        print( f"Historikk: {historikkJobb.result()} NVDB bomstasjoner er nye, endret eller fjernet")
+
+    for navn, tid in tider.items(): 
+        print( f"Tidsbruk {navn}: {tid}")
+    return resultat 
+
+
+if __name__ == '__main__':
+    t0 = datetime.now() 
+
+    mappe = './' 
+    mappe = '/var/www/html/apardata/' 
+    mappe = '/mnt/c/DATA/leveranser/apardata/' 
+
+    # Resultater per bomstasjon gjenbrukes fra forrige kjøring der inndataene er uendret 
+    cache = fingeravtrykk.Stasjonscache( mappe + 'stasjonscache.pkl' )
+    # Kobling og anti-joins som SQL (DuckDB hvis installert, ellers sqlite), se sqlkobling.py 
+    sql = sqlkobling.Sqlmotor() if '--sql' in sys.argv else None
+
+    if '--overlapp' in sys.argv: 
+        kjorOverlappet( mappe, cache=cache, sql=sql )
+        print( f"Tidsbruk: {datetime.now()-t0}")
+        sys.exit( 0 )
+
+    apardata = lesApardump( mappe +  'apardump.json' )
+    # apardata = lesApardump( 'takstendringMai2024/endret_bomstasjoner_sisteuker20240527.json' )
+
+    # nvdbJson = nvdbapiv3.nvdbFagdata(45).to_records() 
+    # with open( 'nvdbdump.json', 'w') as f: 
+    #     json.dump( nvdbJson, f, indent=4, ensure_ascii=False )
+    nvdbAlle = leggTilKjfelt( hentNvdbBomstasjoner(), cache=cache )
+    print( f"Historikk: {historikk.Historikk( mappe + 'historikk/' ).leggTilNvdb( nvdbAlle )} NVDB bomstasjoner er nye, endret eller fjernet")
+
+    # nvdbAlle = pd.read_excel( 'nvdbBomst.xlsx' )
+
+    resultat = sammenstill( apardata, nvdbAlle, cache=cache, sql=sql )
+    cache.oppsummer()
+    cache.skriv()
+    skrivRapporter( resultat, mappe )
+    # Hva er endret siden forrige kjøring? Må sammenlignes før tabellene overskrives 
+    forrige = endringsrapport.lesForrige( mappe + 'tabeller/' )
+    endringer = endringsrapport.sammenlignKjoringer( forrige, resultat )
+    endringsrapport.skrivRapport( endringer, mappe )
+    # Endrede takster og kvalitetsfunn blir hendelser for de som abonnerer, deretter lagres tabellene 
+    lagreMedHendelser( resultat, endringer, forrige, mappe )
+    # Summer per operatør for dashboard, skrives bare når noen stasjoner er endret 
+    operatoroversikt.Operatoroversikt( mappe ).oppdater( operatoroversikt.stasjonsbidrag( resultat ))
     
     # Sammenligner takster til sist
-
-    lagEndringssett( sjekkTakster, outfile=mappe+'bomstasjon_endringssett.json' )
-    print( f"Tidsbruk: {datetime.now()-t0}")
\ No newline at end of file
+    lagEndringssett( resultat['sjekkTakster'], outfile=mappe+'bomstasjon_endringssett.json' )
+    print( f"Tidsbruk: {datetime.now()-t0}")
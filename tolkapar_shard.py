@@ -0,0 +1,242 @@
+"""
+Shard-kjøring av tolkapar: Analyserer hver operatørgruppe for seg og slår sammen resultatene til slutt
+
+Alle steg i analysen (APAR-kobling, NVDB-oppslag, takstsammenligning og endringssett) partisjonerer
+rent på operatør ID. Hver shard kan derfor kjøres i egen prosess eller på egen maskin, og skriver sine
+mellomresultat til mappe/shard_<navn>/. Sammenslåingen leser disse og lager de samme rapportene og det
+samme endringssettet som en vanlig kjøring av tolkapar.py
+
+Bruk:
+    python tolkapar_shard.py plan  <antall shards>                   # Skriver shardplan.json
+    python tolkapar_shard.py kjor  <shardnavn> [--tving]             # Analyserer en shard
+    python tolkapar_shard.py slasammen                               # Lager rapporter, hendelser og endringssett
+
+En shard kjøres bare på nytt hvis inndataene (APAR-rader, NVDB-versjoner og kjørefelt), hvilke APAR-prisintervaller som
+gjelder nå, tabellene i tolkapar.resultattabeller eller koden er endret, med mindre --tving. Når en shard hoppes
+over lages endringssettet på nytt fra lagrede tabeller, slik at startdato blir dagens dato
+"""
+import json
+import os
+import sys
+import hashlib
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import tolkapar
+import publiser
+import endringsrapport
+import operatoroversikt
+import historikk
+import fingeravtrykk
+import aparmodell
+import kvalitetsregler
+import kandidatkobling
+import flertydighet
+import feltplassering
+
+# Modulene som bestemmer innholdet i tabellene fra en shard. Endret kode gir nytt fingeravtrykk
+analysemoduler = [ tolkapar, aparmodell, kvalitetsregler, kandidatkobling, flertydighet, feltplassering, fingeravtrykk ]
+
+def delOperatorer( operatorer, antall ):
+    """
+    Fordeler operatør ID på et gitt antall shards
+
+    ARGUMENTS
+        operatorer: Liste med operatør ID
+
+        antall: Antall shards
+
+    RETURNS
+        dictionary { 'shard_0' : [ operatørId, ...], 'shard_1' : [...], ... }
+    """
+    operatorer = sorted( set( int( x ) for x in operatorer ) )
+    plan = { f"shard_{ii}" : [] for ii in range( antall ) }
+    for ii, operator in enumerate( operatorer ):
+        plan[ f"shard_{ii % antall}" ].append( operator )
+    return plan
+
+def lagShardplan( nvdbAlle, antall, mappe ):
+    """
+    Lager shardplan ut fra de operatørene som finnes i NVDB og skriver den til mappe/shardplan.json
+
+    Første shard tar også med NVDB bomstasjoner som mangler Operatør_Id
+    """
+    operatorer = nvdbAlle[ ~nvdbAlle['Operatør_Id'].isnull() ]['Operatør_Id'].unique()
+    plan = delOperatorer( operatorer, antall )
+    with open( os.path.join( mappe, 'shardplan.json' ), 'w' ) as f:
+        json.dump( plan, f, indent=4 )
+    return plan
+
+def lesShardplan( mappe ):
+    with open( os.path.join( mappe, 'shardplan.json' ) ) as f:
+        return json.load( f )
+
+def kodeversjon() -> str:
+    """
+    Sjekksum av kildekoden til analysemodulene og listen med resultattabeller
+    """
+    h = hashlib.sha256()
+    for modul in analysemoduler:
+        with open( modul.__file__, 'rb' ) as f:
+            h.update( f.read() )
+    h.update( json.dumps( tolkapar.resultattabeller ).encode( 'utf-8' ))
+    return h.hexdigest()
+
+def aktivePrisintervaller( apardata, tidspunkt=None ) -> str:
+    """
+    Sjekksum av hvilke APAR-prisintervaller som gjelder på tidspunktet. Endres når en ny prisperiode starter
+    eller en gammel slutter, selv om APAR-radene er de samme
+    """
+    priser = aparmodell.AparData.fraApar( apardata.to_dict( 'records' )).priser
+    t = np.datetime64( tidspunkt or datetime.now(), 's' )
+    return hashlib.sha256( np.packbits( ( priser.fra <= t ) & ( priser.til > t )).tobytes() ).hexdigest()
+
+def shardFingeravtrykk( apardata, nvdbAlle, tidspunkt=None ) -> str:
+    """
+    Sjekksum for inndataene til en shard: APAR-radene, nvdbId + versjon + kjørefelt for NVDB-objektene,
+    gjeldende prisintervaller og kodeversjon. nvdbAlle må ha kjørefelt fra tolkapar.leggTilKjfelt
+    """
+    h = hashlib.sha256()
+    aparTekst = apardata.sort_values( 'tollStationKey' ).drop( columns=['lat', 'lon'] ).to_json( orient='records', force_ascii=False )
+    h.update( aparTekst.encode( 'utf-8' ))
+    nvdbVersjon = nvdbAlle[['nvdbId', 'versjon', 'stedfest', 'tilgjengeligeKjfelt']].sort_values( 'nvdbId' ).to_json( orient='values' )
+    h.update( nvdbVersjon.encode( 'utf-8' ))
+    h.update( aktivePrisintervaller( apardata, tidspunkt ).encode( 'utf-8' ))
+    h.update( kodeversjon().encode( 'utf-8' ))
+    return h.hexdigest()
+
+def kjorShard( shardnavn, apardata, nvdbAlle, mappe, plan, tving=False ):
+    """
+    Analyserer en shard og lagrer tabeller og delvis endringssett i mappe/<shardnavn>/
+
+    ARGUMENTS
+        shardnavn: Navn på shard i shardplanen
+
+        apardata: pandas dataframe med alle APAR-data (fra tolkapar.lesApardump)
+
+        nvdbAlle: pandas dataframe med alle NVDB bomstasjoner, uten kjørefelt-oppslag
+
+        mappe: Mappe for shardplan og mellomresultat
+
+        plan: Shardplan fra lagShardplan / lesShardplan
+
+    KEYWORDS:
+        tving: False (default) | True. Kjør shard selv om inndataene er uendret
+
+    RETURNS
+        True hvis shard ble analysert, False hvis den ble hoppet over
+    """
+    shardmappe = os.path.join( mappe, shardnavn )
+    utenOperator = shardnavn == sorted( plan.keys() )[0]
+    apar, nvdb = tolkapar.filtrerOperatorer( apardata, nvdbAlle, plan[shardnavn], utenOperator=utenOperator )
+
+    # Kjørefeltene slås opp (fra cache, som fornyes etter tolkapar.kjfeltMaksAlder) før fingeravtrykket
+    # beregnes, slik at endrede kjørefelt gir ny analyse
+    cache = fingeravtrykk.Stasjonscache( os.path.join( shardmappe, 'stasjonscache.pkl' ))
+    nvdb = tolkapar.leggTilKjfelt( nvdb, cache=cache )
+    avtrykk = shardFingeravtrykk( apar, nvdb )
+    avtrykkfil = os.path.join( shardmappe, 'fingeravtrykk.txt' )
+    if not tving and os.path.isfile( avtrykkfil ):
+        with open( avtrykkfil ) as f:
+            if f.read().strip() == avtrykk:
+                print( f"{shardnavn}: Uendrede inndata, hopper over analysen")
+                tolkapar.lagEndringssett( pd.read_pickle( os.path.join( shardmappe, 'sjekkTakster.pkl' )),
+                                          outfile=os.path.join( shardmappe, 'bomstasjon_endringssett.json' ))
+                cache.skriv()
+                return False
+
+    print( f"{shardnavn}: Analyserer {len(apar)} APAR-felt og {len(nvdb)} NVDB bomstasjoner")
+    resultat = tolkapar.sammenstill( apar, nvdb, cache=cache )
+    tolkapar.lagreTabeller( resultat, shardmappe )
+    resultat['prisstart'].to_pickle( os.path.join( shardmappe, 'prisstart.pkl' ))
+    cache.skriv()
+    tolkapar.lagEndringssett( resultat['sjekkTakster'], outfile=os.path.join( shardmappe, 'bomstasjon_endringssett.json' ))
+
+    # Fingeravtrykk skrives til slutt, slik at en avbrutt kjøring blir kjørt på nytt
+    with open( avtrykkfil, 'w' ) as f:
+        f.write( avtrykk )
+    return True
+
+def slaSammen( mappe, plan, utmappe=None, nvdbAlle=None ):
+    """
+    Slår sammen mellomresultatene fra alle shards, skriver rapporter og ett samlet endringssett. Som i
+    tolkapar.kjorOverlappet sammenlignes resultatet med tabellene fra forrige kjøring, og endringene legges
+    i endringsrapport og hendelseslogg før tabellene overskrives. Operatøroversikten oppdateres til slutt
+
+    ARGUMENTS
+        mappe: Mappe med shardplan og mellomresultat
+
+        plan: Shardplan
+
+    KEYWORDS:
+        utmappe: None (default) eller mappe for rapporter og endringssett. Default er mappe
+
+        nvdbAlle: None (default) eller pandas dataframe med alle NVDB bomstasjoner. Oppdaterer NVDB-historikken
+                  i utmappe/historikk/
+
+    RETURNS
+        dictionary med sammenslåtte tabeller
+    """
+    if not utmappe:
+        utmappe = mappe
+
+    deler = [ tolkapar.lesTabeller( os.path.join( mappe, shardnavn )) for shardnavn in sorted( plan.keys() ) ]
+    resultat = { navn : pd.concat( [ x[navn] for x in deler ], ignore_index=True ) for navn in tolkapar.resultattabeller }
+    prisstart = [ pd.read_pickle( os.path.join( mappe, shardnavn, 'prisstart.pkl' )) for shardnavn in sorted( plan.keys() )
+                    if os.path.isfile( os.path.join( mappe, shardnavn, 'prisstart.pkl' )) ]
+    if prisstart:
+        resultat['prisstart'] = pd.concat( prisstart, ignore_index=True )
+
+    # Endringer sammenlignes mot tabellene fra forrige kjøring før de overskrives
+    forrige = endringsrapport.lesForrige( utmappe + 'tabeller/' )
+    endringer = endringsrapport.sammenlignKjoringer( forrige, resultat )
+
+    # Rapporter, hendelser og tabeller skrives i bakgrunnen mens endringssettene slås sammen
+    with ThreadPoolExecutor( max_workers=4 ) as bakgrunn:
+        skrivejobber = tolkapar.skrivRapporter( resultat, utmappe, bakgrunn=bakgrunn )
+        skrivejobber.append( bakgrunn.submit( endringsrapport.skrivRapport, endringer, utmappe ))
+        skrivejobber.append( bakgrunn.submit( tolkapar.lagreMedHendelser, resultat, endringer, forrige, utmappe ))
+        skrivejobber.append( bakgrunn.submit( lambda : operatoroversikt.Operatoroversikt( utmappe ).oppdater( operatoroversikt.stasjonsbidrag( resultat ))))
+        if nvdbAlle is not None:
+            skrivejobber.append( bakgrunn.submit( historikk.Historikk( utmappe + 'historikk/' ).leggTilNvdb, nvdbAlle.copy() ))
+
+        endringssett = None
+        for shardnavn in sorted( plan.keys() ):
+            with open( os.path.join( mappe, shardnavn, 'bomstasjon_endringssett.json' )) as f:
+                delsett = json.load( f )
+            if endringssett is None:
+                endringssett = delsett
+            else:
+                endringssett['delvisOppdater']['vegobjekter'].extend( delsett['delvisOppdater']['vegobjekter'] )
+
+        publiser.skrivJson( endringssett, utmappe + 'bomstasjon_endringssett.json' )
+        for jobb in skrivejobber:
+            jobb.result()
+
+    return resultat
+
+if __name__ == '__main__':
+    t0 = datetime.now()
+    mappe = '/mnt/c/DATA/leveranser/apardata/'
+
+    if len( sys.argv ) < 2 or sys.argv[1] not in [ 'plan', 'kjor', 'slasammen' ]:
+        print( __doc__ )
+        sys.exit( 1 )
+
+    if sys.argv[1] == 'plan':
+        plan = lagShardplan( tolkapar.hentNvdbBomstasjoner(), int( sys.argv[2] ), mappe )
+        print( f"Shardplan: { {k : len(v) for k, v in plan.items() } }")
+
+    elif sys.argv[1] == 'kjor':
+        plan = lesShardplan( mappe )
+        apardata = tolkapar.lesApardump( mappe + 'apardump.json' )
+        nvdbAlle = tolkapar.hentNvdbBomstasjoner()
+        kjorShard( sys.argv[2], apardata, nvdbAlle, mappe, plan, tving='--tving' in sys.argv )
+
+    elif sys.argv[1] == 'slasammen':
+        slaSammen( mappe, lesShardplan( mappe ), nvdbAlle=tolkapar.hentNvdbBomstasjoner() )
+
+    print( f"Tidsbruk: {datetime.now()-t0}")
@@ -0,0 +1,232 @@
+"""
+Trafikkstyring for kall mot NVDB les-API og APAR: token bucket og adaptiv grense for samtidige kall
+
+- Token bucket begrenser antall kall per sekund (rate) med en gitt toppkapasitet (burst)
+- Grensen for samtidige kall justeres ut fra observert svartid og svar med 429 / 503 (AIMD):
+  økes med 1 etter en serie raske svar, halveres ved 429/503 eller ved svartid langt over normalen.
+  Normalen er laveste glidende snitt blant de siste svarene (latensvindu), og følger dermed med hvis
+  serveren blir varig tregere
+- Retry-After fra serveren overholdes: Alle kall i samme styrer venter til pausen er over, deretter
+  prøves kallet på nytt
+- status() gir gjeldende grenser, antall aktive kall og antall kall som står i kø
+
+De felles styrerne nvdb og apar brukes av alle som henter data fra hhv NVDB og APAR, slik at
+grensene gjelder samlet for hele prosessen
+
+Eksempel:
+    svarliste = trafikkstyring.apar.kartlegg( hentOperator, operatorId )
+"""
+import time
+import threading
+from collections import deque
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+class Trafikkstyrer:
+    """
+    Styrer kall mot ett API, se modulbeskrivelsen
+
+    KEYWORDS:
+        navn: Navn på styreren, brukes i utskrift
+
+        rate: Antall kall per sekund (token bucket)
+
+        burst: Maks antall kall som kan gjøres på rad uten å vente på nye tokens
+
+        samtidige: Startverdi for antall samtidige kall
+
+        minSamtidige, maksSamtidige: Grenser for antall samtidige kall
+
+        maksForsok: Antall forsøk per kall ved 429 / 503
+
+        latensvindu: Antall svar som normal svartid beregnes ut fra
+    """
+    def __init__( self, navn='API', rate=10.0, burst=20, samtidige=4, minSamtidige=1, maksSamtidige=16, maksForsok=5,
+                  latensvindu=50 ):
+        self.navn = navn
+        self.rate = float( rate )
+        self.maksRate = float( rate )
+        self.burst = burst
+        self.grense = samtidige
+        self.minSamtidige = minSamtidige
+        self.maksSamtidige = maksSamtidige
+        self.maksForsok = maksForsok
+
+        self._tokens = float( burst )
+        self._sistFylt = time.monotonic()
+        self._pauseTil = 0.0
+        self._aktive = 0
+        self._ventende = 0
+        self._latens = None        # Glidende snitt av svartid
+        self._sisteLatens = deque( maxlen=latensvindu )  # Glidende snitt for de siste svarene
+        self._okPaaRad = 0
+        self._betingelse = threading.Condition()
+        self.statistikk = { 'kall' : 0, 'struping' : 0 }
+
+    def status( self ) -> dict:
+        """
+        Gjeldende grenser og kø
+        """
+        with self._betingelse:
+            return { 'navn'         : self.navn,
+                     'rate'         : self.rate,
+                     'burst'        : self.burst,
+                     'samtidige'    : self.grense,
+                     'aktive'       : self._aktive,
+                     'kø'           : self._ventende,
+                     'latens'       : self._latens,
+                     'pause'        : max( 0.0, self._pauseTil - time.monotonic() ),
+                     **self.statistikk }
+
+    def _fyllTokens( self, naa ):
+        self._tokens = min( self.burst, self._tokens + ( naa - self._sistFylt ) * self.rate )
+        self._sistFylt = naa
+
+    def _hentPlass( self ):
+        """
+        Venter til vi har ledig plass for samtidige kall, ingen pause og en ledig token
+        """
+        with self._betingelse:
+            self._ventende += 1
+            try:
+                while True:
+                    naa = time.monotonic()
+                    self._fyllTokens( naa )
+                    if self._pauseTil > naa:
+                        self._betingelse.wait( self._pauseTil - naa )
+                    elif self._aktive >= self.grense:
+                        self._betingelse.wait( 1.0 )
+                    elif self._tokens < 1:
+                        self._betingelse.wait( ( 1 - self._tokens ) / self.rate )
+                    else:
+                        self._tokens -= 1
+                        self._aktive += 1
+                        return
+            finally:
+                self._ventende -= 1
+
+    def _frigi( self ):
+        with self._betingelse:
+            self._aktive -= 1
+            self._betingelse.notify_all()
+
+    def _registrerSvartid( self, sekunder ):
+        with self._betingelse:
+            self._latens = sekunder if self._latens is None else 0.8 * self._latens + 0.2 * sekunder
+            self._sisteLatens.append( self._latens )
+            normalLatens = min( self._sisteLatens )
+
+            if self._latens > 3 * normalLatens and self.grense > self.minSamtidige:
+                # Serveren blir tregere, vi trapper ned
+                self.grense = max( self.minSamtidige, self.grense // 2 )
+                self._okPaaRad = 0
+            else:
+                self._okPaaRad += 1
+                if self._okPaaRad >= 2 * self.grense:
+                    self._okPaaRad = 0
+                    self.grense = min( self.maksSamtidige, self.grense + 1 )
+                    self.rate = min( self.maksRate, self.rate * 1.1 )
+
+    def _registrerStruping( self, ventetid ):
+        with self._betingelse:
+            self.statistikk['struping'] += 1
+            self.grense = max( self.minSamtidige, self.grense // 2 )
+            self.rate = max( 0.1, self.rate / 2 )
+            self._okPaaRad = 0
+            self._pauseTil = max( self._pauseTil, time.monotonic() + ventetid )
+            self._betingelse.notify_all()
+        print( f"{self.navn}: Strupet av serveren, venter {ventetid:.1f} sekunder. {self.grense} samtidige, {self.rate:.1f} kall/s")
+
+    def utfor( self, funksjon, maalSvartid=True ):
+        """
+        Utfører funksjon (typisk et HTTP-kall) innenfor grensene. Ved svar 429 / 503 venter vi
+        (Retry-After, evt eksponentiell ventetid) og prøver på nytt inntil maksForsok
+
+        ARGUMENTS
+            funksjon: Funksjon uten argumenter. Hvis returverdien har status_code brukes den
+
+        KEYWORDS:
+            maalSvartid: True (default) | False. Bruk svartiden til å justere antall samtidige kall.
+                         Sett til False for langvarige kall, f.eks paginert nedlasting
+
+        RETURNS
+            Returverdien fra funksjon
+        """
+        for forsok in range( self.maksForsok ):
+            self._hentPlass()
+            t0 = time.monotonic()
+            try:
+                svar = funksjon()
+            finally:
+                self._frigi()
+            with self._betingelse:
+                self.statistikk['kall'] += 1
+
+            status_code = getattr( svar, 'status_code', None )
+            if status_code in ( 429, 503 ) and forsok < self.maksForsok - 1:
+                self._registrerStruping( ventetid( svar, forsok ) )
+                continue
+
+            if maalSvartid:
+                self._registrerSvartid( time.monotonic() - t0 )
+            return svar
+
+        return svar
+
+    def kartlegg( self, funksjon, elementer ):
+        """
+        Kjører funksjon på alle elementer i parallell, med maksSamtidige tråder. Funksjonen må selv
+        gjøre sine kall via utfor (f.eks via httpcache med styrer=), det er grensen i styreren som bestemmer
+        hvor mange kall som faktisk er aktive samtidig
+
+        RETURNS
+            Liste med resultater, i samme rekkefølge som elementer
+        """
+        with ThreadPoolExecutor( max_workers=self.maksSamtidige, thread_name_prefix=self.navn ) as pool:
+            return list( pool.map( funksjon, elementer ))
+
+    def kartleggStrom( self, funksjon, elementer, vindu=None ):
+        """
+        Som kartlegg, men resultatene gis etter hvert som de blir ferdige (generator, samme rekkefølge som
+        elementer). Høyst vindu elementer er startet uten at resultatet er hentet, slik at kun vindu
+        resultater holdes i minnet samtidig
+
+        KEYWORDS:
+            vindu: None (default, dvs maksSamtidige) eller maks antall resultater som er startet men ikke hentet
+
+        RETURNS
+            Generator med resultater, i samme rekkefølge som elementer
+        """
+        vindu = vindu or self.maksSamtidige
+        with ThreadPoolExecutor( max_workers=min( vindu, self.maksSamtidige ), thread_name_prefix=self.navn ) as pool:
+            underveis = deque()
+            for element in elementer:
+                if len( underveis ) >= vindu:
+                    yield underveis.popleft().result()
+                underveis.append( pool.submit( funksjon, element ))
+            while underveis:
+                yield underveis.popleft().result()
+
+def ventetid( svar, forsok ) -> float:
+    """
+    Ventetid ut fra Retry-After (sekunder eller HTTP-dato), ellers eksponentiell ventetid
+    """
+    retryAfter = None
+    headers = getattr( svar, 'headers', None )
+    if headers:
+        retryAfter = headers.get( 'Retry-After' )
+    if retryAfter:
+        try:
+            return max( 0.0, float( retryAfter ))
+        except ValueError:
+            try:
+                tidspunkt = parsedate_to_datetime( retryAfter )
+                return max( 0.0, ( tidspunkt - datetime.now( tidspunkt.tzinfo )).total_seconds() )
+            except ( TypeError, ValueError ):
+                pass
+    return min( 60.0, 2.0 ** forsok )
+
+# Felles styrere for hele prosessen
+nvdb = Trafikkstyrer( navn='NVDB', rate=20, burst=40, samtidige=4, maksSamtidige=16 )
+apar = Trafikkstyrer( navn='APAR', rate=5, burst=10, samtidige=2, maksSamtidige=8 )